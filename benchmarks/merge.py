@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Compares the pandas merge of logins and payments (outer merge, date round-trips, drop_duplicates, encoding) with
+# the merge on sorted integer keys, on synthetic extracts:
+#   python -m benchmarks.merge --users 500000
+
+import argparse
+import time
+
+from benchmarks.synthetic import generate
+from src.FrameEncoder import encode_frame, memory_usage
+from src.Merge import merge_extracts, merge_encoded, number_payments
+from src.StateEngine import REGIONS
+
+
+def before(logins, payments):
+    return encode_frame(merge_extracts(logins, payments), REGIONS)
+
+
+def after(logins, payments):
+    return merge_encoded(logins, payments, REGIONS)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=500000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    logins, payments = generate(args.users)
+    payments = number_payments(payments)
+    print("logins {} rows ({:.1f} MB), payments {} rows ({:.1f} MB)".format(
+        len(logins), memory_usage(logins) / 1024 ** 2, len(payments), memory_usage(payments) / 1024 ** 2
+    ))
+
+    for name, function in (("pandas merge", before), ("integer keys", after)):
+        timings = []
+
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            encoded = function(logins, payments)
+            timings.append(time.perf_counter() - start)
+
+        in_regions = (encoded.data["region"] < len(REGIONS)).sum()
+
+        print("{:<14} best {:8.3f} s   mean {:8.3f} s   {} rows in regions".format(
+            name, min(timings), sum(timings) / len(timings), in_regions
+        ))
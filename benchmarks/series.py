@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Compares the ways of building `core_state_series` on a dump of the merged frame (`new_df`):
+#   python -m benchmarks.series /path/to/new_df.pkl --start 2019-07-01 --end 2019-07-31
+
+import argparse
+import time
+
+import pandas as pd
+
+from src.FrameEncoder import encode_frame
+from src.RegionFrames import RegionFrames
+from src.StateEngine import StateEngine, REGIONS
+from src import RegionStateFunctions, StateFunctions
+
+
+def reference(new_df, frames, days):
+    return pd.concat(
+        [StateFunctions.create_series(new_df, now, region) for region in REGIONS for now in days.to_pydatetime()],
+        ignore_index=True
+    )
+
+
+def per_function(new_df, frames, days):
+    return pd.concat(
+        [RegionStateFunctions.create_series(frames, now, region) for region in REGIONS for now in days.to_pydatetime()],
+        ignore_index=True
+    )
+
+
+def combined(new_df, frames, days):
+    return pd.concat(
+        [
+            RegionStateFunctions.calculate_series(frames, now, region)
+            for region in REGIONS for now in days.to_pydatetime()
+        ],
+        ignore_index=True
+    )
+
+
+def engine(new_df, frames, days):
+    return StateEngine(frames).series(days)
+
+
+def normalized(df):
+    return df.astype({"users_count": "int64"}).sort_values(["region", "date_state", "state"]).reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", help="pickle or parquet dump of the merged frame")
+    parser.add_argument("--start", required=True)
+    parser.add_argument("--end", required=True)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    new_df = pd.read_parquet(args.path) if args.path.endswith(".parquet") else pd.read_pickle(args.path)
+    frames = RegionFrames(encode_frame(new_df, REGIONS))
+    days = pd.date_range(args.start, args.end)
+
+    results = {}
+
+    for name, function in (
+            ("reference", reference), ("per-function", per_function), ("combined", combined), ("engine", engine)
+    ):
+        timings = []
+
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            results[name] = normalized(function(new_df, frames, days))
+            timings.append(time.perf_counter() - start)
+
+        print("{:<14} best {:8.3f} s   mean {:8.3f} s".format(name, min(timings), sum(timings) / len(timings)))
+
+    for name, result in results.items():
+        print("{:<14} same as reference: {}".format(name, result.equals(results["reference"])))
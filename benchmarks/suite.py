@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Times every stage of the ETL on synthetic extracts of several sizes and writes a JSON report, which can be compared
+# with a report of another revision:
+#   python -m benchmarks.suite --sizes 10000,100000 --output after.json --compare before.json
+# Uploads are timed only with --db-config, they upsert into the real tables of that database, use a scratch one.
+
+import argparse
+import datetime as dt
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from benchmarks.synthetic import generate
+from src.Extractor import Extractor
+from src.FrameEncoder import encode_frame
+from src.Merge import merge_extracts, merge_encoded, number_payments
+from src.RegionFrames import RegionFrames
+from src.StateEngine import StateEngine, REGIONS
+from src import RegionStateFunctions, StateFunctions
+
+
+TODAY = dt.date(2019, 7, 20)
+
+
+def timed(function, repeat):
+    """Runs the function `repeat` times, returns its last result and the best and mean wall times"""
+
+    timings = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+
+    return result, {"best": min(timings), "mean": sum(timings) / len(timings)}
+
+
+def per_cell(function, frames, days):
+    return pd.concat(
+        [function(frames, now, region) for region in REGIONS for now in days.to_pydatetime()], ignore_index=True
+    )
+
+
+def extract(directory, logins, payments):
+    """Extraction stand-in: both extracts are read back from Parquet concurrently, as `Extractor` runs the queries"""
+
+    logins_path = os.path.join(directory, "logins.parquet")
+    payments_path = os.path.join(directory, "payments.parquet")
+    logins.to_parquet(logins_path, index=False)
+    payments.to_parquet(payments_path, index=False)
+
+    return lambda: Extractor({
+        "logins": lambda: pd.read_parquet(logins_path),
+        "payments": lambda: pd.read_parquet(payments_path),
+    }).extract()
+
+
+def benchmark(users, days, repeat, data_loader=None, modes=()):
+    logins, payments = generate(users, today=TODAY)
+    timings = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        _, timings["extract"] = timed(extract(directory, logins, payments), repeat)
+
+    payments = number_payments(payments)
+
+    new_df = merge_extracts(logins, payments)
+    _, timings["merge_pandas"] = timed(lambda: encode_frame(merge_extracts(logins, payments), REGIONS), repeat)
+    encoded, timings["merge_encoded"] = timed(lambda: merge_encoded(logins, payments, REGIONS), repeat)
+
+    frames = RegionFrames(encoded)
+    engine = StateEngine(frames)
+
+    # the cohort-by-cohort functions fail on empty cohorts, small sizes may not have a timing for them
+    try:
+        _, timings["reference_matrix"] = timed(lambda: per_cell(StateFunctions.create_matrix, new_df, days), repeat)
+        _, timings["create_matrix"] = timed(lambda: per_cell(RegionStateFunctions.create_matrix, frames, days), repeat)
+    except ZeroDivisionError:
+        pass
+
+    _, timings["calculate_matrix"] = timed(
+        lambda: per_cell(RegionStateFunctions.calculate_matrix, frames, days), repeat
+    )
+    matrix, timings["engine_matrix"] = timed(lambda: engine.matrix(days), repeat)
+    _, timings["reference_series"] = timed(lambda: per_cell(StateFunctions.create_series, new_df, days), repeat)
+    _, timings["create_series"] = timed(lambda: per_cell(RegionStateFunctions.create_series, frames, days), repeat)
+    _, timings["calculate_series"] = timed(
+        lambda: per_cell(RegionStateFunctions.calculate_series, frames, days), repeat
+    )
+    series, timings["engine_series"] = timed(lambda: engine.series(days), repeat)
+
+    for mode in modes:
+        def upload():
+            return data_loader.upload_data("core_state_series", series, mode=mode) \
+                and data_loader.upload_data("core_migration_matrix", matrix, mode=mode)
+
+        ok, timings["upload_" + mode] = timed(upload, repeat)
+        timings["upload_" + mode]["ok"] = bool(ok)
+
+    return {
+        "users": users,
+        "logins": len(logins),
+        "payments": len(payments),
+        "days": len(days),
+        "series_rows": len(series),
+        "matrix_rows": len(matrix),
+        "timings": timings,
+    }
+
+
+def compare(report, previous):
+    """Prints best times of the report next to the ones of the previous report for the same sizes"""
+
+    before = {size["users"]: size["timings"] for size in previous["sizes"]}
+
+    for size in report["sizes"]:
+        if size["users"] not in before:
+            continue
+
+        print("{} users".format(size["users"]))
+
+        for name, timing in size["timings"].items():
+            if name not in before[size["users"]]:
+                continue
+
+            old = before[size["users"]][name]["best"]
+            print("  {:<18} {:8.3f} s -> {:8.3f} s   x{:.2f}".format(
+                name, old, timing["best"], old / timing["best"] if timing["best"] else float("nan")
+            ))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10000,100000", help="comma-separated numbers of users")
+    parser.add_argument("--days", type=int, default=7, help="number of `date_state` days")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", help="previous report to compare with")
+    parser.add_argument("--db-config", help="config with the Postgres section, uploads aren't timed without it")
+    parser.add_argument("--db-section", default="postgres")
+    parser.add_argument("--modes", default="insert,copy,values", help="upload modes to time")
+    args = parser.parse_args()
+
+    data_loader, modes = None, ()
+
+    if args.db_config:
+        from bogoslovskiy.model import ConfigWorker
+        from bogoslovskiy.model.db.Implementation import InHouseDbWorker
+        from src.PortgesDataLoader import PostgresDataLoader
+
+        data_loader = PostgresDataLoader(InHouseDbWorker(ConfigWorker(args.db_config), args.db_section))
+        modes = tuple(args.modes.split(","))
+
+    days = pd.date_range(end=TODAY - dt.timedelta(days=8), periods=args.days)
+
+    report = {
+        "created": dt.datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "pandas": pd.__version__,
+        "days": args.days,
+        "repeat": args.repeat,
+        "sizes": [],
+    }
+
+    for users in map(int, args.sizes.split(",")):
+        size = benchmark(users, days, args.repeat, data_loader, modes)
+        report["sizes"].append(size)
+
+        print("{} users, {} logins, {} payments".format(size["users"], size["logins"], size["payments"]))
+
+        for name, timing in size["timings"].items():
+            print("  {:<18} best {:8.3f} s   mean {:8.3f} s".format(name, timing["best"], timing["mean"]))
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Deterministic synthetic extracts shaped like the results of `src.Queries.logins_query` and
+# `src.Queries.payments_query`:
+#   python -m benchmarks.synthetic /tmp/synthetic --users 100000
+
+import argparse
+import datetime as dt
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# share of users per region, None are users of other mirrors
+REGION_SHARES = {"cis": .5, "asia": .3, "latam": .15, None: .05}
+
+
+def dates(days):
+    """Day numbers since epoch -> datetime.date objects, as the database drivers return them"""
+
+    return pd.to_datetime(days, unit="D").date
+
+
+def generate(
+        n_users,
+        today=dt.date(2019, 7, 20),
+        region_shares=None,
+        login_rate=.3,
+        payer_share=.3,
+        payment_rate=.05,
+        login_days=30,
+        payment_days=180,
+        registration_days=400,
+        seed=0,
+):
+    """Generates users, their logins and payment orders
+
+    Args:
+        n_users: number of users
+        today: day of the run, logins are since `today - login_days`, payments since `today - payment_days`
+        region_shares: share of users per region, `REGION_SHARES` by default
+        login_rate: probability of a user to log in on a day
+        payer_share: share of users who ever pay
+        payment_rate: probability of a payer to pay on a day
+        login_days: days of logins
+        payment_days: days of payments
+        registration_days: users are registered during these days before `today`
+        seed: seed of the random generator, the same arguments give the same data
+
+    Returns:
+        (logins, payments): frames with the columns of the logins and the payments queries, payments are ordered by
+            `id_user` and `po_date` as the payments query orders them
+
+    """
+
+    rng = np.random.default_rng(seed)
+    shares = region_shares or REGION_SHARES
+    today = (today - dt.date(1970, 1, 1)).days
+
+    ids = rng.choice(10 ** 9, n_users, replace=False).astype(np.int64)
+    regions = np.array(list(shares), dtype=object)[
+        rng.choice(len(shares), n_users, p=np.array(list(shares.values())) / sum(shares.values()))
+    ]
+    created = today - rng.integers(0, registration_days, n_users)
+
+    # every user logs in on a binomial number of random days of the window, not before the registration
+    counts = rng.binomial(login_days + 1, login_rate, n_users)
+    user = np.repeat(np.arange(n_users), counts)
+    day = np.maximum(today - rng.integers(0, login_days + 1, len(user)), created[user])
+
+    logins = pd.DataFrame({
+        "id_user": ids[user],
+        "u_date_created": dates(created[user]),
+        "date": dates(day),
+        "region": regions[user],
+    }).drop_duplicates(["id_user", "date"], ignore_index=True)
+
+    payers = np.flatnonzero(rng.random(n_users) < payer_share)
+    counts = rng.binomial(payment_days + 1, payment_rate, len(payers))
+    user = np.repeat(payers, counts)
+    day = np.maximum(today - rng.integers(0, payment_days + 1, len(user)), created[user])
+
+    payments = pd.DataFrame({
+        "id_user": ids[user],
+        "po_date": day,
+        "region": regions[user],
+    }).drop_duplicates(["id_user", "po_date"]).sort_values(["id_user", "po_date"], ignore_index=True)
+    payments["po_date"] = dates(payments["po_date"].values)
+
+    return logins, payments
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory", help="where to write logins.parquet and payments.parquet")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--login-rate", type=float, default=.3)
+    parser.add_argument("--payer-share", type=float, default=.3)
+    parser.add_argument("--payment-rate", type=float, default=.05)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logins, payments = generate(
+        args.users, login_rate=args.login_rate, payer_share=args.payer_share, payment_rate=args.payment_rate,
+        seed=args.seed
+    )
+
+    os.makedirs(args.directory, exist_ok=True)
+    logins.to_parquet(os.path.join(args.directory, "logins.parquet"), index=False)
+    payments.to_parquet(os.path.join(args.directory, "payments.parquet"), index=False)
+
+    print("{} logins, {} payments written to {}".format(len(logins), len(payments), args.directory))
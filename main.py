@@ -1,35 +1,143 @@
 #!/usr/bin/env python
 # coding: utf-8
 
-# TODO: synchronous logging (in Docker logs are written in batched and you cannot view them in real time)
-
 from datetime import timedelta
 import datetime as dt
+import atexit
+import configparser
 import logging
+import os
+import sys
 
 import pandas as pd
 
 from bogoslovskiy.model import ConfigWorker
 from bogoslovskiy.model.db.Implementation import InHouseDbWorker, BigQueryWorker
 from src.PortgesDataLoader import PostgresDataLoader
-
-# file handler
+from src.BufferedDataLoader import BufferedDataLoader
+from src.RegionFrames import RegionFrames
+from src.StateEngine import StateEngine, REGIONS
+from src.RollingStateEngine import RollingStateEngine
+from src.ParallelExecutor import ParallelExecutor
+from src.Extractor import Extractor
+from src.Queries import payments_query, logins_query
+from src.ExtractCache import ExtractCache
+from src.Watermark import IncrementalExtract, FileWatermarkStore, PostgresWatermarkStore
+from src.StreamingExtractor import LoginsStream
+from src.SqlStateBackend import SqlStateBackend, check_parity
+from src.Merge import number_payments, merge_encoded
+from src.Backfill import Backfill, LOOK_BACK, PAYMENTS_LOOK_BACK
+from src.Pipeline import Pipeline
+from src.Profiler import Profiler, CallProfiler
+from src.QueueLogging import QueueLogging, Progress
+from src.CellCheckpoint import FailedCells, CellCheckpoints, compute_cells
+
+# matrix cells are computed by this many processes, 1 keeps the calculation in the main process; region frames are
+# shared with the workers through memory-mapped files in ETL_SHARED_DIR (e.g. /dev/shm, system temp dir by default)
+WORKERS: int = int(os.environ.get("ETL_WORKERS", "1"))
+SHARED_DIR: str = os.environ.get("ETL_SHARED_DIR") or None
+
+# workers are forked before any thread of the job is started, beginning with the log writers below
+parallel_executor = ParallelExecutor(WORKERS, SHARED_DIR).start() if WORKERS > 1 else None
+
+# records are queued and written by separate threads: INFO and above to stdout (flushed at once), DEBUG and above
+# to the file
 filepath: str = "/logging/etl_retention.log"
-fh = logging.FileHandler(filepath)
-fh.setLevel(logging.DEBUG)
-
-# stream handler
-ch = logging.StreamHandler()
-ch.setLevel(logging.INFO)
+queue_logging = QueueLogging(filepath, stream_level=logging.INFO, file_level=logging.DEBUG)
+queue_logging.start()
+atexit.register(queue_logging.stop)
+
+if parallel_executor is not None:
+    # workers exit before the log writers, so their last records are written
+    atexit.register(parallel_executor.stop)
+
+DB_CONFIG: str = "/configs/db.ini"
+db_cw = ConfigWorker(DB_CONFIG)
+
+# upload mode for `PostgresDataLoader.upload_data`: "insert" (literal INSERT query), "copy" (COPY into temp table)
+# or "values" (parameterized pages of UPLOAD_PAGE_SIZE rows)
+UPLOAD_MODE: str = os.environ.get("ETL_UPLOAD_MODE", "copy")
+UPLOAD_PAGE_SIZE: int = int(os.environ.get("ETL_UPLOAD_PAGE_SIZE", "1000"))
+
+# buffered uploads are flushed in one transaction after this many rows
+UPLOAD_BUFFER_ROWS: int = int(os.environ.get("ETL_UPLOAD_BUFFER_ROWS", "100000"))
+
+# states calculation: "batch" (all days at once), "rolling" (windows slid day by day, for long backfills) or "sql"
+# (in BigQuery over payments staged into ETL_SQL_PAYMENTS_TABLE, ETL_SQL_PARITY_CHECK=1 compares it with "batch");
+# backfills use "rolling" or "batch" ("batch" for "sql"), "rolling" pays off with ETL_BACKFILL_CHUNK_DAYS of weeks
+STATE_ENGINE: str = os.environ.get("ETL_STATE_ENGINE", "batch")
+SQL_PAYMENTS_TABLE: str = os.environ.get("ETL_SQL_PAYMENTS_TABLE", "etl_retention.payments")
+SQL_PARITY_CHECK: bool = os.environ.get("ETL_SQL_PARITY_CHECK", "0") == "1"
+
+# raw extracts are cached as daily Parquet partitions in ETL_CACHE_DIR (no cache if empty), the latest
+# ETL_CACHE_REFRESH_DAYS days of logins are always extracted again. Payments count by their current status, which can
+# change after the order is created, so the latest ETL_CACHE_PAYMENTS_REFRESH_DAYS days of them are extracted again;
+# orders that reach a paid status later than that stay missing from the cache (and `num` of later payments of the
+# user is off) until it is dropped
+CACHE_DIR: str = os.environ.get("ETL_CACHE_DIR") or None
+CACHE_REFRESH_DAYS: int = int(os.environ.get("ETL_CACHE_REFRESH_DAYS", "2"))
+CACHE_PAYMENTS_REFRESH_DAYS: int = int(os.environ.get("ETL_CACHE_PAYMENTS_REFRESH_DAYS", "14"))
+
+# with the cache, only rows created after the previous extraction (minus ETL_WATERMARK_OVERLAP_HOURS) are extracted;
+# marks are kept in "file" (ETL_WATERMARK_FILE) or "postgres" (table `etl_watermark`), empty turns it off. Payments
+# are found by creation time, ones paid after the mark passed their creation are missed until the cache is rebuilt
+WATERMARK_STORE: str = os.environ.get("ETL_WATERMARK_STORE", "")
+WATERMARK_FILE: str = os.environ.get("ETL_WATERMARK_FILE", "/logging/watermarks.json")
+WATERMARK_OVERLAP_HOURS: int = int(os.environ.get("ETL_WATERMARK_OVERLAP_HOURS", "6"))
+
+# without the cache, logins can be read from BigQuery in pages of ETL_STREAM_PAGE_SIZE rows folded into compact
+# arrays, the run fails instead of the container being killed when they exceed ETL_STREAM_MAX_MB
+STREAM_LOGINS: bool = os.environ.get("ETL_STREAM_LOGINS", "0") == "1"
+STREAM_PAGE_SIZE: int = int(os.environ.get("ETL_STREAM_PAGE_SIZE", "50000"))
+STREAM_MAX_MB: int = int(os.environ.get("ETL_STREAM_MAX_MB", "1024"))
+
+# matrix and series are computed in chunks of ETL_PIPELINE_CHUNK_DAYS days, at most ETL_PIPELINE_QUEUE_SIZE computed
+# chunks wait for upload
+PIPELINE_CHUNK_DAYS: int = int(os.environ.get("ETL_PIPELINE_CHUNK_DAYS", "7"))
+PIPELINE_QUEUE_SIZE: int = int(os.environ.get("ETL_PIPELINE_QUEUE_SIZE", "2"))
+
+# (table, region, date_state) cells that failed are skipped and saved into ETL_FAILED_CELLS, the next run computes
+# them again
+FAILED_CELLS: str = os.environ.get("ETL_FAILED_CELLS", "/logging/failed_cells.json")
+
+# completed (table, region, date_state) cells are checkpointed in ETL_CHECKPOINTS_TABLE (created by the first run)
+# together with their rows; a run computes the days after every region's last checkpoint and cells missing during
+# the last ETL_RESUME_DAYS days
+CHECKPOINTS_TABLE: str = os.environ.get("ETL_CHECKPOINTS_TABLE", "etl_cells")
+RESUME_DAYS: int = int(os.environ.get("ETL_RESUME_DAYS", "14"))
+
+# backfill of `date_state` days in [ETL_BACKFILL_START, ETL_BACKFILL_END] instead of the daily run, in partitions of
+# ETL_BACKFILL_CHUNK_DAYS days; a restarted backfill of the same range resumes from checkpoints in ETL_BACKFILL_STATE
+BACKFILL_START: str = os.environ.get("ETL_BACKFILL_START", "")
+BACKFILL_END: str = os.environ.get("ETL_BACKFILL_END", str(dt.date.today() - timedelta(days=8)))
+BACKFILL_CHUNK_DAYS: int = int(os.environ.get("ETL_BACKFILL_CHUNK_DAYS", "7"))
+BACKFILL_STATE: str = os.environ.get("ETL_BACKFILL_STATE", "/logging/backfill.json")
+
+# wall time, CPU time, peak RSS and rows of every stage are appended as JSON lines to ETL_PROFILE_FILE (empty turns
+# it off); with ETL_CPROFILE_FILE the whole job runs under cProfile and its statistics are saved there (pstats format)
+PROFILE_FILE: str = os.environ.get("ETL_PROFILE_FILE", "/logging/etl_profile.jsonl")
+CPROFILE_FILE: str = os.environ.get("ETL_CPROFILE_FILE", "")
+
+profiler = Profiler(PROFILE_FILE or None)
+
+if CPROFILE_FILE:
+    call_profiler = CallProfiler(CPROFILE_FILE)
+    call_profiler.start()
+    atexit.register(call_profiler.stop)
+
+
+def profiled(stage, function, **fields):
+    """Wraps a function returning a frame, so every call is recorded as `stage`"""
+
+    def run(*args):
+        with profiler.stage(stage, **fields) as record:
+            data = function(*args)
+            record.rows = len(data)
+
+        return data
+
+    return run
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(levelname)-8s%(asctime)s        %(module)-25.25s %(message)s \n",
-    datefmt="%Y-%m-%d %H:%M:%S",
-    handlers=(fh, ch,)
-)
-
-db_cw = ConfigWorker("/configs/db.ini")
 
 # --------------------------------------------------------------------------------------------------------------------
 #                                                   DATABASE
@@ -39,455 +147,259 @@ logging.debug("Database objects initialization")
 bq = BigQueryWorker(db_cw, "bigquery")
 monolith = InHouseDbWorker(db_cw, "monolith")
 postgres = InHouseDbWorker(db_cw, "postgres")
-data_loader = PostgresDataLoader(postgres)
+data_loader = PostgresDataLoader(postgres, page_size=UPLOAD_PAGE_SIZE, profiler=profiler)
 
-# --------------------------------------------------------------------------------------------------------------------
-#                                                   CALCULATION
-# --------------------------------------------------------------------------------------------------------------------
-ld = postgres.get_iterable("select max(date_state) from core_state_series").fetchone()[0]
-ld = ld if ld else dt.date.today() - timedelta(days=9)
-
-ld_matrix = postgres.get_iterable("select max(date_state) from core_migration_matrix").fetchone()[0]
-ld_matrix = ld_matrix if ld_matrix else dt.date.today() - timedelta(days=9)
-
-last_date_matrix = pd.to_datetime(ld_matrix).date()
-
-period = dt.date.today() - timedelta(days=30)
-half_year_period = dt.date.today() - timedelta(days=180)
-
-logging.debug("Payments query")
-df_payments_full = monolith.get_dataframe(
-    """
-    select distinct 
-        id_user, 
-        date(po.date_created) as po_date, 
-        case 
-            when u.id_mirror in (1, 11, 14, 17, 20, 29,  30, 31, 32, 35, 37, 38, 40, 42, 43, 45) then 'cis' 
-            when u.id_mirror in (23, 26, 39, 44, 46, 47, 48, 49) then 'asia' 
-            when u.id_mirror = 41 then 'latam' 
-        end as region
-    from 
-        x27_payment_orders po
-    join 
-        x27_users u on u.id = po.id_user
-    where 1=1
-        and po.date_created >= '{}'
-        and po.code_package not in ('code', 'learn', 'test')
-        and po.id_status in (3, 18, 21)
-        and u.id_partner not in ('-1', '1', '2', '3', '4', '5', 'mikula', 'tech_vb_test')
-    order by id_user, po_date asc
-    """.format(str(half_year_period))
-)
-
-df_payments_full['num'] = df_payments_full.groupby('id_user').cumcount() + 1
-df_payments_full['po_date'] = pd.to_datetime(df_payments_full['po_date']).dt.date
-
-logging.debug("Logins query")
-df = bq.get_dataframe(
-    """
-        WITH users AS (
-          SELECT 
-            id, 
-            date_created, 
-            id_mirror 
-          FROM 
-            product.db_users 
-          WHERE 1=1
-              AND id_partner not in ('-1', '1', '2', '3', '4', '5', 'mikula', 'tech_vb_test', 'test')
-              AND gender = 'male'
-              -- AND (id_blocked is NULL or id_blocked = 0) 
-        ),
 
-        logins AS (
-          SELECT 
-            id_user, 
-            date_created 
-          FROM 
-            product.users_logins 
-          WHERE 1=1
-            AND date_created >= TIMESTAMP('{}')
-        )
-
-
-        select distinct 
-            u.id as id_user, 
-            date(u.date_created) as u_date_created,
-            date(e.date_created) as date, 
-            case 
-                when u.id_mirror in (1, 11, 14, 17, 20, 29,  30, 31, 32, 35, 37, 38, 40, 42, 43, 45) then 'cis' 
-                when u.id_mirror in (23, 26, 39, 44, 46, 47, 48, 49) then 'asia' 
-                when u.id_mirror = 41 then 'latam' 
-            end as region
-        from 
-           logins e
-        inner join 
-            users u on u.id = e.id_user
-    """.format(str(period))
-)
-
-logging.debug("Transformation")
-df['date'] = pd.to_datetime(df['date']).dt.date
-new_df = pd.merge(df, df_payments_full, how='outer', left_on=['id_user', 'date', 'region'], right_on=['id_user', 'po_date', 'region'])
-new_df['po_date'] = pd.to_datetime(new_df['po_date']).dt.date
-new_df['date'] = pd.to_datetime(new_df['date']).dt.date
-new_df['u_date_created'] = pd.to_datetime(new_df['u_date_created']).dt.date
-new_df = new_df.drop_duplicates()
+def bigquery_client(section="bigquery"):
+    """`google.cloud.bigquery.Client` of the project and credentials of the config section `bq` is created from
+    (`project`, `credentials` - service account key, GOOGLE_APPLICATION_CREDENTIALS if it isn't set) for the calls
+    `bq` doesn't cover: streamed results, loads and the states queries over staged payments"""
+
+    from google.cloud import bigquery
+
+    config = configparser.ConfigParser()
+    config.read(DB_CONFIG)
+    options = config[section] if config.has_section(section) else {}
+
+    project = options.get("project") or None
+    credentials = options.get("credentials") or os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
+
+    if credentials:
+        return bigquery.Client.from_service_account_json(credentials, project=project)
+
+    return bigquery.Client(project=project)
 
 
 # --------------------------------------------------------------------------------------------------------------------
-#                                                   MATRIX
+#                                                   BACKFILL
 # --------------------------------------------------------------------------------------------------------------------
-def new_ns_validator(now, region):
-    matrix = pd.DataFrame()
-
-    now = now.date()
-    _7days_ago = (now - timedelta(days=6))
-    _7days_after = (now + timedelta(days=7))
+checkpoints = CellCheckpoints(postgres, CHECKPOINTS_TABLE)
+checkpoints.create()
+
+if BACKFILL_START:
+    logging.debug("Backfill")
+    Backfill(
+        profiled("extract", lambda since, until: bq.get_dataframe(logins_query(since, until)), source="logins"),
+        profiled(
+            "extract", lambda since, until: monolith.get_dataframe(payments_query(since, until)), source="payments"
+        ),
+        data_loader, FileWatermarkStore(BACKFILL_STATE), BACKFILL_CHUNK_DAYS, UPLOAD_MODE, profiler, checkpoints,
+        RollingStateEngine if STATE_ENGINE == "rolling" else StateEngine
+    ).run(pd.to_datetime(BACKFILL_START).date(), pd.to_datetime(BACKFILL_END).date())
 
-    new_df_region = new_df[new_df['region'] == region]
+    sys.exit(0)
 
-    had_payments = set(
-        new_df_region[
-            (new_df_region.po_date <= now) &
-            (new_df_region.num >= 1)
-            ]["id_user"]
+# --------------------------------------------------------------------------------------------------------------------
+#                                                   CALCULATION
+# --------------------------------------------------------------------------------------------------------------------
+failed = FailedCells(FAILED_CELLS)
+
+# (days, regions) of cells to compute by table, the last days of the matrix wait for their next week
+ends = {
+    "core_migration_matrix": dt.date.today() - timedelta(days=8),
+    "core_state_series": dt.date.today() - timedelta(days=1),
+}
+plans = {}
+
+for table, end in ends.items():
+    checkpoints.seed(table)
+    plans[table] = checkpoints.plan(
+        table, REGIONS, end, RESUME_DAYS, dt.date.today() - timedelta(days=9), PIPELINE_CHUNK_DAYS
     )
 
-    date_created = set(
-        new_df_region[
-            (new_df_region['u_date_created'] >= _7days_ago) &
-            (new_df_region['u_date_created'] <= now)
-            ]["id_user"]
-    )
+if not any(plans.values()):
+    logging.info("All cells are completed, nothing to compute")
+    sys.exit(0)
 
-    res = date_created.difference(had_payments)
+# logins are extracted from the look-back of the first planned day and payments are numbered from half a year before
+# it, as by the backfill, so no planned cell is computed over cut-off data
+first_planned = min(days[0].date() for table_plans in plans.values() for days, _ in table_plans)
+period = first_planned - timedelta(days=LOOK_BACK)
+half_year_period = first_planned - timedelta(days=PAYMENTS_LOOK_BACK)
 
-    df_temp = new_df_region[
-        (new_df_region['date'] > now) &
-        (new_df_region['date'] <= _7days_after) &
-        (new_df_region["id_user"].isin(res))
-        ]
+for table, end in ends.items():
+    # failed cells checkpointed since then (e.g. by a backfill) are forgotten
+    failed_days = failed.cells(table)
 
-    more_than_1_pymnt = set(
-        df_temp[df_temp.num > 1]['id_user']
-    )
+    if failed_days:
+        completed = checkpoints.completed(table, min(days[0] for days in failed_days.values()))
+        failed.remove(table, [
+            (region, day) for region, days in failed_days.items() for day in days if day in completed.get(region, ())
+        ])
 
-    only_1_pymnt = (set(df_temp[df_temp.num == 1]['id_user'])).difference(more_than_1_pymnt)
-
-    matrix.loc['new_ns', 'active_ns'] = len(
-        set(df_temp['id_user']).difference(set(df_temp[df_temp.num >= 1]['id_user']))) / len(res) * 100
-
-    matrix.loc['new_ns', 'churn_ns'] = (len(res) - len(set(df_temp['id_user']))) / len(res) * 100
-
-    matrix.loc['new_ns', 'new_spenders'] = len(only_1_pymnt) / len(res) * 100
-
-    matrix.loc['new_ns', 'active_spenders'] = len(set(df_temp[df_temp.num > 1]['id_user'])) / len(res) * 100
-
-    return matrix
-
-
-def active_ns_validator(now, region):
-    matrix = pd.DataFrame()
-    now = now.date()
-    new_df_region = new_df[new_df['region'] == region]
-    _7days_ago = (now - timedelta(days=6))
-    had_payments = set(new_df_region[(new_df_region.po_date <= now) & (new_df_region.num >= 1)].id_user)
-    login_and_date_created = set(new_df_region[
-                                     (new_df_region['date'] >= _7days_ago) & (new_df_region['date'] <= now) & (
-                                                 new_df_region['u_date_created'] < _7days_ago)].id_user)
-    res = login_and_date_created.difference(had_payments)
-    _7days_after = (now + timedelta(days=7))
-    df_temp = pd.DataFrame()
-    df_temp = new_df_region[
-        (new_df_region['date'] > now) & (new_df_region['date'] <= _7days_after) & (new_df_region.id_user.isin(res))]
-    more_than_1_pymnt = set(df_temp[df_temp.num > 1]['id_user'])
-    only_1_pymnt = (set(df_temp[df_temp.num == 1]['id_user'])).difference(more_than_1_pymnt)
-    matrix.loc['active_ns', 'active_ns'] = len(
-        set(df_temp['id_user']).difference(set(df_temp[df_temp.num >= 1]['id_user']))) / len(res) * 100
-    matrix.loc['active_ns', 'churn_ns'] = (len(res) - len(set(df_temp['id_user']))) / len(res) * 100
-    matrix.loc['active_ns', 'new_spenders'] = len(only_1_pymnt) / len(res) * 100
-    matrix.loc['active_ns', 'active_spenders'] = len(set(df_temp[df_temp.num > 1]['id_user'])) / len(res) * 100
-    return matrix
-
-
-def churn_ns_validator(now, region):
-    matrix = pd.DataFrame()
-    now = now.date()
-    new_df_region = new_df[new_df['region'] == region]
-    _7days_ago = (now - timedelta(days=6))
-    _30days_ago = (now - timedelta(days=29))
-    had_payments = set(new_df_region[(new_df_region.po_date <= now) & (new_df_region.num >= 1)].id_user)
-    login_last_month = set(
-        new_df_region[(new_df_region['date'] >= _30days_ago) & (new_df_region['date'] < _7days_ago)].id_user)
-    login_last_week = set(new_df_region[(new_df_region['date'] >= _7days_ago) & (new_df_region['date'] <= now)].id_user)
-    date_created_no_payments = login_last_month.difference(had_payments)
-    res = date_created_no_payments.difference(login_last_week)
-    _7days_after = (now + timedelta(days=7))
-    df_temp = pd.DataFrame()
-    df_temp = new_df_region[
-        (new_df_region['date'] > now) & (new_df_region['date'] <= _7days_after) & (new_df_region.id_user.isin(res))]
-    more_than_1_pymnt = set(df_temp[df_temp.num > 1]['id_user'])
-    only_1_pymnt = (set(df_temp[df_temp.num == 1]['id_user'])).difference(more_than_1_pymnt)
-    matrix.loc['churn_ns', 'active_ns'] = len(
-        set(df_temp['id_user']).difference(set(df_temp[df_temp.num >= 1]['id_user']))) / len(res) * 100
-    matrix.loc['churn_ns', 'churn_ns'] = (len(res) - len(set(df_temp['id_user']))) / len(res) * 100
-    matrix.loc['churn_ns', 'new_spenders'] = len(only_1_pymnt) / len(res) * 100
-    matrix.loc['churn_ns', 'active_spenders'] = len(set(df_temp[df_temp.num > 1]['id_user'])) / len(res) * 100
-    return matrix
-
-
-def new_spenders_validator(now, region):
-    matrix = pd.DataFrame()
-    now = now.date()
-    new_df_region = new_df[new_df['region'] == region]
-    _7days_ago = (now - timedelta(days=6))
-    count_1 = set(new_df_region[(new_df_region.po_date >= _7days_ago) & (new_df_region.po_date <= now) & (
-                new_df_region.num == 1)].id_user)
-    count_more = set(new_df_region[(new_df_region.po_date >= _7days_ago) & (new_df_region.po_date <= now) & (
-                new_df_region.num > 1)].id_user)
-    res = count_1.difference(count_more)
-    _7days_after = (now + timedelta(days=7))
-    df_temp = pd.DataFrame()
-    df_temp = new_df_region[
-        (new_df_region['date'] > now) & (new_df_region['date'] <= _7days_after) & (new_df_region.id_user.isin(res))]
-    more_payments = set(df_temp[(df_temp.num > 1)].id_user)
-    login = set(df_temp['id_user'])
-    matrix.loc['new_spenders', 'churn_spenders'] = (len(res) - len(set(df_temp['id_user']))) / len(res) * 100
-    matrix.loc['new_spenders', 'active_users'] = len(login.difference(more_payments)) / len(res) * 100
-    matrix.loc['new_spenders', 'active_spenders'] = len(set(df_temp[df_temp.num > 1]['id_user'])) / len(res) * 100
-    return matrix
-
-
-def active_spenders_validator(now, region):
-    matrix = pd.DataFrame()
-    now = now.date()
-    new_df_region = new_df[new_df['region'] == region]
-    _7days_ago = (now - timedelta(days=6))
-    res = set(new_df_region[(new_df_region.po_date >= _7days_ago) & (new_df_region.po_date <= now) & (
-                new_df_region.num > 1)].id_user)
-    _7days_after = (now + timedelta(days=7))
-    df_temp = pd.DataFrame()
-    df_temp = new_df_region[
-        (new_df_region['date'] > now) & (new_df_region['date'] <= _7days_after) & (new_df_region.id_user.isin(res))]
-    more_payments = set(df_temp[(df_temp.num > 1)].id_user)
-    login = set(df_temp['id_user'])
-    matrix.loc['active_spenders', 'churn_spenders'] = (len(res) - len(set(df_temp['id_user']))) / len(res) * 100
-    matrix.loc['active_spenders', 'active_users'] = len(login.difference(more_payments)) / len(res) * 100
-    matrix.loc['active_spenders', 'active_spenders'] = len(set(df_temp[df_temp.num > 1]['id_user'])) / len(res) * 100
-    return matrix
-
-
-def active_users_validator(now, region):
-    matrix = pd.DataFrame()
-    now = now.date()
-    new_df_region = new_df[new_df['region'] == region]
-    _7days_ago = (now - timedelta(days=6))
-    had_payments = set(new_df_region[(new_df_region.po_date <= now) & (new_df_region.num >= 1)].id_user)
-    new_login = set(new_df_region[(new_df_region['date'] >= _7days_ago) & (new_df_region['date'] <= now)].id_user)
-    payment_and_login = new_login.intersection(had_payments)
-    payment_last_week = set(
-        new_df_region[(new_df_region.po_date >= _7days_ago) & (new_df_region.po_date <= now)].id_user)
-    res = payment_and_login.difference(payment_last_week)
-    _7days_after = (now + timedelta(days=7))
-    df_temp = pd.DataFrame()
-    df_temp = new_df_region[
-        (new_df_region['date'] > now) & (new_df_region['date'] <= _7days_after) & (new_df_region.id_user.isin(res))]
-    more_payments = set(df_temp[(df_temp.num > 1)].id_user)
-    login = set(df_temp['id_user'])
-    matrix.loc['active_users', 'churn_spenders'] = (len(res) - len(set(df_temp['id_user']))) / len(res) * 100
-    matrix.loc['active_users', 'active_users'] = len(login.difference(more_payments)) / len(res) * 100
-    matrix.loc['active_users', 'active_spenders'] = len(set(df_temp[df_temp.num > 1]['id_user'])) / len(res) * 100
-    return matrix
-
-
-def churn_spenders_validator(now, region):
-    matrix = pd.DataFrame()
-    now = now.date()
-    new_df_region = new_df[new_df['region'] == region]
-    _7days_ago = (now - timedelta(days=6))
-    _30days_ago = (now - timedelta(days=29))
-    early = set(
-        new_df_region[(new_df_region['po_date'] >= _30days_ago) & (new_df_region['po_date'] < _7days_ago)].id_user)
-    new = set(new_df_region[(new_df_region['date'] >= _7days_ago) & (new_df_region['date'] <= now)].id_user)
-    res = early.difference(new)
-    _7days_after = (now + timedelta(days=7))
-    df_temp = pd.DataFrame()
-    df_temp = new_df_region[
-        (new_df_region['date'] > now) & (new_df_region['date'] <= _7days_after) & (new_df_region.id_user.isin(res))]
-    more_payments = set(df_temp[(df_temp.num > 1)].id_user)
-    login = set(df_temp['id_user'])
-    matrix.loc['churn_spenders', 'churn_spenders'] = (len(res) - len(set(df_temp['id_user']))) / len(res) * 100
-    matrix.loc['churn_spenders', 'active_users'] = len(login.difference(more_payments)) / len(res) * 100
-    matrix.loc['churn_spenders', 'active_spenders'] = len(set(df_temp[df_temp.num > 1]['id_user'])) / len(res) * 100
-    return matrix
-
-
-def create_matrix(now, region):
-    l = [
-        new_ns_validator(now, region),
-        active_ns_validator(now, region),
-        churn_ns_validator(now, region),
-        new_spenders_validator(now, region),
-        active_spenders_validator(now, region),
-        active_users_validator(now, region),
-        churn_spenders_validator(now, region),
-    ]
-
-    return pd.concat(l)
-
-
-logging.debug("Matrix iterations")
-for region in ('cis', 'asia', 'latam'):
-    for one_day in pd.date_range(last_date_matrix, dt.date.today() - timedelta(days=8)).to_pydatetime():
-        matrix = create_matrix(one_day, region)
-        matrix = matrix.reset_index()
-        matrix.columns = ["source_state" if x == 'index' else x for x in matrix.columns]
-        matrix["region"] = region
-        matrix["date_state"] = str(one_day)[0:10]
-        data_loader.upload_data("core_migration_matrix", matrix)
+    # cells failed by previous runs go first if the extracted window covers them, older ones stay failed
+    first_day = plans[table][0][0][0].date() if plans[table] else end + timedelta(days=1)
+    plans[table] = [(days, (region,)) for region, days in failed.runs(table, first_day, first_planned)] + plans[table]
+
+logging.debug("Payments and logins queries")
+if CACHE_DIR and WATERMARK_STORE:
+    if WATERMARK_STORE == "postgres":
+        store = PostgresWatermarkStore(postgres, data_loader)
+        store.create()
+    else:
+        store = FileWatermarkStore(WATERMARK_FILE)
+    overlap = timedelta(hours=WATERMARK_OVERLAP_HOURS)
+
+    payments_extract = IncrementalExtract(ExtractCache(CACHE_DIR, "payments", "po_date"), store, overlap)
+    logins_extract = IncrementalExtract(ExtractCache(CACHE_DIR, "logins", "date"), store, overlap)
+
+    sources = {
+        "payments": lambda: payments_extract.get(
+            half_year_period, lambda since, until: monolith.get_dataframe(payments_query(since, until))
+        ),
+        "logins": lambda: logins_extract.get(
+            period, lambda since, until: bq.get_dataframe(logins_query(since, until))
+        ),
+    }
+elif CACHE_DIR:
+    tomorrow = dt.date.today() + timedelta(days=1)
+    payments_cache = ExtractCache(CACHE_DIR, "payments", "po_date", CACHE_PAYMENTS_REFRESH_DAYS)
+    logins_cache = ExtractCache(CACHE_DIR, "logins", "date", CACHE_REFRESH_DAYS)
+
+    sources = {
+        "payments": lambda: payments_cache.get(
+            half_year_period, tomorrow, lambda since, until: monolith.get_dataframe(payments_query(since, until))
+        ),
+        "logins": lambda: logins_cache.get(
+            period, tomorrow, lambda since, until: bq.get_dataframe(logins_query(since, until))
+        ),
+    }
+elif STREAM_LOGINS:
+    logins_stream = LoginsStream(bigquery_client(), page_size=STREAM_PAGE_SIZE, max_bytes=STREAM_MAX_MB * 1024 ** 2)
+
+    sources = {
+        "payments": lambda: monolith.get_dataframe(payments_query(half_year_period)),
+        "logins": lambda: logins_stream.extract(logins_query(period), REGIONS),
+    }
+else:
+    sources = {
+        "payments": lambda: monolith.get_dataframe(payments_query(half_year_period)),
+        "logins": lambda: bq.get_dataframe(logins_query(period)),
+    }
+
+if STATE_ENGINE == "sql" and not SQL_PARITY_CHECK:
+    # logins stay in BigQuery
+    del sources["logins"]
+
+extracted = Extractor({name: profiled("extract", source, source=name) for name, source in sources.items()}).extract()
+del sources
+
+df_payments_full = extracted["payments"]
+df = extracted.get("logins")
+del extracted
+
+df_payments_full = profiled("number_payments", number_payments)(df_payments_full)
+
+if STATE_ENGINE == "sql":
+    logging.debug("Payments staging")
+    sql_client = bigquery_client()
+    sql_backend = SqlStateBackend(sql_client, SQL_PAYMENTS_TABLE, period)
+    with profiler.stage("stage_payments") as record:
+        sql_backend.stage_payments(df_payments_full)
+        record.rows = len(df_payments_full)
+
+if df is not None:
+    # the merge runs on integer keys, streamed logins (day numbers already) and extracted ones alike
+    logging.debug("Merging and encoding")
+    with profiler.stage("merge") as record:
+        encoded = merge_encoded(df, df_payments_full, REGIONS)
+        record.rows = len(encoded.data)
+    del df, df_payments_full
+
+    logging.debug("Partitioning by region")
+    with profiler.stage("partition") as record:
+        frames = RegionFrames(encoded)
+        record.rows = len(encoded.data)
+else:
+    del df, df_payments_full
 
 # --------------------------------------------------------------------------------------------------------------------
-#                                                   SERIES
+#                                                   MATRIX AND SERIES
 # --------------------------------------------------------------------------------------------------------------------
+logging.debug("States calculation")
+if STATE_ENGINE == "sql":
+    engine = sql_backend
+
+    if SQL_PARITY_CHECK:
+        with profiler.stage("parity_check"):
+            check_parity(sql_backend, StateEngine(frames), pd.date_range(
+                min([days[0] for days, _ in plans["core_migration_matrix"]], default=ends["core_migration_matrix"]),
+                ends["core_migration_matrix"]
+            ))
+elif STATE_ENGINE == "rolling":
+    engine = RollingStateEngine(frames)
+else:
+    engine = StateEngine(frames)
+
+
+def engine_for(regions):
+    """Engine of the same kind limited to `regions`, the engine itself for all regions"""
+
+    if tuple(regions) == tuple(engine.regions):
+        return engine
+    elif STATE_ENGINE == "sql":
+        return SqlStateBackend(sql_client, SQL_PAYMENTS_TABLE, period, tuple(regions))
+    elif STATE_ENGINE == "rolling":
+        return RollingStateEngine(frames, tuple(regions))
+
+    return StateEngine(frames, tuple(regions))
+
+
+logging.debug("Matrix and series")
+
+# (table, days, regions) tasks, computed and uploaded by separate stages, so uploads overlap with the next
+# computations
+tasks = []
+
+if WORKERS > 1 and STATE_ENGINE != "sql":
+    # results of all cells are gathered and uploaded at once with their checkpoints
+    matrix = parallel_executor.matrix_cells(
+        frames,
+        [(region, day) for days, regions in plans["core_migration_matrix"] for region in regions for day in days],
+        failed=failed, profiler=profiler
+    )
 
+    if len(matrix):
+        data_loader.upload_batch([
+            ("core_migration_matrix", matrix), (checkpoints.table, checkpoints.rows("core_migration_matrix", matrix))
+        ], mode=UPLOAD_MODE)
+else:
+    tasks += [("core_migration_matrix", days, regions) for days, regions in plans["core_migration_matrix"]]
 
-def active_users_series(now, region):
-    now = now.date()
-    new_df_region = new_df[new_df['region'] == region]
-    _7days_ago = (now - timedelta(days=6))
-    had_payments = set(new_df_region[(new_df_region.po_date <= now) & (new_df_region.num >= 1)].id_user)
-    new_login = set(new_df_region[(new_df_region['date'] >= _7days_ago) & (new_df_region['date'] <= now)].id_user)
-    payment_and_login = new_login.intersection(had_payments)
-    payment_last_week = set(
-        new_df_region[(new_df_region.po_date >= _7days_ago) & (new_df_region.po_date <= now)].id_user)
-    res = payment_and_login.difference(payment_last_week)
-
-    df = pd.DataFrame(
-        {
-            "region": region,
-            "date_state": str(now)[0:10],
-            "state": "active_users",
-            "users_count": [len(res)],
-        }
-    )
+tasks += [("core_state_series", days, regions) for days, regions in plans["core_state_series"]]
 
-    return df
-
-
-def new_spenders_series(now, region):
-    now = now.date()
-    new_df_region = new_df[new_df['region'] == region]
-    _7days_ago = (now - timedelta(days=6))
-    count_1 = set(new_df_region[(new_df_region.po_date >= _7days_ago) & (new_df_region.po_date <= now) & (
-                new_df_region.num == 1)].id_user)
-    count_more = set(new_df_region[(new_df_region.po_date >= _7days_ago) & (new_df_region.po_date <= now) & (
-                new_df_region.num > 1)].id_user)
-    res = count_1.difference(count_more)
-
-    df = pd.DataFrame(
-        {
-            "region": region,
-            "date_state": str(now)[0:10],
-            "state": "new_spenders",
-            "users_count": [len(res)],
-        }
-    )
 
-    return df
-
-
-def active_spenders_series(now, region):
-    now = now.date()
-    new_df_region = new_df[new_df['region'] == region]
-    _7days_ago = (now - timedelta(days=6))
-    res = set(new_df_region[(new_df_region.po_date >= _7days_ago) & (new_df_region.po_date <= now) & (
-                new_df_region.num > 1)].id_user)
-    df = pd.DataFrame(
-        {
-            "region": region,
-            "date_state": str(now)[0:10],
-            "state": "active_spenders",
-            "users_count": [len(res)],
-        }
-    )
+def compute(task):
+    table, days, regions = task
 
-    return df
+    def cells(cell_regions, cell_days):
+        cell_engine = engine_for(cell_regions)
+        return cell_engine.matrix(cell_days) if table == "core_migration_matrix" else cell_engine.series(cell_days)
 
+    # the engines compute all regions and days of a chunk at once, cells are computed separately only if it fails
+    with profiler.stage("compute", table=table, first=days[0].date(), last=days[-1].date(), regions=len(regions)) \
+            as record:
+        data = compute_cells(table, cells, regions, days, failed)
+        record.rows = len(data)
 
-def churn_spenders_series(now, region):
-    now = now.date()
-    new_df_region = new_df[new_df['region'] == region]
+    return table, data
 
-    _7days_ago = (now - timedelta(days=6))
-    _30days_ago = (now - timedelta(days=29))
 
-    early = set(new_df_region[(new_df_region['po_date']>=_30days_ago)&(new_df_region['po_date']<_7days_ago)].id_user)
-    new = set(new_df_region[(new_df_region['date'] >= _7days_ago) & (new_df_region['date'] <= now)].id_user)
-    res = early.difference(new)
-    df = pd.DataFrame(
-        {
-            "region": region,
-            "date_state": str(now)[0:10],
-            "state": "churn_spenders",
-            "users_count": [len(res)],
-        }
-    )
+progress = Progress("Matrix and series chunks", len(tasks))
 
-    return df
-
-
-def new_ns_series(now, region):
-    now = now.date()
-    new_df_region = new_df[new_df['region'] == region]
-
-    _7days_ago = (now - timedelta(days=6))
-    had_payments = set(new_df_region[(new_df_region.po_date <= now) & (new_df_region.num >= 1)].id_user)
-    date_created = set(new_df_region[(new_df_region['u_date_created'] >= _7days_ago) & (
-                new_df_region['u_date_created'] <= now)].id_user)
-    res = date_created.difference(had_payments)
-    df = pd.DataFrame(
-        {
-            "region": region,
-            "date_state": str(now)[0:10],
-            "state": "new_ns",
-            "users_count": [len(res)],
-        }
-    )
+with BufferedDataLoader(data_loader, max_rows=UPLOAD_BUFFER_ROWS, mode=UPLOAD_MODE) as buffer:
+    def load(result):
+        table, data = result
 
-    return df
-
-
-def active_ns_series(now, region):
-    now = now.date()
-    new_df_region = new_df[new_df['region'] == region]
-    _7days_ago = (now - timedelta(days=6))
-    had_payments = set(new_df_region[(new_df_region.po_date <= now) & (new_df_region.num >= 1)].id_user)
-    login_and_date_created = set(new_df_region[
-                                     (new_df_region['date'] >= _7days_ago) & (new_df_region['date'] <= now) & (
-                                                 new_df_region['u_date_created'] < _7days_ago)].id_user)
-    res = login_and_date_created.difference(had_payments)
-    df = pd.DataFrame(
-        {
-            "region": region,
-            "date_state": str(now)[0:10],
-            "state": "active_ns",
-            "users_count": [len(res)],
-        }
-    )
+        # rows of a cell and its checkpoint are always flushed in the same transaction
+        for region in REGIONS:
+            cells = data[data["region"] == region]
 
-    return df
+            if len(cells):
+                buffer.add_batch([(table, cells), (checkpoints.table, checkpoints.rows(table, cells))])
 
+        progress.advance(rows=len(data))
 
-logging.debug("Series iteration")
-for region in ('cis', 'asia', 'latam'):
-    for now in pd.date_range(last_date, dt.date.today() - timedelta(days=1)).to_pydatetime():
-        temp = pd.concat([
-            new_ns_series(now, region),
-            active_ns_series(now, region),
-            new_spenders_series(now, region),
-            active_spenders_series(now, region),
-            churn_spenders_series(now, region),
-            active_users_series(now, region),
-        ])
+    Pipeline(tasks, [("compute", compute), ("load", load)], queue_size=PIPELINE_QUEUE_SIZE).run()
 
-        data_loader.upload_data("core_state_series", temp)
+progress.finish()
@@ -6,6 +6,14 @@ set -e
 NETWORK="db"
 APP_NAME="onetime_etl_retention"
 
+# `date_state` range to recalculate, a restarted backfill of the same range continues after the last completed partition
+BACKFILL_START=${1:?"usage: onetime_deploy.sh START_DATE [END_DATE]"}
+BACKFILL_END=${2:-$(date -d "-8 days" +%Y-%m-%d)}
+
+# long partitions computed by the rolling engine, whose windows are slid day by day instead of rebuilt for every day
+STATE_ENGINE=${ETL_STATE_ENGINE:-rolling}
+BACKFILL_CHUNK_DAYS=${ETL_BACKFILL_CHUNK_DAYS:-60}
+
 LOGGING_DIR_PATH=$HOME/logging
 CONFIG_DIR_PATH=$HOME/configs/etl_retention
 CODEBASE_DIR_PATH=$HOME/etl_retention/src
@@ -17,14 +25,16 @@ if [[ "$(docker container ls -a | grep -q ${APP_NAME})" ]]; then
   docker container rm ${APP_NAME}
 fi
 
-cd ./onetime
-
 docker build -t ${APP_NAME} --rm .
 
 docker run \
     -v ${CONFIG_DIR_PATH}:/configs \
     -v ${LOGGING_DIR_PATH}:/logging \
     -v ${CODEBASE_DIR_PATH}:/cmd/src \
+    -e ETL_BACKFILL_START=${BACKFILL_START} \
+    -e ETL_BACKFILL_END=${BACKFILL_END} \
+    -e ETL_STATE_ENGINE=${STATE_ENGINE} \
+    -e ETL_BACKFILL_CHUNK_DAYS=${BACKFILL_CHUNK_DAYS} \
     --network=${NETWORK} \
     --name=${APP_NAME} \
     --rm \
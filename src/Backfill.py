@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Any, Callable, Dict, List, Optional, Union
+import datetime as dt
+import logging
+import time
+
+import pandas as pd
+
+from src.CellCheckpoint import CellCheckpoints
+from src.Extractor import Extractor
+from src.Merge import number_payments, merge_encoded
+from src.PortgesDataLoader import PostgresDataLoader
+from src.Profiler import Profiler
+from src.RegionFrames import RegionFrames
+from src.StateEngine import StateEngine, REGIONS
+from src.Watermark import FileWatermarkStore, PostgresWatermarkStore
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+# days of logins before a `date_state` the states look at (last month) and after it (next week)
+LOOK_BACK: int = 29
+LOOK_AHEAD: int = 7
+
+# days of payments before the first `date_state`, payments are numbered from here as by the daily job
+PAYMENTS_LOOK_BACK: int = 180
+
+
+class Partition:
+	"""Consecutive `date_state` days computed and uploaded together, with the extraction window of rows that weren't
+	extracted for previous partitions
+
+	Attributes:
+		first (dt.date): first `date_state`
+		last (dt.date): last `date_state`
+		logins_since (dt.date): first date of logins to extract
+		payments_since (dt.date): first date of payments to extract
+		until (dt.date): date after the last date of logins and payments to extract
+
+	"""
+
+	__slots__ = ("first", "last", "logins_since", "payments_since", "until")
+
+	def __init__(self, first: dt.date, last: dt.date, logins_since: dt.date, payments_since: dt.date, until: dt.date):
+		self.first: dt.date = first
+		self.last: dt.date = last
+		self.logins_since: dt.date = logins_since
+		self.payments_since: dt.date = payments_since
+		self.until: dt.date = until
+
+	def __repr__(self) -> str:
+		return "Partition({} - {})".format(self.first, self.last)
+
+
+def plan_partitions(start: dt.date, end: dt.date, chunk_days: int, payments_since: dt.date) -> List[Partition]:
+	"""Function splits [start, end] into partitions of `chunk_days` days with non-overlapping extraction windows. \n
+	The first partition extracts logins of the whole look-back and payments since `payments_since`, every next one
+	only the days its last week of look-ahead adds.
+
+	Args:
+		start (dt.date): first `date_state`
+		end (dt.date): last `date_state`
+		chunk_days (int): days per partition
+		payments_since (dt.date): first date of payments
+
+	Returns:
+		List[Partition]: partitions in order of days
+
+	"""
+
+	partitions: List[Partition] = []
+	first = start
+
+	while first <= end:
+		last = min(first + timedelta(days=chunk_days - 1), end)
+		until = last + timedelta(days=LOOK_AHEAD + 1)
+
+		if partitions:
+			since = partitions[-1].until
+			partitions.append(Partition(first, last, since, since, until))
+		else:
+			partitions.append(Partition(first, last, first - timedelta(days=LOOK_BACK), payments_since, until))
+
+		first = last + timedelta(days=1)
+
+	return partitions
+
+
+class Backfill:
+	"""Recalculation of `core_state_series` and `core_migration_matrix` over an arbitrary range of days. \n
+	The range is split into partitions, extraction of partition N + 1 runs in a background thread while partition N
+	is computed and uploaded. Logins are kept in a sliding window, payments are accumulated. Every partition is
+	uploaded in one transaction together with checkpoints of its cells (if `checkpoints` are given, so the daily run
+	doesn't compute them again) and its last day is saved as a checkpoint, so a restarted backfill of the same range
+	continues after the last completed partition.
+
+	Attributes:
+		extract_logins (Callable[[dt.date, dt.date], pd.DataFrame]): extracts logins of [since, until)
+		extract_payments (Callable[[dt.date, dt.date], pd.DataFrame]): extracts payments of [since, until)
+		data_loader (PostgresDataLoader): object to upload data with
+		store (Union[FileWatermarkStore, PostgresWatermarkStore]): checkpoints
+		chunk_days (int): days per partition
+		mode (str): upload mode of `PostgresDataLoader`
+		profiler (Profiler): records computation of every partition
+		checkpoints (Optional[CellCheckpoints]): checkpoints of (table, region, date_state) cells of the daily run
+		engine (Callable[[RegionFrames], Any]): creates the states engine of a partition's frames, e.g.
+			`StateEngine` or `RollingStateEngine`
+
+	"""
+
+	__slots__ = (
+		"extract_logins", "extract_payments", "data_loader", "store", "chunk_days", "mode", "profiler", "checkpoints",
+		"engine",
+	)
+
+	def __init__(
+			self,
+			extract_logins: Callable[[dt.date, dt.date], pd.DataFrame],
+			extract_payments: Callable[[dt.date, dt.date], pd.DataFrame],
+			data_loader: PostgresDataLoader,
+			store: Union[FileWatermarkStore, PostgresWatermarkStore],
+			chunk_days: int = 7,
+			mode: str = "copy",
+			profiler: Optional[Profiler] = None,
+			checkpoints: Optional[CellCheckpoints] = None,
+			engine: Callable[[RegionFrames], Any] = StateEngine,
+	):
+		self.extract_logins: Callable[[dt.date, dt.date], pd.DataFrame] = extract_logins
+		self.extract_payments: Callable[[dt.date, dt.date], pd.DataFrame] = extract_payments
+		self.data_loader: PostgresDataLoader = data_loader
+		self.store: Union[FileWatermarkStore, PostgresWatermarkStore] = store
+		self.chunk_days: int = chunk_days
+		self.mode: str = mode
+		self.profiler: Profiler = profiler if profiler else Profiler()
+		self.checkpoints: Optional[CellCheckpoints] = checkpoints
+		self.engine: Callable[[RegionFrames], Any] = engine
+
+	@staticmethod
+	def checkpoint_key(start: dt.date, end: dt.date) -> str:
+		return "backfill {} - {}".format(start, end)
+
+	def plan(self, start: dt.date, end: dt.date) -> List[Partition]:
+		"""Method plans partitions of the days left after the last checkpoint of the range
+
+		Args:
+			start (dt.date): first `date_state`
+			end (dt.date): last `date_state`
+
+		Returns:
+			List[Partition]: partitions to process
+
+		"""
+
+		checkpoint: Optional[dt.datetime] = self.store.get(self.checkpoint_key(start, end))
+		first = max(start, checkpoint.date() + timedelta(days=1)) if checkpoint else start
+
+		if first > start:
+			logger.info("Backfill {} - {} resumes from {}".format(start, end, first))
+
+		return plan_partitions(first, end, self.chunk_days, start - timedelta(days=PAYMENTS_LOOK_BACK))
+
+	def __extract(self, partition: Partition) -> Dict[str, pd.DataFrame]:
+		return Extractor({
+			"logins": lambda: self.extract_logins(partition.logins_since, partition.until),
+			"payments": lambda: self.extract_payments(partition.payments_since, partition.until),
+		}).extract()
+
+	def __compute(self, logins: pd.DataFrame, payments: pd.DataFrame, partition: Partition) -> List:
+		"""Method computes series and matrix of the partition's days"""
+
+		with self.profiler.stage("compute", table="backfill", first=partition.first, last=partition.last) as record:
+			engine = self.engine(RegionFrames(merge_encoded(logins, number_payments(payments), REGIONS)))
+			days = pd.date_range(partition.first, partition.last)
+			frames = [("core_state_series", engine.series(days)), ("core_migration_matrix", engine.matrix(days))]
+			record.rows = sum(len(data) for _, data in frames)
+
+		return frames
+
+	def run(self, start: dt.date, end: dt.date):
+		"""Method backfills [start, end]
+
+		Args:
+			start (dt.date): first `date_state`
+			end (dt.date): last `date_state`
+
+		Raises:
+			RuntimeError: if a partition wasn't uploaded, previous partitions stay checkpointed
+
+		"""
+
+		partitions = self.plan(start, end)
+		key = self.checkpoint_key(start, end)
+
+		if self.checkpoints is not None:
+			# history present before the first checkpoints of a table is checkpointed first, it wouldn't be later
+			for table in ("core_state_series", "core_migration_matrix"):
+				self.checkpoints.seed(table)
+
+		logins: Optional[pd.DataFrame] = None
+		payments: Optional[pd.DataFrame] = None
+
+		with ThreadPoolExecutor(max_workers=1, thread_name_prefix="backfill") as prefetch:
+			future = prefetch.submit(self.__extract, partitions[0]) if partitions else None
+
+			for i, partition in enumerate(partitions):
+				waited = time.perf_counter()
+				extracted = future.result()
+				waited = time.perf_counter() - waited
+
+				if i + 1 < len(partitions):
+					future = prefetch.submit(self.__extract, partitions[i + 1])
+
+				start_time = time.perf_counter()
+
+				logins = pd.concat([logins, extracted["logins"]], ignore_index=True) \
+					if logins is not None else extracted["logins"]
+				payments = pd.concat([payments, extracted["payments"]], ignore_index=True) \
+					if payments is not None else extracted["payments"]
+				del extracted
+
+				# logins older than the look-back of the partition's first day aren't needed anymore
+				since = partition.first - timedelta(days=LOOK_BACK)
+				logins = logins[(pd.to_datetime(logins["date"]).dt.date >= since).values].reset_index(drop=True)
+
+				frames = self.__compute(logins, payments, partition)
+
+				# checkpoints of both tables go into the same upload as one frame
+				cells = [self.checkpoints.rows(table, data) for table, data in frames if len(data)] \
+					if self.checkpoints is not None else []
+
+				if cells:
+					frames.append((self.checkpoints.table, pd.concat(cells, ignore_index=True)))
+
+				if not self.data_loader.upload_batch(frames, mode=self.mode):
+					raise RuntimeError("{} wasn't uploaded, backfill stopped".format(partition))
+
+				self.store.set(key, dt.datetime.combine(partition.last, dt.time()))
+
+				logger.info("{} done in {:.2f} s ({:.2f} s waiting for extraction), {} of {}".format(
+					partition, time.perf_counter() - start_time, waited, i + 1, len(partitions)
+				))
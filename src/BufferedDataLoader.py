@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+from typing import Dict, List, Tuple
+import logging
+import time
+
+import pandas as pd
+
+from src.PortgesDataLoader import PostgresDataLoader
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class BufferedDataLoader:
+	"""Buffer on top of PostgresDataLoader. \n
+	It collects dataframes across iterations and uploads all of them in one transaction once a row-count or byte
+	threshold is reached. The rest is uploaded by `flush` or on exit from the `with` block.
+
+	Attributes:
+		data_loader (PostgresDataLoader): object to upload data with
+		max_rows (int): number of buffered rows that triggers a flush
+		max_bytes (int): size of buffered dataframes in bytes that triggers a flush
+		mode (str): upload mode, one of `PostgresDataLoader.UPLOAD_MODES`
+		flushes (List[dict]): statistics of every flush (tables, rows, seconds, success)
+
+	"""
+
+	__slots__ = ("data_loader", "max_rows", "max_bytes", "mode", "flushes", "__frames", "__rows", "__bytes")
+
+	def __init__(
+			self,
+			data_loader: PostgresDataLoader,
+			max_rows: int = 100000,
+			max_bytes: int = 64 * 1024 ** 2,
+			mode: str = "copy",
+	):
+		self.data_loader: PostgresDataLoader = data_loader
+		self.max_rows: int = max_rows
+		self.max_bytes: int = max_bytes
+		self.mode: str = mode
+		self.flushes: List[dict] = []
+
+		self.__frames: Dict[str, List[pd.DataFrame]] = {}
+		self.__rows: int = 0
+		self.__bytes: int = 0
+
+	def __enter__(self) -> "BufferedDataLoader":
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.flush()
+		self.report()
+
+	def add(self, table: str, data: pd.DataFrame) -> bool:
+		"""Method puts data into the buffer and flushes the buffer if any threshold is reached
+
+		Args:
+			table (str): table name to upsert data
+			data (pd.DataFrame): data to upsert
+
+		Returns:
+			bool: success status of the flush, True if the buffer wasn't flushed
+
+		"""
+
+		return self.add_batch([(table, data)])
+
+	def add_batch(self, frames: List[Tuple[str, pd.DataFrame]]) -> bool:
+		"""Method puts several frames into the buffer together, they always end up in the same flush (e.g. rows
+		of a cell and its checkpoint)
+
+		Args:
+			frames (List[Tuple[str, pd.DataFrame]]): pairs of a table name and data to upsert into it
+
+		Returns:
+			bool: success status of the flush, True if the buffer wasn't flushed
+
+		"""
+
+		for table, data in frames:
+			self.__frames.setdefault(table, []).append(data)
+			self.__rows += len(data)
+			self.__bytes += int(data.memory_usage(deep=True).sum())
+
+		if self.__rows >= self.max_rows or self.__bytes >= self.max_bytes:
+			return self.flush()
+
+		return True
+
+	def flush(self) -> bool:
+		"""Method uploads everything buffered in one transaction and clears the buffer. \n
+		Frames of a failed flush are dropped, the same way a failed `upload_data` call loses its data.
+
+		Returns:
+			bool: success status for data uploading
+
+		"""
+
+		if not self.__frames:
+			return True
+
+		frames: List[Tuple[str, pd.DataFrame]] = [
+			(table, pd.concat(data, ignore_index=True, sort=False)) for table, data in self.__frames.items()
+		]
+		rows: int = self.__rows
+
+		self.__frames = {}
+		self.__rows = 0
+		self.__bytes = 0
+
+		start: float = time.perf_counter()
+		success: bool = self.data_loader.upload_batch(frames, mode=self.mode)
+		seconds: float = time.perf_counter() - start
+
+		self.flushes.append(
+			{
+				"tables": {table: len(data) for table, data in frames},
+				"rows": rows,
+				"seconds": seconds,
+				"success": success,
+			}
+		)
+
+		logger.debug("Flushed {} rows ({}) in {:.2f} s".format(
+			rows, ", ".join("{}: {}".format(t, len(d)) for t, d in frames), seconds
+		))
+
+		return success
+
+	def report(self):
+		"""Method logs totals over all flushes"""
+
+		rows: int = sum(i["rows"] for i in self.flushes)
+		seconds: float = sum(i["seconds"] for i in self.flushes)
+		failed: int = sum(1 for i in self.flushes if not i["success"])
+
+		logger.info("Buffered uploads: {} flushes, {} rows, {:.2f} s, {} failed".format(
+			len(self.flushes), rows, seconds, failed
+		))
@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from datetime import timedelta
+import datetime as dt
+import json
+import logging
+import os
+
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class FailedCells:
+	"""(table, region, date_state) cells whose calculation failed, kept in a local JSON file with the error of every
+	cell. A later run computes them again, a cell is removed once it's computed.
+
+	Attributes:
+		path (str): path of the state file
+
+	"""
+
+	__slots__ = ("path",)
+
+	def __init__(self, path: str):
+		self.path: str = path
+
+	def __read(self) -> Dict[str, Dict[str, Dict[str, str]]]:
+		if not os.path.exists(self.path):
+			return {}
+
+		with open(self.path) as f:
+			return json.load(f)
+
+	def __write(self, state: Dict[str, Dict[str, Dict[str, str]]]):
+		# the state file is replaced atomically, so an interrupted run keeps the previous cells
+		with open(self.path + ".tmp", "w") as f:
+			json.dump(state, f, indent=4, sort_keys=True)
+
+		os.replace(self.path + ".tmp", self.path)
+
+	def add(self, table: str, region: str, day: dt.date, error: str):
+		state = self.__read()
+		state.setdefault(table, {}).setdefault(region, {})[str(day)] = error
+
+		self.__write(state)
+
+	def remove(self, table: str, cells: Iterable[Tuple[str, dt.date]]):
+		"""Method forgets computed cells
+
+		Args:
+			table (str): table name
+			cells (Iterable[Tuple[str, dt.date]]): regions and days
+
+		"""
+
+		state = self.__read()
+		regions = state.get(table, {})
+		removed = [(region, str(day)) for region, day in cells if str(day) in regions.get(region, {})]
+
+		if not removed:
+			return
+
+		for region, day in removed:
+			del regions[region][day]
+
+			if not regions[region]:
+				del regions[region]
+
+		if not regions:
+			state.pop(table, None)
+
+		self.__write(state)
+		logger.info("{} failed cells of {} are computed now".format(len(removed), table))
+
+	def cells(self, table: str) -> Dict[str, List[dt.date]]:
+		"""Method returns failed days of every region of a table
+
+		Args:
+			table (str): table name
+
+		Returns:
+			Dict[str, List[dt.date]]: sorted days by region
+
+		"""
+
+		return {
+			region: sorted(dt.date.fromisoformat(day) for day in days)
+			for region, days in self.__read().get(table, {}).items()
+		}
+
+	def runs(
+			self, table: str, before: dt.date, since: Optional[dt.date] = None
+	) -> List[Tuple[str, pd.DatetimeIndex]]:
+		"""Method groups failed days of every region in [since, before) into runs of consecutive days, the days from
+		`before` on are expected to be computed by the regular run anyway. Days before `since` stay failed.
+
+		Args:
+			table (str): table name
+			before (dt.date): first day of the regular run
+			since (Optional[dt.date]): first day that can be computed, e.g. whose look-back is extracted
+
+		Returns:
+			List[Tuple[str, pd.DatetimeIndex]]: region and consecutive days of every run
+
+		"""
+
+		runs: List[Tuple[str, pd.DatetimeIndex]] = []
+		skipped = 0
+
+		for region, days in self.cells(table).items():
+			skipped += sum(1 for day in days if since is not None and day < since)
+			days = pd.DatetimeIndex([day for day in days if day < before and (since is None or day >= since)])
+
+			if not len(days):
+				continue
+
+			# a new run starts where the gap from the previous day is more than one day
+			starts = [0] + [i for i in range(1, len(days)) if (days[i] - days[i - 1]).days > 1] + [len(days)]
+			runs += [(region, days[starts[i]:starts[i + 1]]) for i in range(len(starts) - 1)]
+
+		if skipped:
+			logger.warning("{} failed cells of {} before {} stay failed, they need a backfill".format(
+				skipped, table, since
+			))
+
+		return runs
+
+
+def compute_cells(
+		table: str,
+		compute: Callable[[Tuple[str, ...], pd.DatetimeIndex], pd.DataFrame],
+		regions: Tuple[str, ...],
+		days: pd.DatetimeIndex,
+		failed: FailedCells,
+) -> pd.DataFrame:
+	"""Function computes all (region, day) cells of a chunk at once. Only if that fails, cells are computed one by
+	one, so a single bad cell doesn't cost the rest of the chunk; cells that fail again are saved into `failed` and
+	skipped. Computed cells are removed from `failed`.
+
+	Args:
+		table (str): table name
+		compute (Callable[[Tuple[str, ...], pd.DatetimeIndex], pd.DataFrame]): computes rows of regions and days
+		regions (Tuple[str, ...]): regions of the chunk
+		days (pd.DatetimeIndex): consecutive days of the chunk
+		failed (FailedCells): failed cells
+
+	Returns:
+		pd.DataFrame: rows of the computed cells
+
+	"""
+
+	done = {(region, day.date()) for region in regions for day in days}
+
+	data: Optional[pd.DataFrame] = None
+
+	try:
+		data = compute(regions, days)
+	except Exception:
+		logger.exception("{} of {} for {} - {} failed, computing cells one by one".format(
+			table, regions, days[0].date(), days[-1].date()
+		))
+
+	if data is None:
+		parts = [compute(regions, days[:0])]
+
+		for region in regions:
+			for i in range(len(days)):
+				try:
+					parts.append(compute((region,), days[i:i + 1]))
+				except Exception as e:
+					logger.exception("Cell ({}, {}, {}) failed".format(table, region, days[i].date()))
+					failed.add(table, region, days[i].date(), repr(e))
+					done.discard((region, days[i].date()))
+
+		data = pd.concat(parts, ignore_index=True, sort=False)
+
+	failed.remove(table, done)
+
+	return data
+
+
+def plan_cells(
+		regions: Tuple[str, ...], days: pd.DatetimeIndex, completed: Dict[str, Set[dt.date]], chunk_days: int
+) -> List[Tuple[pd.DatetimeIndex, Tuple[str, ...]]]:
+	"""Function groups cells that aren't completed into tasks: consecutive days missing for the same regions, at most
+	`chunk_days` days per task, so regions that are ahead aren't computed again and regions that are behind are
+	computed together where they can
+
+	Args:
+		regions (Tuple[str, ...]): regions
+		days (pd.DatetimeIndex): consecutive days to check
+		completed (Dict[str, Set[dt.date]]): completed days by region
+		chunk_days (int): days per task
+
+	Returns:
+		List[Tuple[pd.DatetimeIndex, Tuple[str, ...]]]: days and regions of every task in order of days
+
+	"""
+
+	missing = [tuple(r for r in regions if day.date() not in completed.get(r, ())) for day in days]
+	tasks: List[Tuple[pd.DatetimeIndex, Tuple[str, ...]]] = []
+	start = 0
+
+	for i in range(1, len(days) + 1):
+		if i < len(days) and missing[i] == missing[start] and i - start < chunk_days:
+			continue
+
+		if missing[start]:
+			tasks.append((days[start:i], missing[start]))
+
+		start = i
+
+	return tasks
+
+
+class CellCheckpoints:
+	"""Completed (table, region, date_state) cells kept in Postgres next to the tables they describe, the table is
+	created by `create` if it doesn't exist yet:
+
+		create table etl_cells (
+			table_name text, region text, date_state date, completed_at timestamp not null,
+			primary key (table_name, region, date_state)
+		);
+
+	Checkpoint rows are uploaded with the cells' rows in one transaction (`rows` builds them), so a cell is either
+	uploaded and checkpointed or neither.
+
+	Attributes:
+		db_worker: database worker of the Postgres
+		table (str): table of the checkpoints
+
+	"""
+
+	__slots__ = ("db_worker", "table")
+
+	def __init__(self, db_worker, table: str = "etl_cells"):
+		self.db_worker = db_worker
+		self.table: str = table
+
+	def create(self):
+		"""Method creates the checkpoints table if it doesn't exist"""
+
+		self.db_worker.get_iterable(
+			"create table if not exists {} ("
+			"table_name text, region text, date_state date, completed_at timestamp not null, "
+			"primary key (table_name, region, date_state))".format(self.table)
+		)
+
+	def seed(self, table: str):
+		"""Method checkpoints every cell already present in a table if the table has no checkpoints at all, so
+		switching to checkpoints doesn't recompute history
+
+		Args:
+			table (str): table with `region` and `date_state` columns
+
+		"""
+
+		if self.db_worker.get_iterable(
+				"select 1 from {} where table_name = '{}' limit 1".format(self.table, table)
+		).fetchone():
+			return
+
+		self.db_worker.get_iterable(
+			"insert into {0} (table_name, region, date_state, completed_at) "
+			"select distinct '{1}', region, date_state::date, now() from {1} "
+			"on conflict do nothing".format(self.table, table)
+		)
+		logger.info("Checkpoints of {} seeded from its rows".format(table))
+
+	def last(self, table: str) -> Dict[str, dt.date]:
+		"""Method returns the last completed day of every region of a table"""
+
+		return {
+			region: pd.to_datetime(day).date()
+			for region, day in self.db_worker.get_iterable(
+				"select region, max(date_state) from {} where table_name = '{}' group by region".format(
+					self.table, table
+				)
+			)
+		}
+
+	def completed(self, table: str, since: dt.date) -> Dict[str, Set[dt.date]]:
+		"""Method returns completed days of every region of a table since a day"""
+
+		completed: Dict[str, Set[dt.date]] = {}
+
+		for region, day in self.db_worker.get_iterable(
+				"select region, date_state from {} where table_name = '{}' and date_state >= '{}'".format(
+					self.table, table, since
+				)
+		):
+			completed.setdefault(region, set()).add(pd.to_datetime(day).date())
+
+		return completed
+
+	def plan(
+			self, table: str, regions: Tuple[str, ...], end: dt.date, resume_days: int, default_start: dt.date,
+			chunk_days: int
+	) -> List[Tuple[pd.DatetimeIndex, Tuple[str, ...]]]:
+		"""Method plans cells of a table to compute: the last completed day of each region and every day after it
+		(from `default_start` for regions without checkpoints) and gaps during the last `resume_days` days till
+		`end`. The last completed day is computed again as the daily job always did, it may have been computed before
+		all of its logins arrived.
+
+		Args:
+			table (str): table name
+			regions (Tuple[str, ...]): regions
+			end (dt.date): last day to compute
+			resume_days (int): how many days before `end` are checked for gaps
+			default_start (dt.date): first day of regions without checkpoints
+			chunk_days (int): days per task
+
+		Returns:
+			List[Tuple[pd.DatetimeIndex, Tuple[str, ...]]]: days and regions of every task in order of days
+
+		"""
+
+		last = self.last(table)
+		since = min([end - timedelta(days=resume_days - 1)] + [last.get(r, default_start) for r in regions])
+
+		completed = self.completed(table, since)
+
+		for region, day in last.items():
+			completed.get(region, set()).discard(day)
+		tasks = plan_cells(regions, pd.date_range(since, end), completed, chunk_days)
+
+		logger.info("{}: {} cells to compute since {} in {} tasks".format(
+			table, sum(len(days) * len(task_regions) for days, task_regions in tasks), since, len(tasks)
+		))
+
+		return tasks
+
+	def rows(self, table: str, data: pd.DataFrame) -> pd.DataFrame:
+		"""Method builds checkpoint rows of every (region, date_state) cell present in data
+
+		Args:
+			table (str): table of the data
+			data (pd.DataFrame): rows of cells with `region` and `date_state` columns
+
+		Returns:
+			pd.DataFrame: rows of the checkpoints table
+
+		"""
+
+		cells = data[["region", "date_state"]].drop_duplicates()
+
+		return pd.DataFrame({
+			"table_name": table,
+			"region": cells["region"].values,
+			"date_state": cells["date_state"].values,
+			"completed_at": dt.datetime.now(),
+		})
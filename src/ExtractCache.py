@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+from datetime import timedelta
+from typing import Callable, Dict, List, Tuple
+import datetime as dt
+import logging
+import os
+import time
+
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class ExtractCache:
+	"""On-disk cache of one raw extract split into daily Parquet partitions
+	(`{directory}/{name}/{date_column}=YYYY-MM-DD.parquet`, requires pyarrow). \n
+	Only days without a partition and the trailing `refresh_days` days (which may still get late rows) are fetched
+	from the source, partitions before the requested range are evicted. Rows that change after their day was cached
+	(e.g. a payment whose status becomes paid) are seen only if the change happens within `refresh_days`.
+
+	Attributes:
+		directory (str): root directory of the cache
+		name (str): name of the extract
+		date_column (str): column partitions are split by
+		refresh_days (int): number of the latest days that are always fetched again
+		stats (Dict[str, float]): counters of the last `get` call
+
+	"""
+
+	__slots__ = ("directory", "name", "date_column", "refresh_days", "stats")
+
+	def __init__(self, directory: str, name: str, date_column: str, refresh_days: int = 2):
+		self.directory: str = directory
+		self.name: str = name
+		self.date_column: str = date_column
+		self.refresh_days: int = refresh_days
+		self.stats: Dict[str, float] = {}
+
+		os.makedirs(os.path.join(self.directory, self.name), exist_ok=True)
+
+	def __path(self, day: dt.date) -> str:
+		return os.path.join(self.directory, self.name, "{}={}.parquet".format(self.date_column, day.isoformat()))
+
+	def partitions(self) -> Dict[dt.date, str]:
+		"""Method lists cached partitions
+
+		Returns:
+			Dict[dt.date, str]: path of every cached day
+
+		"""
+
+		prefix = "{}=".format(self.date_column)
+		partitions: Dict[dt.date, str] = {}
+
+		for file in os.listdir(os.path.join(self.directory, self.name)):
+			if file.startswith(prefix) and file.endswith(".parquet"):
+				day = dt.datetime.strptime(file[len(prefix):-len(".parquet")], "%Y-%m-%d").date()
+				partitions[day] = os.path.join(self.directory, self.name, file)
+
+		return partitions
+
+	def evict(self, since: dt.date) -> int:
+		"""Method removes partitions of days before the retention window
+
+		Args:
+			since (dt.date): first retained day
+
+		Returns:
+			int: number of removed partitions
+
+		"""
+
+		evicted = 0
+
+		for day, path in self.partitions().items():
+			if day < since:
+				os.remove(path)
+				evicted += 1
+
+		return evicted
+
+	@staticmethod
+	def __ranges(days: List[dt.date]) -> List[Tuple[dt.date, dt.date]]:
+		"""Method groups sorted days into ranges of consecutive days, [first, last + 1 day)"""
+
+		ranges: List[Tuple[dt.date, dt.date]] = []
+
+		for day in days:
+			if ranges and ranges[-1][1] == day:
+				ranges[-1] = (ranges[-1][0], day + timedelta(days=1))
+			else:
+				ranges.append((day, day + timedelta(days=1)))
+
+		return ranges
+
+	def __write(self, data: pd.DataFrame, since: dt.date, until: dt.date):
+		"""Method splits fetched data into daily partitions, days without rows get empty partitions"""
+
+		days = pd.to_datetime(data[self.date_column]).dt.date
+
+		day = since
+		while day < until:
+			path = self.__path(day)
+
+			# partitions are replaced atomically, so an interrupted run never leaves a truncated file
+			data[(days == day).values].to_parquet(path + ".tmp", index=False)
+			os.replace(path + ".tmp", path)
+
+			day += timedelta(days=1)
+
+	def merge(self, data: pd.DataFrame) -> int:
+		"""Method adds rows to the partitions of their days, rows already present in a partition are dropped
+
+		Args:
+			data (pd.DataFrame): rows of any days
+
+		Returns:
+			int: number of updated partitions
+
+		"""
+
+		days = pd.to_datetime(data[self.date_column]).dt.date
+		cached = self.partitions()
+		updated = 0
+
+		for day in sorted(set(days)):
+			rows = data[(days == day).values]
+
+			if day in cached:
+				rows = pd.concat([pd.read_parquet(cached[day]), rows], ignore_index=True).drop_duplicates()
+
+			path = self.__path(day)
+			rows.to_parquet(path + ".tmp", index=False)
+			os.replace(path + ".tmp", path)
+			updated += 1
+
+		return updated
+
+	def read(self, since: dt.date, until: dt.date) -> pd.DataFrame:
+		"""Method reads cached partitions of [since, until), days without a partition are skipped
+
+		Args:
+			since (dt.date): first day
+			until (dt.date): day after the last day
+
+		Returns:
+			pd.DataFrame: rows ordered by day
+
+		"""
+
+		cached = self.partitions()
+		paths = [path for day, path in sorted(cached.items()) if since <= day < until]
+
+		return pd.concat([pd.read_parquet(path) for path in paths], ignore_index=True) if paths else pd.DataFrame()
+
+	def get(self, since: dt.date, until: dt.date, fetch: Callable[[dt.date, dt.date], pd.DataFrame]) -> pd.DataFrame:
+		"""Method returns the extract of [since, until) reading cached days from disk and fetching the rest
+
+		Args:
+			since (dt.date): first day
+			until (dt.date): day after the last day
+			fetch (Callable[[dt.date, dt.date], pd.DataFrame]): function extracting [since, until) from the source
+
+		Returns:
+			pd.DataFrame: rows of all days ordered by day
+
+		"""
+
+		start = time.perf_counter()
+
+		evicted = self.evict(since)
+		cached = self.partitions()
+		fresh = until - timedelta(days=self.refresh_days)
+
+		days = [since + timedelta(days=i) for i in range((until - since).days)]
+		missing = [day for day in days if day not in cached or day >= fresh]
+
+		fetched_rows = 0
+
+		for first, end in self.__ranges(missing):
+			data = fetch(first, end)
+			fetched_rows += len(data)
+
+			self.__write(data, first, end)
+
+		data = self.read(since, until)
+
+		self.stats = {
+			"hits": len(days) - len(missing),
+			"misses": len(missing),
+			"evicted": evicted,
+			"fetched_rows": fetched_rows,
+			"rows": len(data),
+			"seconds": time.perf_counter() - start,
+		}
+
+		self.report()
+
+		return data
+
+	def report(self):
+		"""Method logs cache hits and misses of the last `get` call"""
+
+		logger.info(
+			"Cache {}: {hits} partitions from disk, {misses} fetched ({fetched_rows} rows), {evicted} evicted, "
+			"{rows} rows in {seconds:.2f} s".format(self.name, **self.stats)
+		)
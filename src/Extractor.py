@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+import logging
+import time
+
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class ExtractionError(RuntimeError):
+	"""Raised when one or several sources failed, after all sources have finished
+
+	Attributes:
+		errors (Dict[str, BaseException]): exception of every failed source
+
+	"""
+
+	def __init__(self, errors: Dict[str, BaseException]):
+		super().__init__("Extraction failed for {}".format(
+			", ".join("{} ({!r})".format(name, error) for name, error in errors.items())
+		))
+		self.errors: Dict[str, BaseException] = errors
+
+
+class ExtractionResult:
+	"""Outcome of one source's extraction
+
+	Attributes:
+		name (str): source name
+		data (Optional[pd.DataFrame]): extracted data, None if the source failed
+		seconds (float): wall time of the extraction
+		error (Optional[BaseException]): exception raised by the source, None on success
+
+	"""
+
+	__slots__ = ("name", "data", "seconds", "error")
+
+	def __init__(
+			self, name: str, data: Optional[pd.DataFrame], seconds: float, error: Optional[BaseException] = None
+	):
+		self.name: str = name
+		self.data: Optional[pd.DataFrame] = data
+		self.seconds: float = seconds
+		self.error: Optional[BaseException] = error
+
+	@property
+	def ok(self) -> bool:
+		return self.error is None
+
+
+class Extractor:
+	"""Runs independent sources (BigQuery, MySQL, ...) concurrently in threads. \n
+	Sources spend their time waiting for databases, so threads are enough and wall time becomes the time of the
+	slowest source. A failure of one source doesn't interrupt the others, every source is timed separately.
+
+	Attributes:
+		sources (Dict[str, Callable[[], pd.DataFrame]]): functions returning data of every source by name
+
+	"""
+
+	__slots__ = ("sources",)
+
+	def __init__(self, sources: Dict[str, Callable[[], pd.DataFrame]]):
+		self.sources: Dict[str, Callable[[], pd.DataFrame]] = sources
+
+	@staticmethod
+	def __run(name: str, source: Callable[[], pd.DataFrame]) -> ExtractionResult:
+		start = time.perf_counter()
+
+		try:
+			data = source()
+		except Exception as e:
+			seconds = time.perf_counter() - start
+			logger.exception("Source {} failed after {:.2f} s".format(name, seconds))
+
+			return ExtractionResult(name, None, seconds, e)
+
+		seconds = time.perf_counter() - start
+		logger.info("Source {}: {} rows in {:.2f} s".format(name, len(data), seconds))
+
+		return ExtractionResult(name, data, seconds)
+
+	def run(self) -> Dict[str, ExtractionResult]:
+		"""Method extracts all sources concurrently and waits for all of them
+
+		Returns:
+			Dict[str, ExtractionResult]: result of every source, including failed ones
+
+		"""
+
+		start = time.perf_counter()
+
+		with ThreadPoolExecutor(max_workers=max(len(self.sources), 1), thread_name_prefix="extract") as executor:
+			futures = {name: executor.submit(self.__run, name, source) for name, source in self.sources.items()}
+			results = {name: future.result() for name, future in futures.items()}
+
+		logger.info("Extraction finished in {:.2f} s (sum of sources {:.2f} s)".format(
+			time.perf_counter() - start, sum(i.seconds for i in results.values())
+		))
+
+		return results
+
+	def extract(self) -> Dict[str, pd.DataFrame]:
+		"""Method extracts all sources concurrently
+
+		Raises:
+			ExtractionError: if any source failed, after the rest have finished
+
+		Returns:
+			Dict[str, pd.DataFrame]: data of every source
+
+		"""
+
+		results = self.run()
+		errors = {name: i.error for name, i in results.items() if not i.ok}
+
+		if errors:
+			raise ExtractionError(errors)
+
+		return {name: i.data for name, i in results.items()}
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+from typing import Tuple
+import datetime as dt
+import logging
+
+import numpy as np
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+# marker of a missing date in integer-encoded date columns
+NO_DAY: int = np.iinfo(np.int32).min
+
+# marker of a row without region or with a region outside of the encoded ones
+NO_REGION: int = np.iinfo(np.uint8).max
+
+EPOCH: dt.date = dt.date(1970, 1, 1)
+
+DATE_COLUMNS: Tuple[str, ...] = ("date", "u_date_created", "po_date")
+
+
+def to_day_numbers(values: pd.Series) -> np.ndarray:
+	"""Function converts dates (datetime.date objects, strings or datetimes) into day numbers since epoch. \n
+	Numeric values are taken as day numbers already (e.g. streamed logins after an outer merge, NaN if missing).
+
+	Args:
+		values (pd.Series): dates, missing values are allowed
+
+	Returns:
+		np.ndarray: int32 day numbers, `NO_DAY` for missing dates
+
+	"""
+
+	if pd.api.types.is_numeric_dtype(values):
+		days = values.values.astype(np.float64)
+		days[np.isnan(days)] = NO_DAY
+
+		return days.astype(np.int32)
+
+	codes = None
+
+	if values.dtype == object:
+		# date objects are parsed one by one, so only distinct dates (a few hundred) are parsed
+		codes, uniques = pd.factorize(values.values)
+		values = pd.Series(uniques, dtype=object)
+
+	dates = pd.to_datetime(values)
+	days = dates.values.astype("datetime64[D]").astype(np.int64)
+	days[dates.isna().values] = NO_DAY
+	days = days.astype(np.int32)
+
+	if codes is not None:
+		# missing values have code -1, which takes the appended `NO_DAY`
+		days = np.append(days, np.int32(NO_DAY))[codes]
+
+	return days
+
+
+def day_number(date) -> int:
+	"""Function converts a single date (or datetime) into a day number since epoch
+
+	Args:
+		date (datetime.date | datetime.datetime): date
+
+	Returns:
+		int: day number
+
+	"""
+
+	if isinstance(date, dt.datetime):
+		date = date.date()
+
+	return (date - EPOCH).days
+
+
+def memory_usage(df: pd.DataFrame) -> int:
+	"""Function returns the size of a dataframe in bytes including python objects in object columns
+
+	Args:
+		df (pd.DataFrame): any dataframe
+
+	Returns:
+		int: bytes
+
+	"""
+
+	return int(df.memory_usage(deep=True, index=True).sum())
+
+
+class EncodedFrame:
+	"""Merged frame of logins and payments in compact integer representation
+
+	Attributes:
+		data (pd.DataFrame): columns `user` (int32 dense user index), `region` (uint8 code, `NO_REGION` for other
+			regions), `date`, `u_date_created`, `po_date` (int32 day numbers, `NO_DAY` if missing) and
+			`num` (int16 number of the payment, 0 if there's no payment in the row)
+		ids (np.ndarray): `id_user` of every dense user index
+		regions (Tuple[str, ...]): region of every region code
+
+	"""
+
+	__slots__ = ("data", "ids", "regions")
+
+	def __init__(self, data: pd.DataFrame, ids: np.ndarray, regions: Tuple[str, ...]):
+		self.data: pd.DataFrame = data
+		self.ids: np.ndarray = ids
+		self.regions: Tuple[str, ...] = regions
+
+	def __len__(self) -> int:
+		return len(self.data)
+
+
+def encode_frame(new_df: pd.DataFrame, regions: Tuple[str, ...]) -> EncodedFrame:
+	"""Function normalizes the merged frame: dates become int32 day numbers, regions become uint8 codes and
+	`id_user` becomes a dense int32 index. Memory usage before and after is logged.
+
+	Args:
+		new_df (pd.DataFrame): merged frame with `id_user`, `region`, `date`, `u_date_created`, `po_date` and `num`
+		regions (Tuple[str, ...]): regions to encode, rows of other regions get `NO_REGION`
+
+	Returns:
+		EncodedFrame: encoded frame
+
+	"""
+
+	users, ids = pd.factorize(new_df["id_user"])
+
+	region = pd.Categorical(new_df["region"], categories=regions).codes.astype(np.int16)
+	region[region < 0] = NO_REGION
+
+	data = pd.DataFrame({
+		"user": users.astype(np.int32),
+		"region": region.astype(np.uint8),
+		**{column: to_day_numbers(new_df[column]) for column in DATE_COLUMNS},
+		"num": new_df["num"].fillna(0).values.astype(np.int16),
+	})
+
+	before, after = memory_usage(new_df), memory_usage(data)
+
+	logger.info("Merged frame encoded: {} rows, {:.1f} MB -> {:.1f} MB".format(
+		len(data), before / 1024 ** 2, after / 1024 ** 2
+	))
+
+	return EncodedFrame(data, np.asarray(ids), regions)
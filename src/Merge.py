@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+from typing import Tuple
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.FrameEncoder import EncodedFrame, NO_DAY, to_day_numbers, memory_usage
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def number_payments(payments: pd.DataFrame) -> pd.DataFrame:
+	"""Function numbers payments of every user in the order of their dates
+
+	Args:
+		payments (pd.DataFrame): `id_user`, `po_date` and `region` of payments, one row per user and day
+
+	Returns:
+		pd.DataFrame: payments with `num` (1 for the first payment) and `po_date` as datetime.date
+
+	"""
+
+	payments = payments.sort_values(["id_user", "po_date"], kind="mergesort").reset_index(drop=True)
+	payments["num"] = payments.groupby("id_user").cumcount() + 1
+	payments["po_date"] = pd.to_datetime(payments["po_date"]).dt.date
+
+	return payments
+
+
+def merge_extracts(logins: pd.DataFrame, payments: pd.DataFrame) -> pd.DataFrame:
+	"""Function joins logins and numbered payments of the same user, day and region into the merged frame
+
+	Args:
+		logins (pd.DataFrame): `id_user`, `u_date_created`, `date` and `region` of logins
+		payments (pd.DataFrame): `id_user`, `po_date`, `region` and `num` of payments
+
+	Returns:
+		pd.DataFrame: merged frame (`new_df`) with dates as datetime.date
+
+	"""
+
+	logins = logins.copy()
+	logins["date"] = pd.to_datetime(logins["date"]).dt.date
+
+	new_df = pd.merge(
+		logins, payments, how="outer", left_on=["id_user", "date", "region"], right_on=["id_user", "po_date", "region"]
+	)
+	new_df["po_date"] = pd.to_datetime(new_df["po_date"]).dt.date
+	new_df["date"] = pd.to_datetime(new_df["date"]).dt.date
+	new_df["u_date_created"] = pd.to_datetime(new_df["u_date_created"]).dt.date
+
+	return new_df.drop_duplicates()
+
+
+def _unique(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+	"""Function finds sorted unique keys and the position of the first occurrence of every key (as `np.unique` with
+	`return_index`, but with a plain sort, which is faster on int64 keys than hashing)"""
+
+	order = np.argsort(keys, kind="stable")
+	ordered = keys[order]
+	first = np.ones(len(ordered), dtype=bool)
+	first[1:] = ordered[1:] != ordered[:-1]
+
+	return ordered[first], order[first]
+
+
+def merge_encoded(logins: pd.DataFrame, payments: pd.DataFrame, regions: Tuple[str, ...]) -> EncodedFrame:
+	"""Function joins logins and numbered payments like `merge_extracts` followed by `encode_frame`, but on sorted
+	integer keys. \n
+	Dates are converted into day numbers once, rows are deduplicated on the (region, user, day) key only and the
+	outer join is a union of sorted key arrays. Rows of regions outside of `regions` are dropped, states don't use
+	them. Users are numbered in order of their first appearance in logins, then in payments.
+
+	Args:
+		logins (pd.DataFrame): `id_user`, `u_date_created`, `date` and `region` of logins (dates as dates, strings or
+			day numbers)
+		payments (pd.DataFrame): `id_user`, `po_date`, `region` and `num` of payments
+		regions (Tuple[str, ...]): regions to keep
+
+	Returns:
+		EncodedFrame: encoded merged frame
+
+	"""
+
+	start = time.perf_counter()
+
+	users, ids = pd.factorize(np.concatenate([logins["id_user"].values, payments["id_user"].values]))
+	users = users.astype(np.int64)
+	n_users = max(len(ids), 1)
+
+	login_user, payment_user = users[:len(logins)], users[len(logins):]
+	login_region = pd.Categorical(logins["region"], categories=regions).codes.astype(np.int64)
+	payment_region = pd.Categorical(payments["region"], categories=regions).codes.astype(np.int64)
+	login_day = to_day_numbers(logins["date"]).astype(np.int64)
+	payment_day = to_day_numbers(payments["po_date"]).astype(np.int64)
+
+	known_login = (login_region >= 0) & (login_day != NO_DAY)
+	known_payment = (payment_region >= 0) & (payment_day != NO_DAY)
+
+	first_day = min(
+		login_day[known_login].min() if known_login.any() else 0,
+		payment_day[known_payment].min() if known_payment.any() else 0,
+	)
+	n_days = max(
+		login_day[known_login].max() if known_login.any() else 0,
+		payment_day[known_payment].max() if known_payment.any() else 0,
+	) - first_day + 1
+
+	def keys(region, user, day, known):
+		return ((region[known] * n_users + user[known]) * n_days + day[known] - first_day)
+
+	login_keys, login_rows = _unique(keys(login_region, login_user, login_day, known_login))
+	payment_keys, payment_rows = _unique(keys(payment_region, payment_user, payment_day, known_payment))
+
+	merged, _ = _unique(np.concatenate([login_keys, payment_keys]))
+
+	in_logins = np.zeros(len(merged), dtype=bool)
+	in_logins[np.searchsorted(merged, login_keys)] = True
+	in_payments = np.zeros(len(merged), dtype=bool)
+	in_payments[np.searchsorted(merged, payment_keys)] = True
+
+	group, day = np.divmod(merged, n_days)
+	region, user = np.divmod(group, n_users)
+	day = (day + first_day).astype(np.int32)
+
+	created = to_day_numbers(logins["u_date_created"])[known_login][login_rows]
+	num = payments["num"].fillna(0).values.astype(np.int16)[known_payment][payment_rows]
+
+	date = np.full(len(merged), NO_DAY, dtype=np.int32)
+	date[in_logins] = day[in_logins]
+	po_date = np.full(len(merged), NO_DAY, dtype=np.int32)
+	po_date[in_payments] = day[in_payments]
+	u_date_created = np.full(len(merged), NO_DAY, dtype=np.int32)
+	u_date_created[in_logins] = created
+	payment_num = np.zeros(len(merged), dtype=np.int16)
+	payment_num[in_payments] = num
+
+	data = pd.DataFrame({
+		"user": user.astype(np.int32),
+		"region": region.astype(np.uint8),
+		"date": date,
+		"u_date_created": u_date_created,
+		"po_date": po_date,
+		"num": payment_num,
+	})
+
+	logger.info("Logins and payments merged on integer keys: {} + {} rows -> {} rows, {:.1f} MB in {:.2f} s".format(
+		len(logins), len(payments), len(data), memory_usage(data) / 1024 ** 2, time.perf_counter() - start
+	))
+
+	return EncodedFrame(data, np.asarray(ids), regions)
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from logging.handlers import QueueHandler, QueueListener
+from typing import Tuple, Dict, List, Optional, Iterable
+import logging
+import multiprocessing
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+
+from src.CellCheckpoint import FailedCells
+from src.Profiler import Profiler
+from src.QueueLogging import Progress, RecordForwarder
+from src.RegionFrames import RegionFrames
+from src.StateEngine import StateEngine, consecutive_days
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+# per-process engines over memory-mapped arrays of `_directory`, loaded by the first cell of every `matrix_cells` call
+_directory: Optional[str] = None
+_engines: Dict[str, StateEngine] = {}
+
+# per-process profiler writing into the parent's file under the parent's run id
+_profiler: Profiler = Profiler()
+
+
+def _init_worker(log_queue: multiprocessing.Queue):
+	"""Function sends records of a worker process to the parent, which writes them with its own handlers
+
+	Args:
+		log_queue (multiprocessing.Queue): queue read by the parent's listener
+
+	"""
+
+	root = logging.getLogger()
+
+	for handler in root.handlers[:]:
+		root.removeHandler(handler)
+
+	# levels are checked again by the parent's loggers and handlers
+	root.addHandler(QueueHandler(log_queue))
+	root.setLevel(logging.DEBUG)
+
+
+def _load(directory: str, profile_path: Optional[str], run: Optional[str]):
+	"""Function loads memory-mapped `RegionFrames` in a worker process unless they are loaded already
+
+	Args:
+		directory (str): directory with arrays saved by `RegionFrames.dump`
+		profile_path (Optional[str]): JSON lines file of the parent's profiler
+		run (Optional[str]): run id of the parent's profiler
+
+	"""
+
+	global _directory, _profiler
+
+	if directory == _directory:
+		return
+
+	_profiler = Profiler(profile_path, run)
+
+	frames = RegionFrames.load(directory, mmap=True)
+	_engines.clear()
+
+	for region in frames.regions:
+		_engines[region] = StateEngine(frames, (region,))
+
+	_directory = directory
+
+
+def _matrix_cell(
+		directory: str, profile_path: Optional[str], run: Optional[str], cell: Tuple[str, pd.Timestamp]
+) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
+	"""Function computes the migration matrix of one (region, day) cell in a worker process
+
+	Args:
+		directory (str): directory with arrays saved by `RegionFrames.dump`
+		profile_path (Optional[str]): JSON lines file of the parent's profiler
+		run (Optional[str]): run id of the parent's profiler
+		cell (Tuple[str, pd.Timestamp]): region and `date_state`
+
+	Returns:
+		Tuple[Optional[pd.DataFrame], Optional[str]]: rows of `core_migration_matrix` or the error of the cell
+
+	"""
+
+	region, day = cell
+
+	try:
+		_load(directory, profile_path, run)
+
+		with _profiler.stage("matrix_cell", region=region, day=day.date()) as record:
+			result = _engines[region].matrix([day])
+			record.rows = len(result)
+	except Exception as e:
+		logger.exception("Cell ({}, {}) failed".format(region, day.date()))
+		return None, repr(e)
+
+	return result, None
+
+
+class ParallelExecutor:
+	"""Fans (region, day) cells of the migration matrix out across a process pool. \n
+	`RegionFrames` are saved once into .npy files and memory-mapped by every worker, so the data is shared through
+	the page cache instead of being pickled per task. Only cells' results travel back to the parent process. \n
+	Workers are forked by `start`, which has to be called before the job starts any thread (log writers, extraction,
+	uploads): a forked process gets only the forking thread, and locks held by other threads at that moment would
+	never be released in it. Records of workers are written by the parent's handlers.
+
+	Attributes:
+		workers (int): number of worker processes
+		directory (Optional[str]): where to put the arrays, e.g. /dev/shm; system temp directory if None
+
+	"""
+
+	__slots__ = ("workers", "directory", "__pool", "__listener")
+
+	def __init__(self, workers: int, directory: Optional[str] = None):
+		self.workers: int = workers
+		self.directory: Optional[str] = directory
+
+		self.__pool: Optional[ProcessPoolExecutor] = None
+		self.__listener: Optional[QueueListener] = None
+
+	def start(self) -> "ParallelExecutor":
+		"""Method forks the worker processes
+
+		Returns:
+			ParallelExecutor: the executor itself
+
+		"""
+
+		context = multiprocessing.get_context("fork")
+		log_queue = context.Queue()
+
+		self.__pool = ProcessPoolExecutor(
+			max_workers=self.workers, mp_context=context, initializer=_init_worker, initargs=(log_queue,)
+		)
+
+		# a pool of forked processes starts all of them with the first task
+		self.__pool.submit(int).result()
+
+		self.__listener = QueueListener(log_queue, RecordForwarder())
+		self.__listener.start()
+
+		return self
+
+	def stop(self):
+		"""Method waits for the workers to exit and writes their last records"""
+
+		if self.__pool is not None:
+			self.__pool.shutdown()
+			self.__pool = None
+
+		if self.__listener is not None:
+			self.__listener.stop()
+			self.__listener = None
+
+	def __enter__(self) -> "ParallelExecutor":
+		return self.start()
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.stop()
+
+	def matrix(
+			self, frames: RegionFrames, days: Iterable, regions: Optional[Tuple[str, ...]] = None,
+			failed: Optional[FailedCells] = None, profiler: Optional[Profiler] = None
+	) -> pd.DataFrame:
+		"""Method computes the migration matrix of every (region, day) cell in parallel
+
+		Args:
+			frames (RegionFrames): per-region data
+			days (Iterable): consecutive days
+			regions (Optional[Tuple[str, ...]]): regions, all regions of `frames` by default
+			failed (Optional[FailedCells]): failed cells are saved here and skipped, computed ones are removed from
+				here; without it a failed cell fails the whole matrix
+			profiler (Optional[Profiler]): records every cell in the workers
+
+		Raises:
+			RuntimeError: if a cell failed and there is no `failed`
+
+		Returns:
+			pd.DataFrame: rows of `core_migration_matrix` of all computed cells for a single bulk upload
+
+		"""
+
+		days = consecutive_days(days)
+
+		return self.matrix_cells(
+			frames, [(region, day) for region in (regions if regions else frames.regions) for day in days], failed,
+			profiler
+		)
+
+	def matrix_cells(
+			self, frames: RegionFrames, cells: List[Tuple[str, pd.Timestamp]], failed: Optional[FailedCells] = None,
+			profiler: Optional[Profiler] = None
+	) -> pd.DataFrame:
+		"""Method computes the migration matrix of arbitrary (region, day) cells in parallel. \n
+		Workers keep the arrays of the last call mapped till the next call or `stop`.
+
+		Args:
+			frames (RegionFrames): per-region data
+			cells (List[Tuple[str, pd.Timestamp]]): regions and days
+			failed (Optional[FailedCells]): failed cells are saved here and skipped, computed ones are removed from
+				here; without it a failed cell fails the whole matrix
+			profiler (Optional[Profiler]): records every cell in the workers
+
+		Raises:
+			RuntimeError: if the executor isn't started or a cell failed and there is no `failed`
+
+		Returns:
+			pd.DataFrame: rows of `core_migration_matrix` of all computed cells for a single bulk upload
+
+		"""
+
+		if not cells:
+			return StateEngine(frames).matrix([])
+
+		if self.__pool is None:
+			raise RuntimeError("Workers of the executor aren't started")
+
+		profiler = profiler if profiler else Profiler()
+		directory = tempfile.mkdtemp(prefix="etl_retention_", dir=self.directory)
+
+		try:
+			start = time.perf_counter()
+			frames.dump(directory)
+			logger.debug("Region frames saved to {} in {:.2f} s".format(directory, time.perf_counter() - start))
+
+			start = time.perf_counter()
+			progress = Progress("Matrix cells", len(cells))
+			results = [StateEngine(frames).matrix([])]
+			done = []
+
+			for (region, day), (result, error) in zip(cells, self.__pool.map(
+					partial(_matrix_cell, directory, profiler.path, profiler.run), cells,
+					chunksize=max(1, len(cells) // (self.workers * 4))
+			)):
+				if error is None:
+					results.append(result)
+					done.append((region, day.date()))
+					progress.advance(rows=len(result))
+				elif failed is None:
+					raise RuntimeError("Cell ({}, {}) of the matrix failed: {}".format(region, day.date(), error))
+				else:
+					failed.add("core_migration_matrix", region, day.date(), error)
+					progress.advance()
+
+			if failed is not None:
+				failed.remove("core_migration_matrix", done)
+
+			logger.info("Matrix of {} cells computed by {} workers in {:.2f} s".format(
+				len(cells), self.workers, time.perf_counter() - start
+			))
+		finally:
+			shutil.rmtree(directory, ignore_errors=True)
+
+		return pd.concat(results, ignore_index=True)
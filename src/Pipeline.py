@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import logging
+import queue
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+# marker of the end of a stream passed down the queues
+_DONE = object()
+
+# how often a blocked stage checks whether the pipeline was stopped, seconds
+_POLL: float = 0.1
+
+
+class StageStats:
+	"""Timings of one stage
+
+	Attributes:
+		name (str): stage name
+		items (int): number of processed items
+		busy (float): seconds spent in the stage's function
+		blocked_in (float): seconds spent waiting for input (previous stage is slower)
+		blocked_out (float): seconds spent waiting for room in the output queue (next stage is slower)
+
+	"""
+
+	__slots__ = ("name", "items", "busy", "blocked_in", "blocked_out")
+
+	def __init__(self, name: str):
+		self.name: str = name
+		self.items: int = 0
+		self.busy: float = 0.
+		self.blocked_in: float = 0.
+		self.blocked_out: float = 0.
+
+
+class Pipeline:
+	"""Stages running in their own threads and connected by bounded queues, so a stage works on the next item while
+	the following stage still handles the previous one (e.g. uploads of finished results overlap with computation
+	of the next ones). Bounded queues keep at most `queue_size` items between two stages. \n
+	Every stage's function takes an item and returns the item for the next stage. If a stage fails, the pipeline is
+	stopped and the exception is raised by `run`.
+
+	Attributes:
+		source (Iterable): items for the first stage
+		stages (List[Tuple[str, Callable[[Any], Any]]]): names and functions of stages in order
+		queue_size (int): capacity of every queue between stages
+		stats (Dict[str, StageStats]): timings by stage name, "source" is the iteration over `source`
+
+	"""
+
+	__slots__ = ("source", "stages", "queue_size", "stats", "__stop", "__errors")
+
+	def __init__(self, source: Iterable, stages: List[Tuple[str, Callable[[Any], Any]]], queue_size: int = 4):
+		self.source: Iterable = source
+		self.stages: List[Tuple[str, Callable[[Any], Any]]] = stages
+		self.queue_size: int = queue_size
+		self.stats: Dict[str, StageStats] = {}
+
+		self.__stop: threading.Event = threading.Event()
+		self.__errors: List[BaseException] = []
+
+	def __put(self, output: queue.Queue, item, stats: StageStats) -> bool:
+		"""Method waits for room in the queue, returns False if the pipeline was stopped meanwhile"""
+
+		start = time.perf_counter()
+
+		while not self.__stop.is_set():
+			try:
+				output.put(item, timeout=_POLL)
+				stats.blocked_out += time.perf_counter() - start
+				return True
+			except queue.Full:
+				continue
+
+		return False
+
+	def __get(self, input_queue: queue.Queue, stats: StageStats):
+		start = time.perf_counter()
+		item = input_queue.get()
+		stats.blocked_in += time.perf_counter() - start
+
+		return item
+
+	def __feed(self, output: queue.Queue, stats: StageStats):
+		try:
+			items = iter(self.source)
+
+			while not self.__stop.is_set():
+				start = time.perf_counter()
+
+				try:
+					item = next(items)
+				except StopIteration:
+					break
+				finally:
+					stats.busy += time.perf_counter() - start
+
+				if not self.__put(output, item, stats):
+					break
+
+				stats.items += 1
+		except Exception as e:
+			logger.exception("Source of the pipeline failed")
+			self.__errors.append(e)
+			self.__stop.set()
+		finally:
+			output.put(_DONE)
+
+	def __work(
+			self, function: Callable[[Any], Any], input_queue: queue.Queue, output: Optional[queue.Queue],
+			stats: StageStats
+	):
+		try:
+			while True:
+				item = self.__get(input_queue, stats)
+
+				if item is _DONE:
+					break
+
+				if self.__stop.is_set():
+					# items left after a failure are drained, so upstream stages don't stay blocked
+					continue
+
+				start = time.perf_counter()
+				result = function(item)
+				stats.busy += time.perf_counter() - start
+				stats.items += 1
+
+				if output is not None and not self.__put(output, result, stats):
+					continue
+		except Exception as e:
+			logger.exception("Stage {} of the pipeline failed".format(stats.name))
+			self.__errors.append(e)
+			self.__stop.set()
+
+			# the rest of the input is drained till the end of the stream
+			while self.__get(input_queue, stats) is not _DONE:
+				pass
+		finally:
+			if output is not None:
+				output.put(_DONE)
+
+	def run(self) -> Dict[str, StageStats]:
+		"""Method runs all stages till the source is exhausted
+
+		Raises:
+			Exception: the first exception of a failed stage
+
+		Returns:
+			Dict[str, StageStats]: timings by stage name
+
+		"""
+
+		start = time.perf_counter()
+
+		queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+		self.stats = {"source": StageStats("source")}
+
+		threads = [threading.Thread(
+			target=self.__feed, args=(queues[0], self.stats["source"]), name="pipeline-source", daemon=True
+		)]
+
+		for i, (name, function) in enumerate(self.stages):
+			self.stats[name] = StageStats(name)
+			threads.append(threading.Thread(
+				target=self.__work,
+				args=(function, queues[i], queues[i + 1] if i + 1 < len(queues) else None, self.stats[name]),
+				name="pipeline-{}".format(name),
+				daemon=True,
+			))
+
+		for thread in threads:
+			thread.start()
+
+		for thread in threads:
+			thread.join()
+
+		self.report(time.perf_counter() - start)
+
+		if self.__errors:
+			raise self.__errors[0]
+
+		return self.stats
+
+	def report(self, seconds: float):
+		"""Method logs timings of every stage
+
+		Args:
+			seconds (float): wall time of the pipeline
+
+		"""
+
+		logger.info("Pipeline finished in {:.2f} s".format(seconds))
+
+		for stats in self.stats.values():
+			logger.info(
+				"Stage {:<10} {:>6} items, busy {:8.2f} s, waiting for input {:8.2f} s, "
+				"waiting for output {:8.2f} s".format(
+					stats.name, stats.items, stats.busy, stats.blocked_in, stats.blocked_out
+				)
+			)
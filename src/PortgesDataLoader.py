@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 
-from typing import Tuple, Any, List
+from typing import Tuple, Any, List, Dict, Optional
 import logging
+import time
+import io
 
 import pandas as pd
 from numpy import int64, float64
@@ -9,6 +11,10 @@ from numpy import int64, float64
 from bogoslovskiy.model.db.Implementation import InHouseDbWorker
 
 from sqlalchemy.exc import SQLAlchemyError
+from psycopg2 import Error as PsycopgError
+from psycopg2.extras import execute_values
+
+from src.Profiler import Profiler
 
 
 logger = logging.getLogger(__name__)
@@ -20,13 +26,35 @@ class PostgresDataLoader:
 
 	Attributes:
 		db_worker (InHouseDbWorker): object to work with Postgres
+		metadata_ttl (Optional[float]): seconds after which cached table metadata is queried again (None - never)
+		page_size (int): number of rows per statement and per commit in "values" mode
+		profiler (Profiler): records every `upload_data` and `upload_batch` call
 
 	"""
 
-	__slots__ = ("db_worker",)
+	__slots__ = ("db_worker", "metadata_ttl", "page_size", "profiler", "__metadata")
+
+	# "insert" builds one literal `INSERT ... VALUES` statement, "copy" streams rows through `COPY ... FROM STDIN`,
+	# "values" sends parameterized pages of rows via `execute_values` and commits them one by one
+	UPLOAD_MODES: Tuple[str, ...] = ("insert", "copy", "values")
+
+	# number of rows written to the COPY stream at once
+	COPY_CHUNK_SIZE: int = 100000
 
-	def __init__(self, db_worker: InHouseDbWorker):
+	def __init__(
+			self,
+			db_worker: InHouseDbWorker,
+			metadata_ttl: Optional[float] = None,
+			page_size: int = 1000,
+			profiler: Optional[Profiler] = None,
+	):
 		self.db_worker: InHouseDbWorker = db_worker
+		self.metadata_ttl: Optional[float] = metadata_ttl
+		self.page_size: int = page_size
+		self.profiler: Profiler = profiler if profiler else Profiler()
+
+		# table name -> (columns, primary key columns, monotonic time of loading)
+		self.__metadata: Dict[str, Tuple[List[str], List[str], float]] = {}
 
 	@staticmethod
 	def quotes_for_strings(elem: Any) -> str:
@@ -115,23 +143,72 @@ class PostgresDataLoader:
 
 		return result
 
-	def __upsert_to_postgres(self, df: pd.DataFrame, table: str) -> Tuple[bool, str]:
-		"""Another shitty function here. It gets your pandas dataframe, creates an "INSERT ... ON CONFLICT" query string
-		from it and executes this query on a specified table.
+	def __get_table_metadata(self, table_name: str) -> Tuple[List[str], List[str]]:
+		"""Function returns columns and primary key columns of a specified table. \n
+		Both are queried once per table and then served from cache until they expire or get invalidated.
+
+		Args:
+			table_name (str): name of table in a database
+
+		Returns:
+			Tuple[List[str], List[str]]: columns and columns in primary key for the specified table
+
+		"""
+
+		cached = self.__metadata.get(table_name)
+
+		if cached is not None and (self.metadata_ttl is None or time.monotonic() - cached[2] < self.metadata_ttl):
+			return cached[0], cached[1]
+
+		return self.refresh_metadata(table_name)
+
+	def refresh_metadata(self, table_name: str) -> Tuple[List[str], List[str]]:
+		"""Method queries columns and primary key columns of a specified table and puts them into cache
+
+		Args:
+			table_name (str): name of table in a database
+
+		Returns:
+			Tuple[List[str], List[str]]: columns and columns in primary key for the specified table
+
+		"""
+
+		logger.debug("Method `refresh_metadata` was called for {}".format(table_name))
+
+		columns: List[str] = self.__get_table_columns(table_name)
+		constraints: List[str] = self.__get_table_constraints(table_name)
+
+		self.__metadata[table_name] = (columns, constraints, time.monotonic())
+
+		return columns, constraints
+
+	def invalidate_metadata(self, table_name: Optional[str] = None):
+		"""Method drops cached metadata of a specified table (or of all tables), e.g. after a schema migration
+
+		Args:
+			table_name (Optional[str]): name of table in a database, None drops the whole cache
+
+		"""
+
+		if table_name is None:
+			self.__metadata.clear()
+		else:
+			self.__metadata.pop(table_name, None)
+
+	def __build_upsert_query(self, df: pd.DataFrame, table: str) -> str:
+		"""Another shitty function here. It gets your pandas dataframe and creates an "INSERT ... ON CONFLICT" query
+		string from it for a specified table.
 
 		Args:
 			df (pd.DataFrame): data to be upserted
 			table (str): table name
 
 		Returns:
-			Tuple[bool, str]: tuple with a success status (bool) and an error description (str)
+			str: query string
 
 		"""
 
-		logger.debug("`upsert_to_postgres` method called")
-
-		columns: List[str] = self.__get_table_columns(table)
-		constraints: List[str] = self.__get_table_constraints(table)
+		columns, constraints = self.__get_table_metadata(table)
 
 		rows = [row[1:] for row in df[columns].itertuples()]
 
@@ -158,6 +235,24 @@ class PostgresDataLoader:
 
 		query += ' ;'
 
+		return query
+
+	def __upsert_to_postgres(self, df: pd.DataFrame, table: str) -> Tuple[bool, str]:
+		"""Function executes "INSERT ... ON CONFLICT" query built from your pandas dataframe on a specified table.
+
+		Args:
+			df (pd.DataFrame): data to be upserted
+			table (str): table name
+
+		Returns:
+			Tuple[bool, str]: tuple with a success status (bool) and an error description (str)
+
+		"""
+
+		logger.debug("`upsert_to_postgres` method called")
+
+		query: str = self.__build_upsert_query(df, table)
+
 		try:
 			self.db_worker.get_iterable(query)
 		except SQLAlchemyError as e:
@@ -165,13 +260,250 @@ class PostgresDataLoader:
 
 		return True, ''
 
-	def upload_data(self, table: str, data: pd.DataFrame) -> bool:
+	def __raw_connection(self):
+		"""Function returns a raw DBAPI (psycopg2) connection from the worker's engine pool
+
+		Returns:
+			psycopg2 connection: connection to be closed by the caller
+
+		"""
+
+		return self.db_worker.engine.raw_connection()
+
+	def __copy_upsert(self, cursor, df: pd.DataFrame, table: str) -> str:
+		"""Function streams your pandas dataframe via `COPY ... FROM STDIN` into a temporary table and then moves it
+		into a specified table with a single "INSERT ... SELECT ... ON CONFLICT" query.
+		The temporary table lives only until the end of the current transaction, committing is up to the caller.
+
+		Args:
+			cursor (psycopg2 cursor): cursor of an open transaction
+			df (pd.DataFrame): data to be upserted
+			table (str): table name
+
+		Returns:
+			str: "INSERT ... SELECT" query for error descriptions
+
+		"""
+
+		columns, constraints = self.__get_table_metadata(table)
+
+		columns_s = ', '.join(map(str, columns))
+		temp_table = "tmp_{}".format(table)
+
+		query = '''
+		INSERT INTO {0} ({1})
+		SELECT {1} FROM {2}
+		'''.format(table, columns_s, temp_table)
+
+		query += ' ON CONFLICT ({0}) DO UPDATE SET '.format(
+			', '.join(constraints)
+		)
+
+		query += ', '.join([i + ' = excluded.{}'.format(i) for i in columns])
+
+		query += ' ;'
+
+		cursor.execute(
+			"CREATE TEMP TABLE {0} (LIKE {1} INCLUDING DEFAULTS) ON COMMIT DROP".format(temp_table, table)
+		)
+
+		data = df[columns]
+
+		for start in range(0, len(data), self.COPY_CHUNK_SIZE):
+			buffer = io.StringIO()
+			data.iloc[start:start + self.COPY_CHUNK_SIZE].to_csv(
+				buffer, sep='\t', header=False, index=False, na_rep='\\N'
+			)
+			buffer.seek(0)
+
+			cursor.copy_expert(
+				"COPY {0} ({1}) FROM STDIN WITH (FORMAT csv, DELIMITER E'\\t', NULL '\\N')".format(
+					temp_table, columns_s
+				),
+				buffer
+			)
+
+		cursor.execute(query)
+
+		return query
+
+	def __values_upsert(self, connection, df: pd.DataFrame, table: str, page_size: int, commit_pages: bool) -> str:
+		"""Function upserts your pandas dataframe with a parameterized "INSERT ... VALUES %s ON CONFLICT" query,
+		sending `page_size` rows per statement. Rows are converted page by page, so only one page of python tuples
+		exists at a time.
+
+		Args:
+			connection (psycopg2 connection): connection of an open transaction
+			df (pd.DataFrame): data to be upserted
+			table (str): table name
+			page_size (int): number of rows per statement
+			commit_pages (bool): commit after every page instead of leaving the transaction to the caller
+
+		Returns:
+			str: query template for error descriptions
+
+		"""
+
+		columns, constraints = self.__get_table_metadata(table)
+
+		query = '''
+		INSERT INTO {0} ({1})
+		VALUES %s
+		'''.format(table, ', '.join(map(str, columns)))
+
+		query += ' ON CONFLICT ({0}) DO UPDATE SET '.format(
+			', '.join(constraints)
+		)
+
+		query += ', '.join([i + ' = excluded.{}'.format(i) for i in columns])
+
+		cursor = connection.cursor()
+		data = df[columns]
+
+		for start in range(0, len(data), page_size):
+			page = data.iloc[start:start + page_size].astype(object)
+			page = page.where(pd.notna(page), None)
+
+			execute_values(cursor, query, list(page.itertuples(index=False, name=None)), page_size=page_size)
+
+			if commit_pages:
+				connection.commit()
+
+		return query
+
+	def __values_upsert_to_postgres(self, df: pd.DataFrame, table: str, page_size: int) -> Tuple[bool, str]:
+		"""Function upserts your pandas dataframe page by page, committing every page. \n
+		A failure keeps the pages committed before it.
+
+		Args:
+			df (pd.DataFrame): data to be upserted
+			table (str): table name
+			page_size (int): number of rows per statement and per commit
+
+		Returns:
+			Tuple[bool, str]: tuple with a success status (bool) and an error description (str)
+
+		"""
+
+		logger.debug("`values_upsert_to_postgres` method called")
+
+		connection = self.__raw_connection()
+
+		try:
+			self.__values_upsert(connection, df, table, page_size, commit_pages=True)
+		except PsycopgError as e:
+			connection.rollback()
+			return False, str(e)
+		finally:
+			connection.close()
+
+		return True, ''
+
+	def __copy_upsert_to_postgres(self, df: pd.DataFrame, table: str) -> Tuple[bool, str]:
+		"""Function upserts your pandas dataframe into a specified table through `COPY` in its own transaction
+
+		Args:
+			df (pd.DataFrame): data to be upserted
+			table (str): table name
+
+		Returns:
+			Tuple[bool, str]: tuple with a success status (bool) and an error description (str)
+
+		"""
+
+		logger.debug("`copy_upsert_to_postgres` method called")
+
+		return self.__upsert_in_transaction([(table, df)], "copy")
+
+	def __merge_frames(self, frames: List[Tuple[str, pd.DataFrame]]) -> List[Tuple[str, pd.DataFrame]]:
+		"""Function joins frames of the same table into one frame (the temporary table of "copy" mode can only be
+		created once per transaction), in order of the first frame of every table. Rows with the same primary key keep
+		the values of the last frame, as if the frames were upserted one after another.
+
+		Args:
+			frames (List[Tuple[str, pd.DataFrame]]): pairs of a table name and data to be upserted into it
+
+		Returns:
+			List[Tuple[str, pd.DataFrame]]: one pair per table
+
+		"""
+
+		tables: Dict[str, List[pd.DataFrame]] = {}
+
+		for table, df in frames:
+			tables.setdefault(table, []).append(df)
+
+		merged: List[Tuple[str, pd.DataFrame]] = []
+
+		for table, dfs in tables.items():
+			if len(dfs) == 1:
+				merged.append((table, dfs[0]))
+				continue
+
+			constraints = self.__get_table_metadata(table)[1]
+			df = pd.concat(dfs, ignore_index=True, sort=False)
+			merged.append((table, df.drop_duplicates(subset=constraints, keep="last") if constraints else df))
+
+		return merged
+
+	def __upsert_in_transaction(self, frames: List[Tuple[str, pd.DataFrame]], mode: str) -> Tuple[bool, str]:
+		"""Function upserts several dataframes into their tables within one transaction. \n
+		Either all of them are committed or none of them. Frames of the same table are upserted together.
+
+		Args:
+			frames (List[Tuple[str, pd.DataFrame]]): pairs of a table name and data to be upserted into it
+			mode (str): one of `UPLOAD_MODES`
+
+		Returns:
+			Tuple[bool, str]: tuple with a success status (bool) and an error description (str)
+
+		"""
+
+		connection = self.__raw_connection()
+		query: str = ''
+
+		try:
+			cursor = connection.cursor()
+
+			for table, df in self.__merge_frames(frames):
+				if mode == "copy":
+					query = self.__copy_upsert(cursor, df, table)
+				elif mode == "values":
+					query = self.__values_upsert(connection, df, table, self.page_size, commit_pages=False)
+				else:
+					query = self.__build_upsert_query(df, table)
+					cursor.execute(query)
+
+			connection.commit()
+		except PsycopgError as e:
+			connection.rollback()
+			return False, str(e) + "\n\n{}\n".format(query)
+		finally:
+			connection.close()
+
+		return True, ''
+
+	def __check_mode(self, mode: str):
+		"""Function raises ValueError for unknown upload modes
+
+		Args:
+			mode (str): upload mode to check
+
+		"""
+
+		if mode not in self.UPLOAD_MODES:
+			raise ValueError("Unknown upload mode `{}`, expected one of {}".format(mode, self.UPLOAD_MODES))
+
+	def upload_data(self, table: str, data: pd.DataFrame, mode: str = "insert", page_size: Optional[int] = None) -> bool:
 		"""Main method for uploading data. \n
-		Under the hood it calls `__upsert_to_postgres` and then checks result.
+		Under the hood it calls `__upsert_to_postgres` (mode "insert"), `__copy_upsert_to_postgres` (mode "copy")
+		or `__values_upsert_to_postgres` (mode "values") and then checks result.
 
 		Args:
 			table (str): table name to upsert data
 			data (pd.DataFrame): data to upsert
+			mode (str): one of `UPLOAD_MODES`
+			page_size (Optional[int]): rows per statement and per commit in "values" mode, `self.page_size` if None
 
 		Returns:
 			bool: success status for data uploading
@@ -179,11 +511,58 @@ class PostgresDataLoader:
 		"""
 		logger.debug("Method `upload_data` was called")
 
-		result: Tuple[bool, str] = self.__upsert_to_postgres(data, table)
+		self.__check_mode(mode)
+
+		with self.profiler.stage("upload_data", table=table, mode=mode) as record:
+			record.rows = len(data)
+
+			if mode == "copy":
+				result: Tuple[bool, str] = self.__copy_upsert_to_postgres(data, table)
+			elif mode == "values":
+				result: Tuple[bool, str] = self.__values_upsert_to_postgres(
+					data, table, page_size if page_size else self.page_size
+				)
+			else:
+				result: Tuple[bool, str] = self.__upsert_to_postgres(data, table)
+
+			record.fields["uploaded"] = result[0]
 
 		if result[0]:
-			logger.info("Upsertion went well")
+			logger.debug("Upserted {} rows into {}".format(len(data), table))
 			return True
 		else:
 			logger.warning("Upserting to {} went wrong. Error:\n{}".format(table, result[1]))
 			return False
+
+	def upload_batch(self, frames: List[Tuple[str, pd.DataFrame]], mode: str = "copy") -> bool:
+		"""Method for uploading data into several tables at once. \n
+		All frames are upserted in a single transaction, so either all of them are saved or none of them
+		(pages of "values" mode are not committed separately here).
+
+		Args:
+			frames (List[Tuple[str, pd.DataFrame]]): pairs of a table name and data to upsert into it
+			mode (str): one of `UPLOAD_MODES`
+
+		Returns:
+			bool: success status for data uploading
+
+		"""
+		logger.debug("Method `upload_batch` was called")
+
+		self.__check_mode(mode)
+
+		with self.profiler.stage("upload_batch", tables=sorted({t for t, _ in frames}), mode=mode) as record:
+			record.rows = sum(len(data) for _, data in frames)
+			result: Tuple[bool, str] = self.__upsert_in_transaction(frames, mode)
+			record.fields["uploaded"] = result[0]
+
+		if result[0]:
+			logger.debug("Upserted batch of {} rows into {}".format(
+				sum(len(data) for _, data in frames), ", ".join(t for t, _ in frames)
+			))
+			return True
+		else:
+			logger.warning(
+				"Upserting batch to {} went wrong. Error:\n{}".format(", ".join(t for t, _ in frames), result[1])
+			)
+			return False
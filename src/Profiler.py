@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+import cProfile
+import datetime as dt
+import io
+import json
+import logging
+import os
+import pstats
+import resource
+import sys
+import threading
+import time
+import uuid
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def peak_rss_mb() -> float:
+	"""Function returns the peak resident set size of the process so far, MB (`ru_maxrss` is in KB on Linux)"""
+
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class StageRecord:
+	"""Measurements of one stage, the profiled code sets `rows` and may add `fields`
+
+	Attributes:
+		stage (str): stage name, e.g. "extract", "merge", "compute", "upload_data"
+		fields (Dict[str, Any]): context of the stage, e.g. table, region, days
+		rows (Optional[int]): number of rows the stage produced or handled
+
+	"""
+
+	__slots__ = ("stage", "fields", "rows")
+
+	def __init__(self, stage: str, fields: Dict[str, Any]):
+		self.stage: str = stage
+		self.fields: Dict[str, Any] = fields
+		self.rows: Optional[int] = None
+
+
+class Profiler:
+	"""Records wall time, CPU time, peak RSS and row counts of stages as JSON lines. \n
+	Every line has the run id, stage name, start time, `wall` seconds, `cpu` seconds of the whole process and
+	`thread_cpu` seconds of the stage's thread (they differ when stages run concurrently), `peak_rss_mb` after the
+	stage and `rss_growth_mb` - how much the stage raised the peak, `rows`, pid, thread, `ok` and stage's fields. \n
+	Lines are appended under a lock and the file is reopened for every line, so threads and worker processes of
+	the same run can share one file.
+
+	Attributes:
+		path (Optional[str]): JSON lines file, stages are only logged if None
+		run (str): id of the run, shared by all records of a job
+
+	"""
+
+	__slots__ = ("path", "run", "__lock")
+
+	def __init__(self, path: Optional[str] = None, run: Optional[str] = None):
+		self.path: Optional[str] = path
+		self.run: str = run if run else uuid.uuid4().hex[:12]
+
+		self.__lock: threading.Lock = threading.Lock()
+
+	def write(self, record: Dict[str, Any]):
+		"""Method appends one JSON line to `path`
+
+		Args:
+			record (Dict[str, Any]): JSON-serializable values, others are written as strings
+
+		"""
+
+		if not self.path:
+			return
+
+		line = json.dumps(record, default=str) + "\n"
+
+		with self.__lock:
+			try:
+				with open(self.path, "a") as f:
+					f.write(line)
+			except OSError:
+				logger.exception("Profile record wasn't written to {}".format(self.path))
+
+	@contextmanager
+	def stage(self, name: str, **fields) -> Iterator[StageRecord]:
+		"""Context manager measuring the code inside it. A failed stage is recorded with `ok` false and the
+		exception is raised further.
+
+		Args:
+			name (str): stage name
+			**fields: context of the stage
+
+		Yields:
+			StageRecord: record to set `rows` of
+
+		"""
+
+		record = StageRecord(name, fields)
+		ok = False
+
+		started = dt.datetime.now()
+		rss = peak_rss_mb()
+		cpu = time.process_time()
+		thread_cpu = time.thread_time()
+		wall = time.perf_counter()
+
+		try:
+			yield record
+			ok = True
+		finally:
+			wall = time.perf_counter() - wall
+			thread_cpu = time.thread_time() - thread_cpu
+			cpu = time.process_time() - cpu
+			peak = peak_rss_mb()
+
+			logger.debug("Stage {} {}: {} rows, wall {:.3f} s, cpu {:.3f} s, peak rss {:.0f} MB".format(
+				name, fields if fields else "", record.rows, wall, cpu, peak
+			))
+
+			self.write(dict({
+				"run": self.run,
+				"stage": name,
+				"started": started.isoformat(),
+				"wall": round(wall, 6),
+				"cpu": round(cpu, 6),
+				"thread_cpu": round(thread_cpu, 6),
+				"peak_rss_mb": round(peak, 1),
+				"rss_growth_mb": round(peak - rss, 1),
+				"rows": record.rows,
+				"pid": os.getpid(),
+				"thread": threading.current_thread().name,
+				"ok": ok,
+			}, **record.fields))
+
+
+class CallProfiler:
+	"""cProfile of the main thread and of every thread started while it runs (extraction, pipeline stages). \n
+	On `stop` the statistics of all threads are merged and saved in the pstats format to `path` (readable by
+	`pstats`, snakeviz, gprof2dot), and the `top` hottest calls by cumulative time are logged. Worker processes
+	aren't covered, attach `py-spy record --subprocesses` to the job for them.
+
+	Attributes:
+		path (str): where to save the statistics
+		top (int): number of calls to log
+
+	"""
+
+	__slots__ = ("path", "top", "__profiles", "__lock")
+
+	def __init__(self, path: str, top: int = 30):
+		self.path: str = path
+		self.top: int = top
+
+		self.__profiles: List[cProfile.Profile] = []
+		self.__lock: threading.Lock = threading.Lock()
+
+	def __new_profile(self) -> cProfile.Profile:
+		profile = cProfile.Profile()
+
+		with self.__lock:
+			self.__profiles.append(profile)
+
+		return profile
+
+	def __thread_hook(self, frame, event, arg):
+		"""Called by `threading` in every new thread before its target, replaces itself with the thread's cProfile"""
+
+		sys.setprofile(None)
+		self.__new_profile().enable()
+
+	def start(self):
+		threading.setprofile(self.__thread_hook)
+		self.__new_profile().enable()
+
+	def stop(self):
+		threading.setprofile(None)
+
+		with self.__lock:
+			profiles, self.__profiles = self.__profiles, []
+
+		if not profiles:
+			return
+
+		# the first profile is the one of the calling thread
+		profiles[0].disable()
+
+		stats = pstats.Stats(profiles[0])
+
+		for profile in profiles[1:]:
+			stats.add(profile)
+
+		stats.dump_stats(self.path)
+
+		stream = io.StringIO()
+		stats.stream = stream
+		stats.sort_stats("cumulative").print_stats(self.top)
+		logger.info("Profile saved to {}, hottest calls:\n{}".format(self.path, stream.getvalue()))
+
+	def __enter__(self) -> "CallProfiler":
+		self.start()
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.stop()
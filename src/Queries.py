@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+
+from typing import Optional
+import datetime as dt
+
+
+# payments from the monolith MySQL, `{since}` is the first date of payments, `{until}` is an optional upper bound
+PAYMENTS_QUERY: str = """
+select distinct 
+    id_user, 
+    date(po.date_created) as po_date, 
+    case 
+        when u.id_mirror in (1, 11, 14, 17, 20, 29,  30, 31, 32, 35, 37, 38, 40, 42, 43, 45) then 'cis' 
+        when u.id_mirror in (23, 26, 39, 44, 46, 47, 48, 49) then 'asia' 
+        when u.id_mirror = 41 then 'latam' 
+    end as region
+from 
+    x27_payment_orders po
+join 
+    x27_users u on u.id = po.id_user
+where 1=1
+    and po.date_created >= '{since}'{until}
+    and po.code_package not in ('code', 'learn', 'test')
+    and po.id_status in (3, 18, 21)
+    and u.id_partner not in ('-1', '1', '2', '3', '4', '5', 'mikula', 'tech_vb_test')
+order by id_user, po_date asc
+"""
+
+# logins from BigQuery, `{since}` is the first date of logins, `{until}` is an optional upper bound
+LOGINS_QUERY: str = """
+WITH users AS (
+  SELECT 
+    id, 
+    date_created, 
+    id_mirror 
+  FROM 
+    product.db_users 
+  WHERE 1=1
+      AND id_partner not in ('-1', '1', '2', '3', '4', '5', 'mikula', 'tech_vb_test', 'test')
+      AND gender = 'male'
+      -- AND (id_blocked is NULL or id_blocked = 0) 
+),
+
+logins AS (
+  SELECT 
+    id_user, 
+    date_created 
+  FROM 
+    product.users_logins 
+  WHERE 1=1
+    AND date_created >= TIMESTAMP('{since}'){until}
+)
+
+
+select distinct 
+    u.id as id_user, 
+    date(u.date_created) as u_date_created,
+    date(e.date_created) as date, 
+    case 
+        when u.id_mirror in (1, 11, 14, 17, 20, 29,  30, 31, 32, 35, 37, 38, 40, 42, 43, 45) then 'cis' 
+        when u.id_mirror in (23, 26, 39, 44, 46, 47, 48, 49) then 'asia' 
+        when u.id_mirror = 41 then 'latam' 
+    end as region
+from 
+   logins e
+inner join 
+    users u on u.id = e.id_user
+"""
+
+
+def payments_query(since: dt.date, until: Optional[dt.date] = None) -> str:
+	"""Function renders the payments query
+
+	Args:
+		since (dt.date): first date of payments
+		until (Optional[dt.date]): date after the last date of payments, no upper bound if None
+
+	Returns:
+		str: query for `monolith.get_dataframe`
+
+	"""
+
+	return PAYMENTS_QUERY.format(
+		since=str(since),
+		until="\n    and po.date_created < '{}'".format(until) if until else ""
+	)
+
+
+def logins_query(since: dt.date, until: Optional[dt.date] = None) -> str:
+	"""Function renders the logins query
+
+	Args:
+		since (dt.date): first date of logins
+		until (Optional[dt.date]): date after the last date of logins, no upper bound if None
+
+	Returns:
+		str: query for `bq.get_dataframe`
+
+	"""
+
+	return LOGINS_QUERY.format(
+		since=str(since),
+		until="\n    AND date_created < TIMESTAMP('{}')".format(until) if until else ""
+	)
+
+
+# counts of users in every state per (region, date_state) and of their activity during the next week, computed in
+# BigQuery over logins (`{logins}`, the logins query) and payments staged from the monolith (`{payments_table}`);
+# states and windows are the same as of `src.StateEngine.StateEngine`
+STATES_QUERY: str = """
+WITH logins AS (
+  SELECT DISTINCT id_user, u_date_created, date, region
+  FROM ({logins})
+  WHERE region IS NOT NULL
+),
+
+payments AS (
+  SELECT id_user, po_date, region, num
+  FROM `{payments_table}`
+  WHERE region IS NOT NULL
+),
+
+days AS (
+  SELECT date_state
+  FROM UNNEST(GENERATE_DATE_ARRAY(DATE '{first_day}', DATE '{last_day}')) AS date_state
+),
+
+first_payments AS (
+  SELECT region, id_user, MIN(po_date) AS first_po_date
+  FROM payments
+  GROUP BY region, id_user
+),
+
+registrations AS (
+  SELECT DISTINCT region, id_user, u_date_created
+  FROM logins
+  WHERE u_date_created IS NOT NULL
+),
+
+-- number of the payment made on a login day, 0 if there is no payment
+logins_num AS (
+  SELECT l.id_user, l.u_date_created, l.date, l.region, IFNULL(p.num, 0) AS num
+  FROM logins l
+  LEFT JOIN payments p ON p.id_user = l.id_user AND p.po_date = l.date AND p.region = l.region
+),
+
+events AS (
+  SELECT
+    d.date_state, l.region, l.id_user,
+    l.date BETWEEN DATE_SUB(d.date_state, INTERVAL 6 DAY) AND d.date_state AS login_week,
+    l.date BETWEEN DATE_SUB(d.date_state, INTERVAL 29 DAY) AND DATE_SUB(d.date_state, INTERVAL 7 DAY) AS login_month,
+    l.date BETWEEN DATE_SUB(d.date_state, INTERVAL 6 DAY) AND d.date_state
+      AND IFNULL(l.u_date_created < DATE_SUB(d.date_state, INTERVAL 6 DAY), FALSE) AS login_week_old,
+    FALSE AS created_week,
+    FALSE AS payment_week,
+    FALSE AS payment_week_first,
+    FALSE AS payment_week_more,
+    FALSE AS payment_month,
+    l.date > d.date_state AS next_login,
+    l.date > d.date_state AND l.num >= 1 AS next_payment,
+    l.date > d.date_state AND l.num = 1 AS next_first,
+    l.date > d.date_state AND l.num > 1 AS next_more
+  FROM days d
+  JOIN logins_num l ON l.date BETWEEN DATE_SUB(d.date_state, INTERVAL 29 DAY) AND DATE_ADD(d.date_state, INTERVAL 7 DAY)
+
+  UNION ALL
+
+  SELECT
+    d.date_state, r.region, r.id_user,
+    FALSE, FALSE, FALSE, TRUE, FALSE, FALSE, FALSE, FALSE, FALSE, FALSE, FALSE, FALSE
+  FROM days d
+  JOIN registrations r ON r.u_date_created BETWEEN DATE_SUB(d.date_state, INTERVAL 6 DAY) AND d.date_state
+
+  UNION ALL
+
+  SELECT
+    d.date_state, p.region, p.id_user,
+    FALSE, FALSE, FALSE, FALSE,
+    p.po_date >= DATE_SUB(d.date_state, INTERVAL 6 DAY) AS payment_week,
+    p.po_date >= DATE_SUB(d.date_state, INTERVAL 6 DAY) AND p.num = 1 AS payment_week_first,
+    p.po_date >= DATE_SUB(d.date_state, INTERVAL 6 DAY) AND p.num > 1 AS payment_week_more,
+    p.po_date <= DATE_SUB(d.date_state, INTERVAL 7 DAY) AS payment_month,
+    FALSE, FALSE, FALSE, FALSE
+  FROM days d
+  JOIN payments p ON p.po_date BETWEEN DATE_SUB(d.date_state, INTERVAL 29 DAY) AND d.date_state
+),
+
+users AS (
+  SELECT
+    e.date_state, e.region, e.id_user,
+    LOGICAL_OR(e.login_week) AS login_week,
+    LOGICAL_OR(e.login_month) AS login_month,
+    LOGICAL_OR(e.login_week_old) AS login_week_old,
+    LOGICAL_OR(e.created_week) AS created_week,
+    LOGICAL_OR(e.payment_week) AS payment_week,
+    LOGICAL_OR(e.payment_week_first) AS payment_week_first,
+    LOGICAL_OR(e.payment_week_more) AS payment_week_more,
+    LOGICAL_OR(e.payment_month) AS payment_month,
+    LOGICAL_OR(e.next_login) AS next_login,
+    LOGICAL_OR(e.next_payment) AS next_payment,
+    LOGICAL_OR(e.next_first) AS next_first,
+    LOGICAL_OR(e.next_more) AS next_more,
+    IFNULL(ANY_VALUE(f.first_po_date) <= e.date_state, FALSE) AS had_payments
+  FROM events e
+  LEFT JOIN first_payments f ON f.region = e.region AND f.id_user = e.id_user
+  GROUP BY e.date_state, e.region, e.id_user
+),
+
+states AS (
+  SELECT u.date_state, u.region, u.id_user, state, u.next_login, u.next_payment, u.next_first, u.next_more
+  FROM users u, UNNEST([
+    IF(u.created_week AND NOT u.had_payments, 'new_ns', NULL),
+    IF(u.login_week_old AND NOT u.had_payments, 'active_ns', NULL),
+    IF(u.login_month AND NOT u.had_payments AND NOT u.login_week, 'churn_ns', NULL),
+    IF(u.payment_week_first AND NOT u.payment_week_more, 'new_spenders', NULL),
+    IF(u.payment_week_more, 'active_spenders', NULL),
+    IF(u.login_week AND u.had_payments AND NOT u.payment_week, 'active_users', NULL),
+    IF(u.payment_month AND NOT u.login_week, 'churn_spenders', NULL)
+  ]) AS state
+  WHERE state IS NOT NULL
+)
+
+SELECT
+  region,
+  date_state,
+  state,
+  COUNT(*) AS size,
+  COUNTIF(next_login) AS login,
+  COUNTIF(next_login AND NOT next_payment) AS no_payments,
+  COUNTIF(next_first AND NOT next_more) AS only_first,
+  COUNTIF(next_more) AS more_payments,
+  COUNTIF(next_login AND NOT next_more) AS no_more_payments
+FROM states
+GROUP BY region, date_state, state
+"""
+
+
+def states_query(logins_since: dt.date, payments_table: str, first_day: dt.date, last_day: dt.date) -> str:
+	"""Function renders the states query
+
+	Args:
+		logins_since (dt.date): first date of logins
+		payments_table (str): BigQuery table with staged payments (`id_user`, `po_date`, `region`, `num`)
+		first_day (dt.date): first `date_state`
+		last_day (dt.date): last `date_state`
+
+	Returns:
+		str: query for `bq.get_dataframe`
+
+	"""
+
+	return STATES_QUERY.format(
+		logins=logins_query(logins_since),
+		payments_table=payments_table,
+		first_day=str(first_day),
+		last_day=str(last_day),
+	)
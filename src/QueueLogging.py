@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+from logging.handlers import QueueHandler, QueueListener
+from typing import List, Optional
+import logging
+import queue
+import sys
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class FlushingStreamHandler(logging.StreamHandler):
+	"""Stream handler writing to stdout (at the time of every record, so a replaced `sys.stdout` is respected) and
+	flushing after every record, so container logs can be followed in real time"""
+
+	def __init__(self):
+		super().__init__(sys.stdout)
+
+	def emit(self, record: logging.LogRecord):
+		self.stream = sys.stdout
+		super().emit(record)
+		self.flush()
+
+
+class RecordForwarder(logging.Handler):
+	"""Handler of records received from other processes (e.g. workers of a process pool): every record is passed to
+	the logger of the same name in this process, so it's written by the handlers configured here"""
+
+	def handle(self, record: logging.LogRecord):
+		target = logging.getLogger(record.name)
+
+		if target.isEnabledFor(record.levelno):
+			target.handle(record)
+
+
+class QueueLogging:
+	"""Logging of the job moved off the hot path. \n
+	The root logger only puts records into queues, stdout and the log file are written by their own `QueueListener`
+	threads, so a slow disk doesn't delay the console and neither of them delays the calculation. Stdout is flushed
+	after every record. Records left in the queues are written by `stop`.
+
+	Attributes:
+		path (str): log file
+		stream_level (int): minimal level of records written to stdout
+		file_level (int): minimal level of records written to the file
+		level (int): level of the root logger
+		fmt (str): format of records
+		datefmt (str): format of dates
+
+	"""
+
+	__slots__ = ("path", "stream_level", "file_level", "level", "fmt", "datefmt", "__listeners", "__handlers")
+
+	def __init__(
+			self,
+			path: str,
+			stream_level: int = logging.INFO,
+			file_level: int = logging.DEBUG,
+			level: int = logging.INFO,
+			fmt: str = "%(levelname)-8s%(asctime)s        %(module)-25.25s %(message)s \n",
+			datefmt: str = "%Y-%m-%d %H:%M:%S",
+	):
+		self.path: str = path
+		self.stream_level: int = stream_level
+		self.file_level: int = file_level
+		self.level: int = level
+		self.fmt: str = fmt
+		self.datefmt: str = datefmt
+
+		self.__listeners: List[QueueListener] = []
+		self.__handlers: List[logging.Handler] = []
+
+	def start(self):
+		"""Method replaces handlers of the root logger with queue handlers and starts the writer threads"""
+
+		formatter = logging.Formatter(self.fmt, self.datefmt)
+		root = logging.getLogger()
+
+		for handler in root.handlers[:]:
+			root.removeHandler(handler)
+
+		root.setLevel(self.level)
+
+		for handler, level in (
+				(FlushingStreamHandler(), self.stream_level),
+				(logging.FileHandler(self.path), self.file_level),
+		):
+			handler.setLevel(level)
+			handler.setFormatter(formatter)
+
+			log_queue: queue.Queue = queue.Queue(-1)
+			queue_handler = QueueHandler(log_queue)
+			queue_handler.setLevel(level)
+			root.addHandler(queue_handler)
+
+			listener = QueueListener(log_queue, handler, respect_handler_level=True)
+			listener.start()
+
+			self.__listeners.append(listener)
+			self.__handlers += [queue_handler, handler]
+
+	def stop(self):
+		"""Method writes the rest of the queued records, stops the writer threads and detaches the queue handlers"""
+
+		root = logging.getLogger()
+
+		for listener in self.__listeners:
+			listener.stop()
+
+		for handler in self.__handlers:
+			root.removeHandler(handler)
+			handler.close()
+
+		self.__listeners = []
+		self.__handlers = []
+
+	def __enter__(self) -> "QueueLogging":
+		self.start()
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.stop()
+
+
+class Progress:
+	"""Periodic progress summary of many small steps instead of a record per step. \n
+	`advance` is called after every step, a summary (done, share of the total, rows, elapsed time, estimate of the
+	time left) is logged at most once per `interval` seconds and once more by `finish`. Safe to call from several
+	threads.
+
+	Attributes:
+		name (str): what is being done
+		total (Optional[int]): number of steps if known
+		interval (float): seconds between summaries
+		done (int): steps done
+		rows (int): rows produced by the steps
+
+	"""
+
+	__slots__ = ("name", "total", "interval", "done", "rows", "__start", "__last", "__lock")
+
+	def __init__(self, name: str, total: Optional[int] = None, interval: float = 30.):
+		self.name: str = name
+		self.total: Optional[int] = total
+		self.interval: float = interval
+		self.done: int = 0
+		self.rows: int = 0
+
+		self.__start: float = time.perf_counter()
+		self.__last: float = self.__start
+		self.__lock: threading.Lock = threading.Lock()
+
+	def __summary(self, now: float) -> str:
+		elapsed = now - self.__start
+
+		if not self.total:
+			return "{}: {} done, {} rows, {:.0f} s".format(self.name, self.done, self.rows, elapsed)
+
+		left = elapsed / self.done * (self.total - self.done) if self.done else float("nan")
+
+		return "{}: {} of {} done ({:.0%}), {} rows, {:.0f} s, about {:.0f} s left".format(
+			self.name, self.done, self.total, self.done / self.total, self.rows, elapsed, left
+		)
+
+	def advance(self, steps: int = 1, rows: int = 0):
+		"""Method counts finished steps and logs a summary if `interval` has passed since the previous one
+
+		Args:
+			steps (int): number of finished steps
+			rows (int): rows produced by them
+
+		"""
+
+		with self.__lock:
+			self.done += steps
+			self.rows += rows
+			now = time.perf_counter()
+
+			if now - self.__last < self.interval:
+				return
+
+			self.__last = now
+			summary = self.__summary(now)
+
+		logger.info(summary)
+
+	def finish(self):
+		"""Method logs the final summary"""
+
+		with self.__lock:
+			summary = self.__summary(time.perf_counter())
+
+		logger.info(summary)
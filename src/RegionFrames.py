@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+from typing import Tuple, Dict, Optional
+import logging
+import json
+import os
+
+import numpy as np
+
+from src.FrameEncoder import EncodedFrame, NO_DAY
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class EventIndex:
+	"""Events of one kind (logins, payments, ...) of one region sorted by day. \n
+	Events of a day range are a contiguous slice found with a binary search.
+
+	Attributes:
+		days (np.ndarray): sorted day numbers of events
+		users (np.ndarray): dense indices of events' users
+		num (np.ndarray): number of the user's payment made on the event's row (0 if there is no payment)
+		created (np.ndarray): day number of the user's registration on the event's row (`NO_DAY` if unknown)
+
+	"""
+
+	__slots__ = ("days", "users", "num", "created")
+
+	FIELDS: Tuple[str, ...] = ("days", "users", "num", "created")
+
+	def __init__(
+			self, days: np.ndarray, users: np.ndarray, num: np.ndarray, created: np.ndarray, presorted: bool = False
+	):
+		order = slice(None) if presorted else np.argsort(days, kind="stable")
+
+		self.days: np.ndarray = days[order]
+		self.users: np.ndarray = users[order]
+		self.num: np.ndarray = num[order]
+		self.created: np.ndarray = created[order]
+
+	def __len__(self) -> int:
+		return len(self.days)
+
+	def between(self, start: Optional[int], end: Optional[int]) -> slice:
+		"""Method finds events with days in [start, end]
+
+		Args:
+			start (Optional[int]): first day number, None for no lower bound
+			end (Optional[int]): last day number, None for no upper bound
+
+		Returns:
+			slice: positions of the events
+
+		"""
+
+		left = 0 if start is None else int(np.searchsorted(self.days, start, side="left"))
+		right = len(self.days) if end is None else int(np.searchsorted(self.days, end, side="right"))
+
+		return slice(left, max(left, right))
+
+
+class RegionFrame:
+	"""Columnar, date-sorted data of one region
+
+	Attributes:
+		region (str): region name
+		logins (EventIndex): login rows by login date
+		payments (EventIndex): payment rows by payment date
+		created (EventIndex): distinct (user, registration date) pairs of users with logins by registration date
+
+	"""
+
+	__slots__ = ("region", "logins", "payments", "created")
+
+	INDEXES: Tuple[str, ...] = ("logins", "payments", "created")
+
+	def __init__(self, region: str, logins: EventIndex, payments: EventIndex, created: EventIndex):
+		self.region: str = region
+		self.logins: EventIndex = logins
+		self.payments: EventIndex = payments
+		self.created: EventIndex = created
+
+
+class RegionFrames:
+	"""Encoded merged frame of logins and payments split once into per-region `RegionFrame`s. \n
+	Users keep the dense numbering of the encoded frame, `ids` maps the numbers back to `id_user`.
+
+	Attributes:
+		regions (Tuple[str, ...]): regions in the order of their codes
+		ids (np.ndarray): `id_user` of every dense user index
+		frames (Dict[str, RegionFrame]): data by region
+
+	"""
+
+	__slots__ = ("regions", "ids", "frames")
+
+	def __init__(self, encoded: EncodedFrame):
+		self.regions: Tuple[str, ...] = encoded.regions
+		self.ids: np.ndarray = encoded.ids
+		self.frames: Dict[str, RegionFrame] = {}
+
+		data = encoded.data
+
+		region_codes = data["region"].values
+		users = data["user"].values
+		login = data["date"].values
+		created = data["u_date_created"].values
+		payment = data["po_date"].values
+		num = data["num"].values
+
+		for code, region in enumerate(self.regions):
+			in_region = region_codes == code
+
+			has_login = in_region & (login != NO_DAY)
+			has_payment = in_region & (payment != NO_DAY)
+
+			registrations = np.unique(
+				np.stack([created[has_login], users[has_login]]), axis=1
+			) if has_login.any() else np.empty((2, 0), dtype=np.int32)
+			registrations = registrations[:, registrations[0] != NO_DAY]
+
+			self.frames[region] = RegionFrame(
+				region,
+				logins=EventIndex(login[has_login], users[has_login], num[has_login], created[has_login]),
+				payments=EventIndex(payment[has_payment], users[has_payment], num[has_payment], created[has_payment]),
+				created=EventIndex(
+					registrations[0], registrations[1],
+					np.zeros(registrations.shape[1], dtype=np.int16), registrations[0]
+				),
+			)
+
+			logger.debug("Region {}: {} logins, {} payments, {} registrations".format(
+				region, has_login.sum(), has_payment.sum(), registrations.shape[1]
+			))
+
+	def __getitem__(self, region: str) -> RegionFrame:
+		return self.frames[region]
+
+	def dump(self, directory: str):
+		"""Method saves all arrays as .npy files, so other processes can memory-map them with `load`
+
+		Args:
+			directory (str): existing directory
+
+		"""
+
+		with open(os.path.join(directory, "regions.json"), "w") as f:
+			json.dump(list(self.regions), f)
+
+		np.save(os.path.join(directory, "ids.npy"), self.ids, allow_pickle=True)
+
+		for region, frame in self.frames.items():
+			for index in RegionFrame.INDEXES:
+				for field in EventIndex.FIELDS:
+					np.save(
+						os.path.join(directory, "{}.{}.{}.npy".format(region, index, field)),
+						getattr(getattr(frame, index), field)
+					)
+
+	@classmethod
+	def load(cls, directory: str, mmap: bool = True) -> "RegionFrames":
+		"""Method reads arrays saved by `dump`
+
+		Args:
+			directory (str): directory with saved arrays
+			mmap (bool): memory-map the arrays read-only instead of reading them into memory
+
+		Returns:
+			RegionFrames: per-region data
+
+		"""
+
+		mode = "r" if mmap else None
+
+		with open(os.path.join(directory, "regions.json")) as f:
+			regions = tuple(json.load(f))
+
+		frames = cls.__new__(cls)
+		frames.regions = regions
+		frames.ids = np.load(os.path.join(directory, "ids.npy"), allow_pickle=True)
+		frames.frames = {}
+
+		for region in regions:
+			indexes = {
+				index: EventIndex(
+					*[
+						np.load(os.path.join(directory, "{}.{}.{}.npy".format(region, index, field)), mmap_mode=mode)
+						for field in EventIndex.FIELDS
+					],
+					presorted=True
+				)
+				for index in RegionFrame.INDEXES
+			}
+
+			frames.frames[region] = RegionFrame(region, **indexes)
+
+		return frames
+
+	@property
+	def n_users(self) -> int:
+		return max(len(self.ids), 1)
@@ -0,0 +1,448 @@
+# -*- coding: utf-8 -*-
+
+from typing import Tuple, Optional, Callable, Dict
+
+import numpy as np
+import pandas as pd
+
+from src.FrameEncoder import NO_DAY, day_number
+from src.RegionFrames import RegionFrames, RegionFrame, EventIndex
+from src.StateEngine import MATRIX_STATES, NS_STATES, DESTINATIONS, destination_codes
+from src.UserSet import UserSet
+
+
+def _users(
+		index: EventIndex, start: Optional[int], end: Optional[int],
+		condition: Optional[Callable[[np.ndarray], np.ndarray]] = None
+) -> UserSet:
+	"""Function returns users with events in [start, end], found by a binary search over sorted days
+
+	Args:
+		index (EventIndex): events
+		start (Optional[int]): first day number, None for no lower bound
+		end (Optional[int]): last day number, None for no upper bound
+		condition (Optional[Callable[[np.ndarray], np.ndarray]]): filter over `num` of the events
+
+	Returns:
+		UserSet: dense user indices
+
+	"""
+
+	span = index.between(start, end)
+	users = index.users[span]
+
+	if condition is not None:
+		users = users[condition(index.num[span])]
+
+	return UserSet(users)
+
+
+def _next_week(frame: RegionFrame, day: int, res: UserSet) -> Tuple[UserSet, UserSet, UserSet, UserSet]:
+	"""Function returns users of `res` who logged in during next 7 days and who paid on those login days
+
+	Args:
+		frame (RegionFrame): data of a region
+		day (int): day number of `now`
+		res (UserSet): users in a source state
+
+	Returns:
+		Tuple[UserSet, UserSet, UserSet, UserSet]: logged in, paid, made the first payment, made not the first
+			payment
+
+	"""
+
+	span = frame.logins.between(day + 1, day + 7)
+	users, num = frame.logins.users[span], frame.logins.num[span]
+
+	in_res = res.contains(users)
+	users, num = users[in_res], num[in_res]
+
+	return (
+		UserSet(users),
+		UserSet(users[num >= 1]),
+		UserSet(users[num == 1]),
+		UserSet(users[num > 1]),
+	)
+
+
+def _ns_transitions(matrix: pd.DataFrame, state: str, frame: RegionFrame, day: int, res: UserSet) -> pd.DataFrame:
+	"""Function puts next-week transitions of non-spenders `res` into the `state` row of the matrix"""
+
+	login, paid, first_payment, more_payments = _next_week(frame, day, res)
+
+	matrix.loc[state, 'active_ns'] = len(login.difference(paid)) / len(res) * 100
+	matrix.loc[state, 'churn_ns'] = (len(res) - len(login)) / len(res) * 100
+	matrix.loc[state, 'new_spenders'] = len(first_payment.difference(more_payments)) / len(res) * 100
+	matrix.loc[state, 'active_spenders'] = len(more_payments) / len(res) * 100
+
+	return matrix
+
+
+def _spenders_transitions(
+		matrix: pd.DataFrame, state: str, frame: RegionFrame, day: int, res: UserSet
+) -> pd.DataFrame:
+	"""Function puts next-week transitions of spenders `res` into the `state` row of the matrix"""
+
+	login, _, _, more_payments = _next_week(frame, day, res)
+
+	matrix.loc[state, 'churn_spenders'] = (len(res) - len(login)) / len(res) * 100
+	matrix.loc[state, 'active_users'] = len(login.difference(more_payments)) / len(res) * 100
+	matrix.loc[state, 'active_spenders'] = len(more_payments) / len(res) * 100
+
+	return matrix
+
+
+# --------------------------------------------------------------------------------------------------------------------
+#                                                   STATES
+# --------------------------------------------------------------------------------------------------------------------
+def new_ns_users(frame: RegionFrame, day: int) -> UserSet:
+	"""Function returns users registered during the last week without payments"""
+
+	had_payments = _users(frame.payments, None, day, lambda num: num >= 1)
+	date_created = _users(frame.created, day - 6, day)
+
+	return date_created.difference(had_payments)
+
+
+def active_ns_users(frame: RegionFrame, day: int) -> UserSet:
+	"""Function returns users registered earlier without payments who logged in during the last week"""
+
+	had_payments = _users(frame.payments, None, day, lambda num: num >= 1)
+
+	span = frame.logins.between(day - 6, day)
+	created = frame.logins.created[span]
+	login_and_date_created = UserSet(frame.logins.users[span][(created != NO_DAY) & (created < day - 6)])
+
+	return login_and_date_created.difference(had_payments)
+
+
+def churn_ns_users(frame: RegionFrame, day: int) -> UserSet:
+	"""Function returns users without payments who logged in 30 to 7 days ago but not during the last week"""
+
+	had_payments = _users(frame.payments, None, day, lambda num: num >= 1)
+	login_last_month = _users(frame.logins, day - 29, day - 7)
+	login_last_week = _users(frame.logins, day - 6, day)
+
+	return login_last_month.difference(had_payments).difference(login_last_week)
+
+
+def new_spenders_users(frame: RegionFrame, day: int) -> UserSet:
+	"""Function returns users who made their first payment during the last week"""
+
+	count_1 = _users(frame.payments, day - 6, day, lambda num: num == 1)
+	count_more = _users(frame.payments, day - 6, day, lambda num: num > 1)
+
+	return count_1.difference(count_more)
+
+
+def active_spenders_users(frame: RegionFrame, day: int) -> UserSet:
+	"""Function returns users who made a repeated payment during the last week"""
+
+	return _users(frame.payments, day - 6, day, lambda num: num > 1)
+
+
+def active_users_users(frame: RegionFrame, day: int) -> UserSet:
+	"""Function returns payers who logged in without paying during the last week"""
+
+	had_payments = _users(frame.payments, None, day, lambda num: num >= 1)
+	new_login = _users(frame.logins, day - 6, day)
+	payment_last_week = _users(frame.payments, day - 6, day)
+
+	return new_login.intersection(had_payments).difference(payment_last_week)
+
+
+def churn_spenders_users(frame: RegionFrame, day: int) -> UserSet:
+	"""Function returns users who paid 30 to 7 days ago and didn't log in during the last week"""
+
+	early = _users(frame.payments, day - 29, day - 7)
+	new = _users(frame.logins, day - 6, day)
+
+	return early.difference(new)
+
+
+# --------------------------------------------------------------------------------------------------------------------
+#                                                   MATRIX
+# --------------------------------------------------------------------------------------------------------------------
+def new_ns_validator(frames: RegionFrames, now, region: str) -> pd.DataFrame:
+	"""Function returns the `new_ns` row of `StateFunctions.new_ns_validator` from per-region data"""
+
+	frame, day = frames[region], day_number(now)
+	return _ns_transitions(pd.DataFrame(), 'new_ns', frame, day, new_ns_users(frame, day))
+
+
+def active_ns_validator(frames: RegionFrames, now, region: str) -> pd.DataFrame:
+	"""Function returns the `active_ns` row of `StateFunctions.active_ns_validator` from per-region data"""
+
+	frame, day = frames[region], day_number(now)
+	return _ns_transitions(pd.DataFrame(), 'active_ns', frame, day, active_ns_users(frame, day))
+
+
+def churn_ns_validator(frames: RegionFrames, now, region: str) -> pd.DataFrame:
+	"""Function returns the `churn_ns` row of `StateFunctions.churn_ns_validator` from per-region data"""
+
+	frame, day = frames[region], day_number(now)
+	return _ns_transitions(pd.DataFrame(), 'churn_ns', frame, day, churn_ns_users(frame, day))
+
+
+def new_spenders_validator(frames: RegionFrames, now, region: str) -> pd.DataFrame:
+	"""Function returns the `new_spenders` row of `StateFunctions.new_spenders_validator` from per-region data"""
+
+	frame, day = frames[region], day_number(now)
+	return _spenders_transitions(pd.DataFrame(), 'new_spenders', frame, day, new_spenders_users(frame, day))
+
+
+def active_spenders_validator(frames: RegionFrames, now, region: str) -> pd.DataFrame:
+	"""Function returns the `active_spenders` row of `StateFunctions.active_spenders_validator`"""
+
+	frame, day = frames[region], day_number(now)
+	return _spenders_transitions(pd.DataFrame(), 'active_spenders', frame, day, active_spenders_users(frame, day))
+
+
+def active_users_validator(frames: RegionFrames, now, region: str) -> pd.DataFrame:
+	"""Function returns the `active_users` row of `StateFunctions.active_users_validator` from per-region data"""
+
+	frame, day = frames[region], day_number(now)
+	return _spenders_transitions(pd.DataFrame(), 'active_users', frame, day, active_users_users(frame, day))
+
+
+def churn_spenders_validator(frames: RegionFrames, now, region: str) -> pd.DataFrame:
+	"""Function returns the `churn_spenders` row of `StateFunctions.churn_spenders_validator`"""
+
+	frame, day = frames[region], day_number(now)
+	return _spenders_transitions(pd.DataFrame(), 'churn_spenders', frame, day, churn_spenders_users(frame, day))
+
+
+def create_matrix(frames: RegionFrames, now, region: str) -> pd.DataFrame:
+	"""Function returns the same rows as `StateFunctions.create_matrix` from per-region data"""
+
+	l = [
+		new_ns_validator(frames, now, region),
+		active_ns_validator(frames, now, region),
+		churn_ns_validator(frames, now, region),
+		new_spenders_validator(frames, now, region),
+		active_spenders_validator(frames, now, region),
+		active_users_validator(frames, now, region),
+		churn_spenders_validator(frames, now, region),
+	]
+
+	return pd.concat(l)
+
+
+def matrix_users(frame: RegionFrame, day: int) -> Dict[str, UserSet]:
+	"""Function computes users of all seven source states of the migration matrix of a day in one pass. \n
+	Sets shared by several states (payments before the day, logins and payments of the last week) are built once.
+
+	Args:
+		frame (RegionFrame): data of a region
+		day (int): day number of `now`
+
+	Returns:
+		Dict[str, UserSet]: users by state in the order of `create_matrix`
+
+	"""
+
+	users = series_users(frame, day)
+
+	had_payments = _users(frame.payments, None, day, lambda num: num >= 1)
+	login_month = _users(frame.logins, day - 29, day - 7)
+	login_week = _users(frame.logins, day - 6, day)
+
+	users["churn_ns"] = login_month - had_payments - login_week
+
+	return {state: users[state] for state in MATRIX_STATES}
+
+
+def transition_table(frame: RegionFrame, day: int) -> pd.DataFrame:
+	"""Function assigns every user of every source state the destination state of the next week. \n
+	Next 7 days of logins are read once and joined with all source states together.
+
+	Args:
+		frame (RegionFrame): data of a region
+		day (int): day number of `now`
+
+	Returns:
+		pd.DataFrame: columns `user` (dense index), `source_state` and `destination_state` as indices into
+			`MATRIX_STATES` and `DESTINATIONS`
+
+	"""
+
+	span = frame.logins.between(day + 1, day + 7)
+	users, num = frame.logins.users[span], frame.logins.num[span]
+	login, first_payment, more_payments = UserSet(users), UserSet(users[num == 1]), UserSet(users[num > 1])
+
+	sources = matrix_users(frame, day)
+
+	return pd.DataFrame({
+		"user": np.concatenate([res.values for res in sources.values()]),
+		"source_state": np.repeat(np.arange(len(MATRIX_STATES)), [len(res) for res in sources.values()]),
+		"destination_state": np.concatenate([np.empty(0, dtype=np.int64)] + [
+			destination_codes(
+				state, login.contains(res.values), first_payment.contains(res.values),
+				more_payments.contains(res.values)
+			)
+			for state, res in sources.items()
+		]),
+	})
+
+
+def calculate_matrix(frames: RegionFrames, now, region: str) -> pd.DataFrame:
+	"""Function returns the same rows as `create_matrix`, counting all transitions of a (day, region) at once. \n
+	A source state without users gets a row of NaN instead of raising ZeroDivisionError.
+
+	Args:
+		frames (RegionFrames): per-region data
+		now (datetime.datetime): `date_state`
+		region (str): region
+
+	Returns:
+		pd.DataFrame: percents of users moving from every source state (index) into every destination state
+			(columns) during the next week
+
+	"""
+
+	table = transition_table(frames[region], day_number(now))
+
+	counts = np.bincount(
+		table["source_state"].values * len(DESTINATIONS) + table["destination_state"].values,
+		minlength=len(MATRIX_STATES) * len(DESTINATIONS)
+	).reshape(len(MATRIX_STATES), len(DESTINATIONS))
+
+	size = counts.sum(axis=1).astype(np.float64)
+	empty = size == 0
+
+	percents = np.full(counts.shape, np.nan)
+	percents[~empty] = counts[~empty] / size[~empty][:, np.newaxis] * 100
+
+	matrix = pd.DataFrame(percents, index=list(MATRIX_STATES), columns=list(DESTINATIONS))
+
+	# destinations that a source state can't move into stay NaN, as in `create_matrix`
+	matrix.loc[list(NS_STATES), ["churn_spenders", "active_users"]] = np.nan
+	matrix.loc[[i for i in MATRIX_STATES if i not in NS_STATES], ["active_ns", "churn_ns", "new_spenders"]] = np.nan
+
+	return matrix
+
+
+# --------------------------------------------------------------------------------------------------------------------
+#                                                   SERIES
+# --------------------------------------------------------------------------------------------------------------------
+def _series(now, region: str, state: str, res: UserSet) -> pd.DataFrame:
+	"""Function returns the `core_state_series` row of a state with the number of its users"""
+
+	return pd.DataFrame(
+		{
+			"region": region,
+			"date_state": str(now)[0:10],
+			"state": state,
+			"users_count": [len(res)],
+		}
+	)
+
+
+def active_users_series(frames: RegionFrames, now, region: str) -> pd.DataFrame:
+	"""Function returns the row of `StateFunctions.active_users_series` from per-region data"""
+
+	return _series(now, region, "active_users", active_users_users(frames[region], day_number(now)))
+
+
+def new_spenders_series(frames: RegionFrames, now, region: str) -> pd.DataFrame:
+	"""Function returns the row of `StateFunctions.new_spenders_series` from per-region data"""
+
+	return _series(now, region, "new_spenders", new_spenders_users(frames[region], day_number(now)))
+
+
+def active_spenders_series(frames: RegionFrames, now, region: str) -> pd.DataFrame:
+	"""Function returns the row of `StateFunctions.active_spenders_series` from per-region data"""
+
+	return _series(now, region, "active_spenders", active_spenders_users(frames[region], day_number(now)))
+
+
+def churn_spenders_series(frames: RegionFrames, now, region: str) -> pd.DataFrame:
+	"""Function returns the row of `StateFunctions.churn_spenders_series` from per-region data"""
+
+	return _series(now, region, "churn_spenders", churn_spenders_users(frames[region], day_number(now)))
+
+
+def new_ns_series(frames: RegionFrames, now, region: str) -> pd.DataFrame:
+	"""Function returns the row of `StateFunctions.new_ns_series` from per-region data"""
+
+	return _series(now, region, "new_ns", new_ns_users(frames[region], day_number(now)))
+
+
+def active_ns_series(frames: RegionFrames, now, region: str) -> pd.DataFrame:
+	"""Function returns the row of `StateFunctions.active_ns_series` from per-region data"""
+
+	return _series(now, region, "active_ns", active_ns_users(frames[region], day_number(now)))
+
+
+def create_series(frames: RegionFrames, now, region: str) -> pd.DataFrame:
+	"""Function returns the same rows as `StateFunctions.create_series` from per-region data"""
+
+	return pd.concat([
+		new_ns_series(frames, now, region),
+		active_ns_series(frames, now, region),
+		new_spenders_series(frames, now, region),
+		active_spenders_series(frames, now, region),
+		churn_spenders_series(frames, now, region),
+		active_users_series(frames, now, region),
+	])
+
+
+def series_users(frame: RegionFrame, day: int) -> Dict[str, UserSet]:
+	"""Function computes users of all six `core_state_series` states of a day in one pass. \n
+	Sets shared by several states (payments before the day, logins and payments of the last week) are built once.
+
+	Args:
+		frame (RegionFrame): data of a region
+		day (int): day number of `now`
+
+	Returns:
+		Dict[str, UserSet]: users by state in the order of `create_series`
+
+	"""
+
+	had_payments = _users(frame.payments, None, day, lambda num: num >= 1)
+	login_week = _users(frame.logins, day - 6, day)
+	date_created = _users(frame.created, day - 6, day)
+	payment_early = _users(frame.payments, day - 29, day - 7)
+
+	span = frame.payments.between(day - 6, day)
+	users, num = frame.payments.users[span], frame.payments.num[span]
+	payment_week, payment_week_first, payment_week_more = UserSet(users), UserSet(users[num == 1]), UserSet(users[num > 1])
+
+	span = frame.logins.between(day - 6, day)
+	created = frame.logins.created[span]
+	login_week_old = UserSet(frame.logins.users[span][(created != NO_DAY) & (created < day - 6)])
+
+	return {
+		"new_ns": date_created - had_payments,
+		"active_ns": login_week_old - had_payments,
+		"new_spenders": payment_week_first - payment_week_more,
+		"active_spenders": payment_week_more,
+		"churn_spenders": payment_early - login_week,
+		"active_users": (login_week & had_payments) - payment_week,
+	}
+
+
+def calculate_series(frames: RegionFrames, now, region: str) -> pd.DataFrame:
+	"""Function returns the same rows as `create_series`, computing all states of a (day, region) together
+
+	Args:
+		frames (RegionFrames): per-region data
+		now (datetime.datetime): `date_state`
+		region (str): region
+
+	Returns:
+		pd.DataFrame: rows of `core_state_series`
+
+	"""
+
+	users = series_users(frames[region], day_number(now))
+
+	return pd.DataFrame(
+		{
+			"region": region,
+			"date_state": str(now)[0:10],
+			"state": list(users.keys()),
+			"users_count": [len(i) for i in users.values()],
+		}
+	)
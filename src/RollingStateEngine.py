@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+
+from typing import Tuple, Dict, Iterable, Optional
+import logging
+
+import numpy as np
+import pandas as pd
+
+from src.FrameEncoder import NO_DAY, to_day_numbers
+from src.RegionFrames import RegionFrames, RegionFrame
+from src.StateEngine import (
+	MATRIX_STATES, SERIES_STATES, consecutive_days, series_frame, matrix_frame,
+)
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+# day after which an event never leaves its window
+NEVER: int = np.iinfo(np.int64).max
+
+# next week activity counted for every source state of the migration matrix
+TRANSITIONS: Tuple[str, ...] = ("login", "no_payments", "only_first", "more_payments", "no_more_payments")
+
+
+class _Counter:
+	"""Number of a user's events inside a sliding window. \n
+	An event is inside the window for `date_state` days in [enter, leave), so moving the window by one day means
+	adding events entering on the new day and dropping events leaving on it.
+
+	Attributes:
+		counts (np.ndarray): number of events inside the window by dense user index
+
+	"""
+
+	__slots__ = ("counts", "__enter", "__enter_users", "__leave", "__leave_users")
+
+	def __init__(self, users: np.ndarray, enter: np.ndarray, leave: np.ndarray, n_users: int):
+		keep = enter < leave
+		users, enter, leave = users[keep], enter[keep], leave[keep]
+
+		by_enter = np.argsort(enter, kind="stable")
+		by_leave = np.argsort(leave, kind="stable")
+
+		self.__enter: np.ndarray = enter[by_enter]
+		self.__enter_users: np.ndarray = users[by_enter]
+		self.__leave: np.ndarray = leave[by_leave]
+		self.__leave_users: np.ndarray = users[by_leave]
+
+		self.counts: np.ndarray = np.zeros(n_users, dtype=np.int32)
+
+	def changes(self, day: int, first: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+		"""Method finds events entering and leaving the window when it moves to a day
+
+		Args:
+			day (int): day number of the new day
+			first (bool): the window starts on this day, so every event entered on or before it counts
+
+		Returns:
+			Tuple[np.ndarray, np.ndarray]: users of entering events and users of leaving events
+
+		"""
+
+		start_enter = 0 if first else np.searchsorted(self.__enter, day, side="left")
+		start_leave = 0 if first else np.searchsorted(self.__leave, day, side="left")
+
+		return (
+			self.__enter_users[start_enter:np.searchsorted(self.__enter, day, side="right")],
+			self.__leave_users[start_leave:np.searchsorted(self.__leave, day, side="right")],
+		)
+
+	def apply(self, entered: np.ndarray, left: np.ndarray):
+		"""Method updates counts with entering and leaving events
+
+		Args:
+			entered (np.ndarray): users of entering events
+			left (np.ndarray): users of leaving events
+
+		"""
+
+		np.add.at(self.counts, entered, 1)
+		np.subtract.at(self.counts, left, 1)
+
+
+class RollingStateEngine:
+	"""Incremental calculation of users' states for `core_state_series` and `core_migration_matrix`. \n
+	Per-user counters of events inside the 7-day, 30-day and next-week windows are slid forward one day at a time.
+	States and transitions are functions of the counters, so only users with events entering or leaving the windows
+	on a day are re-evaluated, and daily cost scales with one day's events instead of the whole window.
+	Results are the same as of `StateEngine`.
+
+	Attributes:
+		frames (RegionFrames): per-region data
+		regions (Tuple[str, ...]): regions to calculate states for, all regions of `frames` by default
+
+	"""
+
+	__slots__ = ("frames", "regions")
+
+	def __init__(self, frames: RegionFrames, regions: Optional[Tuple[str, ...]] = None):
+		self.frames: RegionFrames = frames
+		self.regions: Tuple[str, ...] = regions if regions else frames.regions
+
+	def __counters(self, frame: RegionFrame) -> Dict[str, _Counter]:
+		"""Function creates counters of every window of a region
+
+		Args:
+			frame (RegionFrame): data of a region
+
+		Returns:
+			Dict[str, _Counter]: counters by name
+
+		"""
+
+		n_users = self.frames.n_users
+		logins, payments, created = frame.logins, frame.payments, frame.created
+
+		def counter(index, mask, enter, leave):
+			return _Counter(index.users[mask], enter[mask], leave[mask], n_users)
+
+		every_login = np.ones(len(logins), dtype=bool)
+		every_payment = payments.num >= 1
+		known = logins.created != NO_DAY
+		old_enter = np.where(known, np.maximum(logins.days, np.where(known, logins.created, 0) + 7), NEVER)
+
+		return {
+			# windows before `now`: [now - 6, now] and [now - 29, now - 7]
+			"login_week": counter(logins, every_login, logins.days, logins.days + 7),
+			"login_month": counter(logins, every_login, logins.days + 7, logins.days + 30),
+			"old_login_week": counter(logins, known, old_enter, logins.days + 7),
+			"created_week": counter(created, np.ones(len(created), dtype=bool), created.days, created.days + 7),
+			"paid": counter(payments, every_payment, payments.days, np.full(len(payments), NEVER)),
+			"payment_week": counter(payments, every_payment, payments.days, payments.days + 7),
+			"payment_week_first": counter(payments, payments.num == 1, payments.days, payments.days + 7),
+			"payment_week_more": counter(payments, payments.num > 1, payments.days, payments.days + 7),
+			"payment_month": counter(payments, every_payment, payments.days + 7, payments.days + 30),
+			# next week after `now`: [now + 1, now + 7]
+			"next_login": counter(logins, every_login, logins.days - 7, logins.days),
+			"next_payment": counter(logins, logins.num >= 1, logins.days - 7, logins.days),
+			"next_first": counter(logins, logins.num == 1, logins.days - 7, logins.days),
+			"next_more": counter(logins, logins.num > 1, logins.days - 7, logins.days),
+		}
+
+	@staticmethod
+	def __indicators(counters: Dict[str, _Counter], users: np.ndarray) -> Dict[Tuple[str, str], np.ndarray]:
+		"""Function evaluates states and transitions of users out of their counters
+
+		Args:
+			counters (Dict[str, _Counter]): counters of a region
+			users (np.ndarray): dense user indices
+
+		Returns:
+			Dict[Tuple[str, str], np.ndarray]: boolean masks by (state, "size") and by (state, next week activity)
+
+		"""
+
+		c = {name: counter.counts[users] > 0 for name, counter in counters.items()}
+
+		states = {
+			"new_ns": c["created_week"] & ~c["paid"],
+			"active_ns": c["old_login_week"] & ~c["paid"],
+			"churn_ns": c["login_month"] & ~c["paid"] & ~c["login_week"],
+			"new_spenders": c["payment_week_first"] & ~c["payment_week_more"],
+			"active_spenders": c["payment_week_more"],
+			"active_users": c["login_week"] & c["paid"] & ~c["payment_week"],
+			"churn_spenders": c["payment_month"] & ~c["login_week"],
+		}
+
+		targets = {
+			"login": c["next_login"],
+			"no_payments": c["next_login"] & ~c["next_payment"],
+			"only_first": c["next_first"] & ~c["next_more"],
+			"more_payments": c["next_more"],
+			"no_more_payments": c["next_login"] & ~c["next_more"],
+		}
+
+		indicators = {}
+
+		for state, mask in states.items():
+			indicators[(state, "size")] = mask
+
+			for target, target_mask in targets.items():
+				indicators[(state, target)] = mask & target_mask
+
+		return indicators
+
+	def __roll(self, days: pd.DatetimeIndex) -> Dict[Tuple[str, str], np.ndarray]:
+		"""Function slides windows over the requested days for every region
+
+		Args:
+			days (pd.DatetimeIndex): consecutive days
+
+		Returns:
+			Dict[Tuple[str, str], np.ndarray]: users count of shape (regions, days) by (state, "size") and
+				by (state, next week activity)
+
+		"""
+
+		first_day = int(to_day_numbers(pd.Series(days[:1]))[0])
+		totals: Dict[Tuple[str, str], np.ndarray] = {}
+
+		for code, region in enumerate(self.regions):
+			counters = self.__counters(self.frames[region])
+			current: Dict[Tuple[str, str], int] = {}
+			changed_total = 0
+
+			for i in range(len(days)):
+				changes = {name: counter.changes(first_day + i, first=i == 0) for name, counter in counters.items()}
+				users = np.unique(np.concatenate([np.concatenate(pair) for pair in changes.values()]))
+				changed_total += len(users)
+
+				# every state and transition needs a non-zero counter, so nothing is counted before the first day
+				before = self.__indicators(counters, users) if i else {}
+
+				for name, (entered, left) in changes.items():
+					counters[name].apply(entered, left)
+
+				for key, mask in self.__indicators(counters, users).items():
+					current[key] = current.get(key, 0) + int(mask.sum()) - (int(before[key].sum()) if i else 0)
+
+				for key, value in current.items():
+					totals.setdefault(key, np.zeros((len(self.regions), len(days)), dtype=np.int64))[code, i] = value
+
+			logger.debug("Region {}: {} user re-evaluations over {} days".format(region, changed_total, len(days)))
+
+		return totals
+
+	def series(self, days: Iterable) -> pd.DataFrame:
+		"""Method counts users in every state of `core_state_series` for every region and requested `date_state`
+
+		Args:
+			days (Iterable): consecutive days
+
+		Returns:
+			pd.DataFrame: rows of `core_state_series`
+
+		"""
+
+		days = consecutive_days(days)
+
+		if not len(days):
+			return series_frame({}, self.regions, days)
+
+		totals = self.__roll(days)
+
+		return series_frame({state: totals[(state, "size")] for state in SERIES_STATES}, self.regions, days)
+
+	def matrix(self, days: Iterable) -> pd.DataFrame:
+		"""Method calculates the migration matrix for every region and requested `date_state`
+
+		Args:
+			days (Iterable): consecutive days
+
+		Returns:
+			pd.DataFrame: rows of `core_migration_matrix`
+
+		"""
+
+		days = consecutive_days(days)
+
+		if not len(days):
+			return matrix_frame({}, {}, self.regions, days)
+
+		totals = self.__roll(days)
+
+		return matrix_frame(
+			{state: totals[(state, "size")] for state in MATRIX_STATES},
+			{state: {target: totals[(state, target)] for target in TRANSITIONS} for state in MATRIX_STATES},
+			self.regions,
+			days,
+		)
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+from typing import Tuple, Dict, Iterable
+import datetime as dt
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.Queries import states_query
+from src.StateEngine import (
+	REGIONS, SERIES_STATES, MATRIX_STATES, consecutive_days, series_frame, matrix_frame
+)
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+# counts returned by `STATES_QUERY` for every (region, date_state, state)
+COUNT_COLUMNS: Tuple[str, ...] = (
+	"size", "login", "no_payments", "only_first", "more_payments", "no_more_payments",
+)
+
+
+class SqlStateBackend:
+	"""States calculation pushed down into BigQuery. \n
+	Payments from the monolith are staged into a BigQuery table, then a single query per call classifies users over
+	`product.users_logins`/`product.db_users` and returns only counts per (region, date_state, state). Staging and
+	queries go through the same client, so both use one project. Counts are
+	turned into `core_state_series`/`core_migration_matrix` rows by the same helpers as of `StateEngine`.
+
+	Attributes:
+		client: `google.cloud.bigquery.Client` for staging payments and running the states query
+		payments_table (str): BigQuery table for staged payments, e.g. "etl_retention.payments"
+		logins_since (dt.date): first date of logins, the same as of the pandas path
+		regions (Tuple[str, ...]): regions to calculate states for
+
+	"""
+
+	__slots__ = ("client", "payments_table", "logins_since", "regions")
+
+	def __init__(self, client, payments_table: str, logins_since: dt.date, regions: Tuple[str, ...] = REGIONS):
+		self.client = client
+		self.payments_table: str = payments_table
+		self.logins_since: dt.date = logins_since
+		self.regions: Tuple[str, ...] = regions
+
+	def stage_payments(self, payments: pd.DataFrame):
+		"""Method replaces the staged payments table
+
+		Args:
+			payments (pd.DataFrame): `id_user`, `po_date`, `region` and `num` of payments
+
+		"""
+
+		from google.cloud import bigquery
+
+		start = time.perf_counter()
+
+		data = payments[["id_user", "po_date", "region", "num"]].copy()
+		data["po_date"] = pd.to_datetime(data["po_date"]).dt.date
+		data["region"] = data["region"].astype(object)
+
+		job = self.client.load_table_from_dataframe(
+			data, self.payments_table,
+			job_config=bigquery.LoadJobConfig(write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE)
+		)
+		job.result()
+
+		logger.info("{} payments staged into {} in {:.2f} s".format(
+			len(data), self.payments_table, time.perf_counter() - start
+		))
+
+	def counts(self, days: pd.DatetimeIndex) -> Dict[str, Dict[str, np.ndarray]]:
+		"""Method runs the states query
+
+		Args:
+			days (pd.DatetimeIndex): consecutive days
+
+		Returns:
+			Dict[str, Dict[str, np.ndarray]]: counts of shape (regions, days) by state and by `COUNT_COLUMNS`,
+				zeros for (region, day, state) without users
+
+		"""
+
+		start = time.perf_counter()
+
+		data = self.client.query(
+			states_query(self.logins_since, self.payments_table, days[0].date(), days[-1].date())
+		).result().to_dataframe()
+
+		logger.info("States query: {} rows in {:.2f} s".format(len(data), time.perf_counter() - start))
+
+		region = pd.Categorical(data["region"], categories=self.regions).codes
+		day = (pd.to_datetime(data["date_state"]) - days[0]).dt.days.values
+		keep = (region >= 0) & (day >= 0) & (day < len(days))
+
+		counts: Dict[str, Dict[str, np.ndarray]] = {}
+
+		for state in MATRIX_STATES:
+			rows = keep & (data["state"] == state).values
+			counts[state] = {}
+
+			for column in COUNT_COLUMNS:
+				values = np.zeros((len(self.regions), len(days)), dtype=np.int64)
+				values[region[rows], day[rows]] = data[column].values[rows]
+				counts[state][column] = values
+
+		return counts
+
+	def series(self, days: Iterable) -> pd.DataFrame:
+		"""Method counts users in every state of `core_state_series` for every region and requested `date_state`
+
+		Args:
+			days (Iterable): consecutive days
+
+		Returns:
+			pd.DataFrame: rows of `core_state_series`
+
+		"""
+
+		days = consecutive_days(days)
+
+		if not len(days):
+			return series_frame({}, self.regions, days)
+
+		counts = self.counts(days)
+
+		return series_frame({state: counts[state]["size"] for state in SERIES_STATES}, self.regions, days)
+
+	def matrix(self, days: Iterable) -> pd.DataFrame:
+		"""Method calculates the migration matrix for every region and requested `date_state`. \n
+		Percents of an empty source state are NaN.
+
+		Args:
+			days (Iterable): consecutive days
+
+		Returns:
+			pd.DataFrame: rows of `core_migration_matrix`
+
+		"""
+
+		days = consecutive_days(days)
+
+		if not len(days):
+			return matrix_frame({}, {}, self.regions, days)
+
+		counts = self.counts(days)
+
+		return matrix_frame(
+			{state: counts[state]["size"] for state in MATRIX_STATES},
+			{state: {k: v for k, v in counts[state].items() if k != "size"} for state in MATRIX_STATES},
+			self.regions, days
+		)
+
+
+def check_parity(backend: SqlStateBackend, engine, days: Iterable, tolerance: float = 1e-9) -> bool:
+	"""Function compares series and matrix of the SQL backend with the ones of a pandas engine
+
+	Args:
+		backend (SqlStateBackend): SQL backend
+		engine (StateEngine | RollingStateEngine): pandas engine over the same data
+		days (Iterable): consecutive days
+		tolerance (float): absolute tolerance of percents
+
+	Returns:
+		bool: True if both are the same, differences are logged otherwise
+
+	"""
+
+	same = True
+
+	for name, columns, key in (
+			("series", ["users_count"], ["region", "date_state", "state"]),
+			("matrix", ["active_ns", "churn_ns", "new_spenders", "active_spenders", "churn_spenders", "active_users"],
+				["region", "date_state", "source_state"]),
+	):
+		sql = getattr(backend, name)(days).set_index(key).sort_index()
+		pandas = getattr(engine, name)(days).set_index(key).sort_index()
+
+		if not sql.index.equals(pandas.index):
+			logger.warning("Parity of {}: different rows".format(name))
+			same = False
+			continue
+
+		left = sql[columns].values.astype(np.float64)
+		right = pandas[columns].values.astype(np.float64)
+		differs = ~np.isclose(left, right, rtol=0, atol=tolerance, equal_nan=True).all(axis=1)
+
+		if differs.any():
+			logger.warning("Parity of {}: {} of {} rows differ, e.g.\n{}\n{}".format(
+				name, differs.sum(), len(differs), sql[differs].head(), pandas[differs].head()
+			))
+			same = False
+		else:
+			logger.info("Parity of {}: {} rows are the same".format(name, len(differs)))
+
+	return same
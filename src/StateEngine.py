@@ -0,0 +1,572 @@
+# -*- coding: utf-8 -*-
+
+from typing import Tuple, Dict, Iterable, Optional, Callable
+import logging
+
+import numpy as np
+import pandas as pd
+
+from src.FrameEncoder import NO_DAY, to_day_numbers
+from src.RegionFrames import RegionFrames, EventIndex
+from src.UserSet import UserSet
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+REGIONS: Tuple[str, ...] = ("cis", "asia", "latam")
+
+SERIES_STATES: Tuple[str, ...] = (
+	"new_ns", "active_ns", "new_spenders", "active_spenders", "churn_spenders", "active_users",
+)
+
+MATRIX_STATES: Tuple[str, ...] = (
+	"new_ns", "active_ns", "churn_ns", "new_spenders", "active_spenders", "active_users", "churn_spenders",
+)
+
+NS_STATES: Tuple[str, ...] = ("new_ns", "active_ns", "churn_ns")
+
+# destination states of the migration matrix for non-spenders and for spenders
+NS_TARGETS: Tuple[str, ...] = ("active_ns", "churn_ns", "new_spenders", "active_spenders")
+SPENDERS_TARGETS: Tuple[str, ...] = ("churn_spenders", "active_users", "active_spenders")
+
+MATRIX_COLUMNS: Tuple[str, ...] = (
+	"source_state", "active_ns", "churn_ns", "new_spenders", "active_spenders", "churn_spenders", "active_users",
+	"region", "date_state",
+)
+
+# destination states of all source states, in the order of `core_migration_matrix` columns
+DESTINATIONS: Tuple[str, ...] = MATRIX_COLUMNS[1:7]
+
+def consecutive_days(days: Iterable) -> pd.DatetimeIndex:
+	"""Function normalizes requested days and checks that they go one after another
+
+	Args:
+		days (Iterable): days as dates, datetimes or strings
+
+	Returns:
+		pd.DatetimeIndex: days
+
+	"""
+
+	days = pd.DatetimeIndex(pd.to_datetime(list(days))).normalize()
+
+	if len(days) and not (days == pd.date_range(days[0], periods=len(days))).all():
+		raise ValueError("States are calculated for consecutive days only")
+
+	return days
+
+
+def series_frame(counts: Dict[str, np.ndarray], regions: Tuple[str, ...], days: pd.DatetimeIndex) -> pd.DataFrame:
+	"""Function builds `core_state_series` rows
+
+	Args:
+		counts (Dict[str, np.ndarray]): users count of shape (regions, days) by state
+		regions (Tuple[str, ...]): regions in the order of counts' rows
+		days (pd.DatetimeIndex): days in the order of counts' columns
+
+	Returns:
+		pd.DataFrame: rows of `core_state_series`
+
+	"""
+
+	date_state = days.strftime("%Y-%m-%d")
+
+	frames = []
+
+	for state in SERIES_STATES:
+		if state not in counts:
+			continue
+
+		for i, region in enumerate(regions):
+			frames.append(pd.DataFrame({
+				"region": region,
+				"date_state": date_state,
+				"state": state,
+				"users_count": counts[state][i],
+			}))
+
+	if not frames:
+		return pd.DataFrame(columns=["region", "date_state", "state", "users_count"])
+
+	return pd.concat(frames, ignore_index=True)
+
+
+def matrix_frame(
+		sizes: Dict[str, np.ndarray],
+		transitions: Dict[str, Dict[str, np.ndarray]],
+		regions: Tuple[str, ...],
+		days: pd.DatetimeIndex,
+) -> pd.DataFrame:
+	"""Function builds `core_migration_matrix` rows out of users counts of source states and of their next week.
+	Percents of an empty source state are NaN (NULL in the table), they aren't divided at all.
+
+	Args:
+		sizes (Dict[str, np.ndarray]): users count of shape (regions, days) by source state
+		transitions (Dict[str, Dict[str, np.ndarray]]): users count of shape (regions, days) by source state and by
+			next week activity: "login", "no_payments", "only_first", "more_payments", "no_more_payments"
+		regions (Tuple[str, ...]): regions in the order of counts' rows
+		days (pd.DatetimeIndex): days in the order of counts' columns
+
+	Returns:
+		pd.DataFrame: rows of `core_migration_matrix`
+
+	"""
+
+	date_state = days.strftime("%Y-%m-%d")
+
+	frames = []
+
+	for state in MATRIX_STATES:
+		if state not in sizes:
+			continue
+
+		size = sizes[state].astype(np.float64)
+		empty = size == 0
+		counts = transitions[state]
+
+		if state in NS_STATES:
+			values = {
+				"active_ns": counts["no_payments"],
+				"churn_ns": size - counts["login"],
+				"new_spenders": counts["only_first"],
+				"active_spenders": counts["more_payments"],
+			}
+		else:
+			values = {
+				"churn_spenders": size - counts["login"],
+				"active_users": counts["no_more_payments"],
+				"active_spenders": counts["more_payments"],
+			}
+
+		values = {k: np.where(empty, np.nan, v / np.where(empty, 1., size) * 100) for k, v in values.items()}
+
+		for i, region in enumerate(regions):
+			frame = pd.DataFrame({"source_state": state, **{k: v[i] for k, v in values.items()}})
+			frame["region"] = region
+			frame["date_state"] = date_state
+			frames.append(frame)
+
+	if not frames:
+		return pd.DataFrame(columns=MATRIX_COLUMNS)
+
+	return pd.concat(frames, ignore_index=True, sort=False)[list(MATRIX_COLUMNS)]
+
+
+def destination_codes(
+		state: str, login: np.ndarray, first_payment: np.ndarray, more_payments: np.ndarray
+) -> np.ndarray:
+	"""Function assigns every user of a source state the destination state of the next week. \n
+	Destinations of a source state don't overlap: a payment made on a login day is either the first or not, so users
+	who logged in split into those who paid the first time only, those who paid again and those who didn't pay; the
+	rest churned. This is how the percents of a matrix row add up to 100.
+
+	Args:
+		state (str): source state
+		login (np.ndarray): boolean mask of users who logged in during the next week
+		first_payment (np.ndarray): boolean mask of users who made the first payment on a login day
+		more_payments (np.ndarray): boolean mask of users who made not the first payment on a login day
+
+	Returns:
+		np.ndarray: indices into `DESTINATIONS`
+
+	"""
+
+	code = DESTINATIONS.index
+
+	if state in NS_STATES:
+		return np.where(
+			more_payments, code("active_spenders"),
+			np.where(first_payment, code("new_spenders"), np.where(login, code("active_ns"), code("churn_ns")))
+		)
+
+	return np.where(
+		more_payments, code("active_spenders"), np.where(login, code("active_users"), code("churn_spenders"))
+	)
+
+
+def transitions_frame(counts: np.ndarray, regions: Tuple[str, ...], days: pd.DatetimeIndex) -> pd.DataFrame:
+	"""Function builds `core_migration_matrix` rows out of users counts of every transition. \n
+	A source state's size is the sum of its transitions. Percents of an empty source state are NaN (NULL in the
+	table), they aren't divided at all.
+
+	Args:
+		counts (np.ndarray): users count of shape (regions, days, `MATRIX_STATES`, `DESTINATIONS`)
+		regions (Tuple[str, ...]): regions in the order of counts
+		days (pd.DatetimeIndex): days in the order of counts
+
+	Returns:
+		pd.DataFrame: rows of `core_migration_matrix`, the same as of `matrix_frame`
+
+	"""
+
+	date_state = days.strftime("%Y-%m-%d")
+
+	size = counts.sum(axis=3).astype(np.float64)
+	empty = size == 0
+
+	percents = np.full(counts.shape, np.nan)
+	percents[~empty] = counts[~empty] / size[~empty][:, np.newaxis] * 100
+
+	frames = []
+
+	for s, state in enumerate(MATRIX_STATES):
+		targets = NS_TARGETS if state in NS_STATES else SPENDERS_TARGETS
+
+		for i, region in enumerate(regions):
+			frame = pd.DataFrame({
+				"source_state": state,
+				**{target: percents[i, :, s, DESTINATIONS.index(target)] for target in targets}
+			})
+			frame["region"] = region
+			frame["date_state"] = date_state
+			frames.append(frame)
+
+	if not frames:
+		return pd.DataFrame(columns=MATRIX_COLUMNS)
+
+	return pd.concat(frames, ignore_index=True, sort=False)[list(MATRIX_COLUMNS)]
+
+
+class StateEngine:
+	"""Vectorized calculation of users' states for `core_state_series` and `core_migration_matrix`. \n
+	Every event of `RegionFrames` is turned into the range of `date_state` days for which it puts its user into
+	a window ("login during last week", "payment between 30 and 7 days ago", ...). Ranges are expanded into
+	(region, day, user) keys for all requested days at once, and states are `UserSet` operations on the keys.
+	Results are the same as of the per-day functions in `src.StateFunctions`.
+
+	Attributes:
+		frames (RegionFrames): per-region data
+		regions (Tuple[str, ...]): regions to calculate states for, all regions of `frames` by default
+
+	"""
+
+	__slots__ = ("frames", "regions", "__first_payment")
+
+	def __init__(self, frames: RegionFrames, regions: Optional[Tuple[str, ...]] = None):
+		self.frames: RegionFrames = frames
+		self.regions: Tuple[str, ...] = regions if regions else frames.regions
+
+		# day of the first payment of every (region, user), max int64 for users without payments
+		self.__first_payment: np.ndarray = np.full(
+			len(self.regions) * frames.n_users, np.iinfo(np.int64).max, dtype=np.int64
+		)
+
+		for code, region in enumerate(self.regions):
+			payments: EventIndex = frames[region].payments
+			users, first = np.unique(payments.users, return_index=True)
+			self.__first_payment[code * frames.n_users + users.astype(np.int64)] = payments.days[first]
+
+	def __expand(
+			self, code: int, users: np.ndarray, start: np.ndarray, end: np.ndarray, first_day: int, n_days: int
+	) -> UserSet:
+		"""Function turns events into (region, day, user) keys for every `date_state` in [start, end] of an event
+
+		Args:
+			code (int): region code
+			users (np.ndarray): dense user indices of events
+			start (np.ndarray): first day number for which an event counts
+			end (np.ndarray): last day number for which an event counts
+			first_day (int): day number of the first requested `date_state`
+			n_days (int): number of requested days
+
+		Returns:
+			UserSet: keys
+
+		"""
+
+		start = np.maximum(start - first_day, 0)
+		end = np.minimum(end - first_day, n_days - 1)
+		keep = start <= end
+
+		# keys don't fit into int32 day numbers and user indices
+		user = users[keep].astype(np.int64)
+		start = start[keep].astype(np.int64)
+		lengths = end[keep].astype(np.int64) - start + 1
+
+		offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+		days = np.repeat(start, lengths) + offsets
+
+		keys = (code * n_days + days) * self.frames.n_users + np.repeat(user, lengths)
+
+		return UserSet(keys)
+
+	def __window(
+			self, code: int, index: EventIndex, since: int, until: int, first_day: int, n_days: int,
+			condition: Optional[Callable[[EventIndex, slice], np.ndarray]] = None,
+	) -> UserSet:
+		"""Function returns keys of users with an event between `now - since` and `now - until` days. \n
+		Only events that fall into the window for some requested day are read (found by a binary search).
+
+		Args:
+			code (int): region code
+			index (EventIndex): events
+			since (int): window start as a number of days before `now`
+			until (int): window end as a number of days before `now` (negative for days after `now`)
+			first_day (int): day number of the first requested `date_state`
+			n_days (int): number of requested days
+			condition (Optional[Callable[[EventIndex, slice], np.ndarray]]): extra filter of the events
+
+		Returns:
+			UserSet: keys
+
+		"""
+
+		span = index.between(first_day - since, first_day + n_days - 1 - until)
+		days, users = index.days[span], index.users[span]
+
+		if condition is not None:
+			keep = condition(index, span)
+			days, users = days[keep], users[keep]
+
+		return self.__expand(code, users, days + until, days + since, first_day, n_days)
+
+	def __had_payments(self, keys: UserSet, first_day: int, n_days: int) -> np.ndarray:
+		"""Function tells which keys belong to users who had any payment on or before their `date_state`
+
+		Args:
+			keys (UserSet): (region, day, user) keys
+			first_day (int): day number of the first requested `date_state`
+			n_days (int): number of requested days
+
+		Returns:
+			np.ndarray: boolean mask over keys
+
+		"""
+
+		group, user = np.divmod(keys.values, self.frames.n_users)
+		region, day = np.divmod(group, n_days)
+
+		return self.__first_payment[region * self.frames.n_users + user] <= first_day + day
+
+	def __region_states(
+			self, code: int, first_day: int, n_days: int
+	) -> Tuple[Dict[str, UserSet], Dict[str, UserSet]]:
+		"""Function computes keys of every state and of the next week activity of one region
+
+		Args:
+			code (int): region code
+			first_day (int): day number of the first requested `date_state`
+			n_days (int): number of requested days
+
+		Returns:
+			Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]: keys by state and keys by next week activity
+
+		"""
+
+		frame = self.frames[self.regions[code]]
+
+		def window(index, since, until, condition=None):
+			return self.__window(code, index, since, until, first_day, n_days, condition)
+
+		def without_payments(keys):
+			return keys.filter(~self.__had_payments(keys, first_day, n_days))
+
+		login_week = window(frame.logins, 6, 0)
+		login_month = window(frame.logins, 29, 7)
+		payment_week = window(frame.payments, 6, 0)
+		payment_week_first = window(frame.payments, 6, 0, lambda i, s: i.num[s] == 1)
+		payment_week_more = window(frame.payments, 6, 0, lambda i, s: i.num[s] > 1)
+		payment_month = window(frame.payments, 29, 7)
+
+		created_week = window(frame.created, 6, 0)
+
+		# login during last week of a user created before the week: `now` in [max(login, created + 7), login + 6]
+		span = frame.logins.between(first_day - 6, first_day + n_days - 1)
+		days, users, created = frame.logins.days[span], frame.logins.users[span], frame.logins.created[span]
+		known = created != NO_DAY
+		login_week_old = self.__expand(
+			code, users[known], np.maximum(days[known], created[known] + 7), days[known] + 6, first_day, n_days
+		)
+
+		states: Dict[str, UserSet] = {
+			"new_ns": without_payments(created_week),
+			"active_ns": without_payments(login_week_old),
+			"churn_ns": without_payments(login_month) - login_week,
+			"new_spenders": payment_week_first - payment_week_more,
+			"active_spenders": payment_week_more,
+			"active_users": login_week.filter(self.__had_payments(login_week, first_day, n_days)) - payment_week,
+			"churn_spenders": payment_month - login_week,
+		}
+
+		# logins during next 7 days and payments made on those login days
+		next_week: Dict[str, UserSet] = {
+			"login": window(frame.logins, -1, -7),
+			"payment": window(frame.logins, -1, -7, lambda i, s: i.num[s] >= 1),
+			"first_payment": window(frame.logins, -1, -7, lambda i, s: i.num[s] == 1),
+			"more_payments": window(frame.logins, -1, -7, lambda i, s: i.num[s] > 1),
+		}
+
+		return states, next_week
+
+	def __states(self, days: pd.DatetimeIndex) -> Tuple[Dict[str, UserSet], Dict[str, UserSet]]:
+		"""Function computes keys of every state and of the next week activity for the requested days. \n
+		Keys of a region are greater than keys of previous regions, so concatenated keys stay sorted.
+
+		Args:
+			days (pd.DatetimeIndex): consecutive days
+
+		Returns:
+			Tuple[Dict[str, UserSet], Dict[str, UserSet]]: keys by state and keys by next week activity
+
+		"""
+
+		first_day, n_days = int(to_day_numbers(pd.Series(days[:1]))[0]), len(days)
+
+		parts = [self.__region_states(code, first_day, n_days) for code in range(len(self.regions))]
+
+		states = {state: UserSet.concatenate(p[0][state] for p in parts) for state in MATRIX_STATES}
+		next_week = {key: UserSet.concatenate(p[1][key] for p in parts) for key in parts[0][1]}
+
+		return states, next_week
+
+	def __counts(self, keys: UserSet, n_days: int) -> np.ndarray:
+		"""Function counts keys per (region, day)
+
+		Args:
+			keys (UserSet): (region, day, user) keys
+			n_days (int): number of requested days
+
+		Returns:
+			np.ndarray: counts of shape (regions, days)
+
+		"""
+
+		groups = keys.values // self.frames.n_users
+
+		return np.bincount(groups, minlength=len(self.regions) * n_days).reshape(len(self.regions), n_days)
+
+	def state_table(self, days: Iterable) -> pd.DataFrame:
+		"""Method assigns states to users for every requested `date_state`
+
+		Args:
+			days (Iterable): consecutive days
+
+		Returns:
+			pd.DataFrame: columns `region`, `date_state`, `id_user` and `state`
+
+		"""
+
+		days = consecutive_days(days)
+		states, _ = self.__states(days)
+
+		frames = []
+
+		for state, keys in states.items():
+			group, user = np.divmod(keys.values, self.frames.n_users)
+			region, day = np.divmod(group, len(days))
+
+			frames.append(pd.DataFrame({
+				"region": np.asarray(self.regions, dtype=object)[region],
+				"date_state": days[day].strftime("%Y-%m-%d"),
+				"id_user": self.frames.ids[user],
+				"state": state,
+			}))
+
+		return pd.concat(frames, ignore_index=True)
+
+	def series(self, days: Iterable) -> pd.DataFrame:
+		"""Method counts users in every state of `core_state_series` for every region and requested `date_state`
+
+		Args:
+			days (Iterable): consecutive days
+
+		Returns:
+			pd.DataFrame: rows of `core_state_series`
+
+		"""
+
+		days = consecutive_days(days)
+
+		if not len(days):
+			return series_frame({}, self.regions, days)
+
+		states, _ = self.__states(days)
+
+		return series_frame(
+			{state: self.__counts(states[state], len(days)) for state in SERIES_STATES}, self.regions, days
+		)
+
+	def __transitions(self, days: pd.DatetimeIndex) -> Dict[str, Tuple[UserSet, np.ndarray]]:
+		"""Function computes keys of every source state and the destination state of every key. \n
+		Source keys are looked up in the next week activity once, in a single pass over each state.
+
+		Args:
+			days (pd.DatetimeIndex): consecutive days
+
+		Returns:
+			Dict[str, Tuple[UserSet, np.ndarray]]: keys and indices into `DESTINATIONS` by source state
+
+		"""
+
+		states, next_week = self.__states(days)
+
+		return {
+			state: (keys, destination_codes(
+				state,
+				next_week["login"].contains(keys.values),
+				next_week["first_payment"].contains(keys.values),
+				next_week["more_payments"].contains(keys.values),
+			))
+			for state, keys in states.items()
+		}
+
+	def transition_table(self, days: Iterable) -> pd.DataFrame:
+		"""Method assigns source states and the next week's destination states to users for every requested
+		`date_state`
+
+		Args:
+			days (Iterable): consecutive days
+
+		Returns:
+			pd.DataFrame: columns `region`, `date_state`, `id_user`, `source_state` and `destination_state`
+
+		"""
+
+		days = consecutive_days(days)
+		frames = []
+
+		for state, (keys, destination) in self.__transitions(days).items():
+			group, user = np.divmod(keys.values, self.frames.n_users)
+			region, day = np.divmod(group, len(days))
+
+			frames.append(pd.DataFrame({
+				"region": np.asarray(self.regions, dtype=object)[region],
+				"date_state": days[day].strftime("%Y-%m-%d"),
+				"id_user": self.frames.ids[user],
+				"source_state": state,
+				"destination_state": np.asarray(DESTINATIONS, dtype=object)[destination],
+			}))
+
+		return pd.concat(frames, ignore_index=True)
+
+	def matrix(self, days: Iterable) -> pd.DataFrame:
+		"""Method calculates the migration matrix (percent of a source state's users moving into every destination
+		state during the next week) for every region and requested `date_state`. \n
+		All (region, day, source state, destination state) transitions are counted at once, percents of an empty
+		source state are NaN.
+
+		Args:
+			days (Iterable): consecutive days
+
+		Returns:
+			pd.DataFrame: rows of `core_migration_matrix`
+
+		"""
+
+		days = consecutive_days(days)
+		shape = (len(self.regions), len(days), len(MATRIX_STATES), len(DESTINATIONS))
+
+		if not len(days):
+			return transitions_frame(np.zeros(shape, dtype=np.int64), self.regions, days)
+
+		codes = [
+			((keys.values // self.frames.n_users) * len(MATRIX_STATES) + MATRIX_STATES.index(state)) * len(DESTINATIONS)
+			+ destination
+			for state, (keys, destination) in self.__transitions(days).items()
+		]
+
+		counts = np.bincount(np.concatenate(codes), minlength=int(np.prod(shape))).reshape(shape)
+
+		return transitions_frame(counts, self.regions, days)
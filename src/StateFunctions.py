@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+
+from datetime import timedelta
+
+import pandas as pd
+
+
+# --------------------------------------------------------------------------------------------------------------------
+#                                                   MATRIX
+# --------------------------------------------------------------------------------------------------------------------
+def new_ns_validator(new_df: pd.DataFrame, now, region: str) -> pd.DataFrame:
+	"""Function returns next-week transitions in percents of users registered during the last week without payments"""
+
+	matrix = pd.DataFrame()
+
+	now = now.date()
+	_7days_ago = (now - timedelta(days=6))
+	_7days_after = (now + timedelta(days=7))
+
+	new_df_region = new_df[new_df['region'] == region]
+
+	had_payments = set(
+		new_df_region[
+			(new_df_region.po_date <= now) &
+			(new_df_region.num >= 1)
+			]["id_user"]
+	)
+
+	date_created = set(
+		new_df_region[
+			(new_df_region['u_date_created'] >= _7days_ago) &
+			(new_df_region['u_date_created'] <= now)
+			]["id_user"]
+	)
+
+	res = date_created.difference(had_payments)
+
+	df_temp = new_df_region[
+		(new_df_region['date'] > now) &
+		(new_df_region['date'] <= _7days_after) &
+		(new_df_region["id_user"].isin(res))
+		]
+
+	more_than_1_pymnt = set(
+		df_temp[df_temp.num > 1]['id_user']
+	)
+
+	only_1_pymnt = (set(df_temp[df_temp.num == 1]['id_user'])).difference(more_than_1_pymnt)
+
+	matrix.loc['new_ns', 'active_ns'] = len(
+		set(df_temp['id_user']).difference(set(df_temp[df_temp.num >= 1]['id_user']))) / len(res) * 100
+
+	matrix.loc['new_ns', 'churn_ns'] = (len(res) - len(set(df_temp['id_user']))) / len(res) * 100
+
+	matrix.loc['new_ns', 'new_spenders'] = len(only_1_pymnt) / len(res) * 100
+
+	matrix.loc['new_ns', 'active_spenders'] = len(set(df_temp[df_temp.num > 1]['id_user'])) / len(res) * 100
+
+	return matrix
+
+
+def active_ns_validator(new_df: pd.DataFrame, now, region: str) -> pd.DataFrame:
+	"""Function returns next-week transitions in percents of users without payments logged in during the last week"""
+
+	matrix = pd.DataFrame()
+	now = now.date()
+	new_df_region = new_df[new_df['region'] == region]
+	_7days_ago = (now - timedelta(days=6))
+	had_payments = set(new_df_region[(new_df_region.po_date <= now) & (new_df_region.num >= 1)].id_user)
+	login_and_date_created = set(new_df_region[
+									 (new_df_region['date'] >= _7days_ago) & (new_df_region['date'] <= now) & (
+												 new_df_region['u_date_created'] < _7days_ago)].id_user)
+	res = login_and_date_created.difference(had_payments)
+	_7days_after = (now + timedelta(days=7))
+	df_temp = pd.DataFrame()
+	df_temp = new_df_region[
+		(new_df_region['date'] > now) & (new_df_region['date'] <= _7days_after) & (new_df_region.id_user.isin(res))]
+	more_than_1_pymnt = set(df_temp[df_temp.num > 1]['id_user'])
+	only_1_pymnt = (set(df_temp[df_temp.num == 1]['id_user'])).difference(more_than_1_pymnt)
+	matrix.loc['active_ns', 'active_ns'] = len(
+		set(df_temp['id_user']).difference(set(df_temp[df_temp.num >= 1]['id_user']))) / len(res) * 100
+	matrix.loc['active_ns', 'churn_ns'] = (len(res) - len(set(df_temp['id_user']))) / len(res) * 100
+	matrix.loc['active_ns', 'new_spenders'] = len(only_1_pymnt) / len(res) * 100
+	matrix.loc['active_ns', 'active_spenders'] = len(set(df_temp[df_temp.num > 1]['id_user'])) / len(res) * 100
+	return matrix
+
+
+def churn_ns_validator(new_df: pd.DataFrame, now, region: str) -> pd.DataFrame:
+	"""Function returns next-week transitions in percents of users without payments logged in 30 to 7 days ago only"""
+
+	matrix = pd.DataFrame()
+	now = now.date()
+	new_df_region = new_df[new_df['region'] == region]
+	_7days_ago = (now - timedelta(days=6))
+	_30days_ago = (now - timedelta(days=29))
+	had_payments = set(new_df_region[(new_df_region.po_date <= now) & (new_df_region.num >= 1)].id_user)
+	login_last_month = set(
+		new_df_region[(new_df_region['date'] >= _30days_ago) & (new_df_region['date'] < _7days_ago)].id_user)
+	login_last_week = set(new_df_region[(new_df_region['date'] >= _7days_ago) & (new_df_region['date'] <= now)].id_user)
+	date_created_no_payments = login_last_month.difference(had_payments)
+	res = date_created_no_payments.difference(login_last_week)
+	_7days_after = (now + timedelta(days=7))
+	df_temp = pd.DataFrame()
+	df_temp = new_df_region[
+		(new_df_region['date'] > now) & (new_df_region['date'] <= _7days_after) & (new_df_region.id_user.isin(res))]
+	more_than_1_pymnt = set(df_temp[df_temp.num > 1]['id_user'])
+	only_1_pymnt = (set(df_temp[df_temp.num == 1]['id_user'])).difference(more_than_1_pymnt)
+	matrix.loc['churn_ns', 'active_ns'] = len(
+		set(df_temp['id_user']).difference(set(df_temp[df_temp.num >= 1]['id_user']))) / len(res) * 100
+	matrix.loc['churn_ns', 'churn_ns'] = (len(res) - len(set(df_temp['id_user']))) / len(res) * 100
+	matrix.loc['churn_ns', 'new_spenders'] = len(only_1_pymnt) / len(res) * 100
+	matrix.loc['churn_ns', 'active_spenders'] = len(set(df_temp[df_temp.num > 1]['id_user'])) / len(res) * 100
+	return matrix
+
+
+def new_spenders_validator(new_df: pd.DataFrame, now, region: str) -> pd.DataFrame:
+	"""Function returns next-week transitions in percents of users who made their first payment during the last week"""
+
+	matrix = pd.DataFrame()
+	now = now.date()
+	new_df_region = new_df[new_df['region'] == region]
+	_7days_ago = (now - timedelta(days=6))
+	count_1 = set(new_df_region[(new_df_region.po_date >= _7days_ago) & (new_df_region.po_date <= now) & (
+				new_df_region.num == 1)].id_user)
+	count_more = set(new_df_region[(new_df_region.po_date >= _7days_ago) & (new_df_region.po_date <= now) & (
+				new_df_region.num > 1)].id_user)
+	res = count_1.difference(count_more)
+	_7days_after = (now + timedelta(days=7))
+	df_temp = pd.DataFrame()
+	df_temp = new_df_region[
+		(new_df_region['date'] > now) & (new_df_region['date'] <= _7days_after) & (new_df_region.id_user.isin(res))]
+	more_payments = set(df_temp[(df_temp.num > 1)].id_user)
+	login = set(df_temp['id_user'])
+	matrix.loc['new_spenders', 'churn_spenders'] = (len(res) - len(set(df_temp['id_user']))) / len(res) * 100
+	matrix.loc['new_spenders', 'active_users'] = len(login.difference(more_payments)) / len(res) * 100
+	matrix.loc['new_spenders', 'active_spenders'] = len(set(df_temp[df_temp.num > 1]['id_user'])) / len(res) * 100
+	return matrix
+
+
+def active_spenders_validator(new_df: pd.DataFrame, now, region: str) -> pd.DataFrame:
+	"""Function returns next-week transitions in percents of users who made a repeated payment during the last week"""
+
+	matrix = pd.DataFrame()
+	now = now.date()
+	new_df_region = new_df[new_df['region'] == region]
+	_7days_ago = (now - timedelta(days=6))
+	res = set(new_df_region[(new_df_region.po_date >= _7days_ago) & (new_df_region.po_date <= now) & (
+				new_df_region.num > 1)].id_user)
+	_7days_after = (now + timedelta(days=7))
+	df_temp = pd.DataFrame()
+	df_temp = new_df_region[
+		(new_df_region['date'] > now) & (new_df_region['date'] <= _7days_after) & (new_df_region.id_user.isin(res))]
+	more_payments = set(df_temp[(df_temp.num > 1)].id_user)
+	login = set(df_temp['id_user'])
+	matrix.loc['active_spenders', 'churn_spenders'] = (len(res) - len(set(df_temp['id_user']))) / len(res) * 100
+	matrix.loc['active_spenders', 'active_users'] = len(login.difference(more_payments)) / len(res) * 100
+	matrix.loc['active_spenders', 'active_spenders'] = len(set(df_temp[df_temp.num > 1]['id_user'])) / len(res) * 100
+	return matrix
+
+
+def active_users_validator(new_df: pd.DataFrame, now, region: str) -> pd.DataFrame:
+	"""Function returns next-week transitions in percents of payers logged in without paying during the last week"""
+
+	matrix = pd.DataFrame()
+	now = now.date()
+	new_df_region = new_df[new_df['region'] == region]
+	_7days_ago = (now - timedelta(days=6))
+	had_payments = set(new_df_region[(new_df_region.po_date <= now) & (new_df_region.num >= 1)].id_user)
+	new_login = set(new_df_region[(new_df_region['date'] >= _7days_ago) & (new_df_region['date'] <= now)].id_user)
+	payment_and_login = new_login.intersection(had_payments)
+	payment_last_week = set(
+		new_df_region[(new_df_region.po_date >= _7days_ago) & (new_df_region.po_date <= now)].id_user)
+	res = payment_and_login.difference(payment_last_week)
+	_7days_after = (now + timedelta(days=7))
+	df_temp = pd.DataFrame()
+	df_temp = new_df_region[
+		(new_df_region['date'] > now) & (new_df_region['date'] <= _7days_after) & (new_df_region.id_user.isin(res))]
+	more_payments = set(df_temp[(df_temp.num > 1)].id_user)
+	login = set(df_temp['id_user'])
+	matrix.loc['active_users', 'churn_spenders'] = (len(res) - len(set(df_temp['id_user']))) / len(res) * 100
+	matrix.loc['active_users', 'active_users'] = len(login.difference(more_payments)) / len(res) * 100
+	matrix.loc['active_users', 'active_spenders'] = len(set(df_temp[df_temp.num > 1]['id_user'])) / len(res) * 100
+	return matrix
+
+
+def churn_spenders_validator(new_df: pd.DataFrame, now, region: str) -> pd.DataFrame:
+	"""Function returns next-week transitions in percents of users who paid 30 to 7 days ago and didn't log in since"""
+
+	matrix = pd.DataFrame()
+	now = now.date()
+	new_df_region = new_df[new_df['region'] == region]
+	_7days_ago = (now - timedelta(days=6))
+	_30days_ago = (now - timedelta(days=29))
+	early = set(
+		new_df_region[(new_df_region['po_date'] >= _30days_ago) & (new_df_region['po_date'] < _7days_ago)].id_user)
+	new = set(new_df_region[(new_df_region['date'] >= _7days_ago) & (new_df_region['date'] <= now)].id_user)
+	res = early.difference(new)
+	_7days_after = (now + timedelta(days=7))
+	df_temp = pd.DataFrame()
+	df_temp = new_df_region[
+		(new_df_region['date'] > now) & (new_df_region['date'] <= _7days_after) & (new_df_region.id_user.isin(res))]
+	more_payments = set(df_temp[(df_temp.num > 1)].id_user)
+	login = set(df_temp['id_user'])
+	matrix.loc['churn_spenders', 'churn_spenders'] = (len(res) - len(set(df_temp['id_user']))) / len(res) * 100
+	matrix.loc['churn_spenders', 'active_users'] = len(login.difference(more_payments)) / len(res) * 100
+	matrix.loc['churn_spenders', 'active_spenders'] = len(set(df_temp[df_temp.num > 1]['id_user'])) / len(res) * 100
+	return matrix
+
+
+def create_matrix(new_df: pd.DataFrame, now, region: str) -> pd.DataFrame:
+	"""Function returns rows of `core_migration_matrix` of all source states of a (day, region)"""
+
+	l = [
+		new_ns_validator(new_df, now, region),
+		active_ns_validator(new_df, now, region),
+		churn_ns_validator(new_df, now, region),
+		new_spenders_validator(new_df, now, region),
+		active_spenders_validator(new_df, now, region),
+		active_users_validator(new_df, now, region),
+		churn_spenders_validator(new_df, now, region),
+	]
+
+	return pd.concat(l)
+
+
+# --------------------------------------------------------------------------------------------------------------------
+#                                                   SERIES
+# --------------------------------------------------------------------------------------------------------------------
+
+
+def active_users_series(new_df: pd.DataFrame, now, region: str) -> pd.DataFrame:
+	"""Function counts payers logged in without paying during the last week"""
+
+	now = now.date()
+	new_df_region = new_df[new_df['region'] == region]
+	_7days_ago = (now - timedelta(days=6))
+	had_payments = set(new_df_region[(new_df_region.po_date <= now) & (new_df_region.num >= 1)].id_user)
+	new_login = set(new_df_region[(new_df_region['date'] >= _7days_ago) & (new_df_region['date'] <= now)].id_user)
+	payment_and_login = new_login.intersection(had_payments)
+	payment_last_week = set(
+		new_df_region[(new_df_region.po_date >= _7days_ago) & (new_df_region.po_date <= now)].id_user)
+	res = payment_and_login.difference(payment_last_week)
+
+	df = pd.DataFrame(
+		{
+			"region": region,
+			"date_state": str(now)[0:10],
+			"state": "active_users",
+			"users_count": [len(res)],
+		}
+	)
+
+	return df
+
+
+def new_spenders_series(new_df: pd.DataFrame, now, region: str) -> pd.DataFrame:
+	"""Function counts users who made their first payment during the last week"""
+
+	now = now.date()
+	new_df_region = new_df[new_df['region'] == region]
+	_7days_ago = (now - timedelta(days=6))
+	count_1 = set(new_df_region[(new_df_region.po_date >= _7days_ago) & (new_df_region.po_date <= now) & (
+				new_df_region.num == 1)].id_user)
+	count_more = set(new_df_region[(new_df_region.po_date >= _7days_ago) & (new_df_region.po_date <= now) & (
+				new_df_region.num > 1)].id_user)
+	res = count_1.difference(count_more)
+
+	df = pd.DataFrame(
+		{
+			"region": region,
+			"date_state": str(now)[0:10],
+			"state": "new_spenders",
+			"users_count": [len(res)],
+		}
+	)
+
+	return df
+
+
+def active_spenders_series(new_df: pd.DataFrame, now, region: str) -> pd.DataFrame:
+	"""Function counts users who made a repeated payment during the last week"""
+
+	now = now.date()
+	new_df_region = new_df[new_df['region'] == region]
+	_7days_ago = (now - timedelta(days=6))
+	res = set(new_df_region[(new_df_region.po_date >= _7days_ago) & (new_df_region.po_date <= now) & (
+				new_df_region.num > 1)].id_user)
+	df = pd.DataFrame(
+		{
+			"region": region,
+			"date_state": str(now)[0:10],
+			"state": "active_spenders",
+			"users_count": [len(res)],
+		}
+	)
+
+	return df
+
+
+def churn_spenders_series(new_df: pd.DataFrame, now, region: str) -> pd.DataFrame:
+	"""Function counts users who paid 30 to 7 days ago and didn't log in during the last week"""
+
+	now = now.date()
+	new_df_region = new_df[new_df['region'] == region]
+
+	_7days_ago = (now - timedelta(days=6))
+	_30days_ago = (now - timedelta(days=29))
+
+	early = set(new_df_region[(new_df_region['po_date']>=_30days_ago)&(new_df_region['po_date']<_7days_ago)].id_user)
+	new = set(new_df_region[(new_df_region['date'] >= _7days_ago) & (new_df_region['date'] <= now)].id_user)
+	res = early.difference(new)
+	df = pd.DataFrame(
+		{
+			"region": region,
+			"date_state": str(now)[0:10],
+			"state": "churn_spenders",
+			"users_count": [len(res)],
+		}
+	)
+
+	return df
+
+
+def new_ns_series(new_df: pd.DataFrame, now, region: str) -> pd.DataFrame:
+	"""Function counts users registered during the last week without payments"""
+
+	now = now.date()
+	new_df_region = new_df[new_df['region'] == region]
+
+	_7days_ago = (now - timedelta(days=6))
+	had_payments = set(new_df_region[(new_df_region.po_date <= now) & (new_df_region.num >= 1)].id_user)
+	date_created = set(new_df_region[(new_df_region['u_date_created'] >= _7days_ago) & (
+				new_df_region['u_date_created'] <= now)].id_user)
+	res = date_created.difference(had_payments)
+	df = pd.DataFrame(
+		{
+			"region": region,
+			"date_state": str(now)[0:10],
+			"state": "new_ns",
+			"users_count": [len(res)],
+		}
+	)
+
+	return df
+
+
+def active_ns_series(new_df: pd.DataFrame, now, region: str) -> pd.DataFrame:
+	"""Function counts users registered earlier without payments logged in during the last week"""
+
+	now = now.date()
+	new_df_region = new_df[new_df['region'] == region]
+	_7days_ago = (now - timedelta(days=6))
+	had_payments = set(new_df_region[(new_df_region.po_date <= now) & (new_df_region.num >= 1)].id_user)
+	login_and_date_created = set(new_df_region[
+									 (new_df_region['date'] >= _7days_ago) & (new_df_region['date'] <= now) & (
+												 new_df_region['u_date_created'] < _7days_ago)].id_user)
+	res = login_and_date_created.difference(had_payments)
+	df = pd.DataFrame(
+		{
+			"region": region,
+			"date_state": str(now)[0:10],
+			"state": "active_ns",
+			"users_count": [len(res)],
+		}
+	)
+
+	return df
+
+
+def create_series(new_df: pd.DataFrame, now, region: str) -> pd.DataFrame:
+	"""Function returns rows of `core_state_series` of all states of a (day, region)"""
+
+	return pd.concat([
+		new_ns_series(new_df, now, region),
+		active_ns_series(new_df, now, region),
+		new_spenders_series(new_df, now, region),
+		active_spenders_series(new_df, now, region),
+		churn_spenders_series(new_df, now, region),
+		active_users_series(new_df, now, region),
+	])
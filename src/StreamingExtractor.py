@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+from typing import Tuple, Dict, List
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.FrameEncoder import NO_DAY
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class MemoryCeilingExceeded(MemoryError):
+	"""Raised when folded pages of a streamed result don't fit into the memory ceiling"""
+
+
+def _day_numbers(values: List) -> np.ndarray:
+	"""Function converts a list of dates (datetime.date, None) into int32 day numbers, `NO_DAY` for None"""
+
+	days = np.array(values, dtype="datetime64[D]")
+	missing = np.isnat(days)
+
+	days = days.astype(np.int64)
+	days[missing] = NO_DAY
+
+	return days.astype(np.int32)
+
+
+class LoginsStream:
+	"""Reads the BigQuery logins result page by page and folds every page into compact per-region arrays
+	(int64 `id_user`, int32 day numbers of `date` and `u_date_created`), so python rows of only one page exist
+	at a time. Rows of regions outside of `regions` are dropped while folding, they never get into the states.
+
+	Attributes:
+		client: `google.cloud.bigquery.Client` of the same project and credentials as the rest of BigQuery queries
+		page_size (int): rows per page
+		max_bytes (int): memory ceiling of folded arrays plus the current page
+
+	"""
+
+	__slots__ = ("client", "page_size", "max_bytes")
+
+	COLUMNS: Tuple[str, ...] = ("id_user", "u_date_created", "date", "region")
+
+	# estimated size of one python row of a page: Row object, values tuple, date objects and region string
+	ROW_BYTES: int = 400
+
+	def __init__(self, client, page_size: int = 50000, max_bytes: int = 1024 ** 3):
+		self.client = client
+		self.page_size: int = page_size
+		self.max_bytes: int = max_bytes
+
+	def extract(self, query: str, regions: Tuple[str, ...]) -> pd.DataFrame:
+		"""Method runs the logins query and folds its result page by page
+
+		Args:
+			query (str): logins query with `COLUMNS`
+			regions (Tuple[str, ...]): regions to keep
+
+		Raises:
+			MemoryCeilingExceeded: if folded arrays and a page exceed `max_bytes`
+
+		Returns:
+			pd.DataFrame: `id_user` (int64), `u_date_created`, `date` (int32 day numbers, `NO_DAY` if missing) and
+				`region` (categorical over `regions`)
+
+		"""
+
+		start = time.perf_counter()
+
+		chunks: Dict[str, List[Tuple[np.ndarray, ...]]] = {region: [] for region in regions}
+		folded_bytes: int = 0
+		rows: int = 0
+		pages: int = 0
+
+		result = self.client.query(query).result(page_size=self.page_size)
+		positions = [[field.name for field in result.schema].index(column) for column in self.COLUMNS]
+
+		for page in result.pages:
+			values = [tuple(row[i] for i in positions) for row in page]
+
+			if folded_bytes + len(values) * self.ROW_BYTES > self.max_bytes:
+				raise MemoryCeilingExceeded(
+					"Logins don't fit into {:.1f} MB after {} rows, lower the page size or raise the ceiling".format(
+						self.max_bytes / 1024 ** 2, rows
+					)
+				)
+
+			if values:
+				ids, created, date, region = zip(*values)
+
+				ids = np.array(ids, dtype=np.int64)
+				created = _day_numbers(created)
+				date = _day_numbers(date)
+				region = np.array(region, dtype=object)
+
+				for name in regions:
+					in_region = region == name
+
+					if in_region.any():
+						chunk = (ids[in_region], created[in_region], date[in_region])
+						chunks[name].append(chunk)
+						folded_bytes += sum(i.nbytes for i in chunk)
+
+			rows += len(values)
+			pages += 1
+
+			del values
+
+		data = pd.concat([
+			pd.DataFrame({
+				"id_user": np.concatenate([i[0] for i in region_chunks]),
+				"u_date_created": np.concatenate([i[1] for i in region_chunks]),
+				"date": np.concatenate([i[2] for i in region_chunks]),
+				"region": region,
+			})
+			for region, region_chunks in chunks.items() if region_chunks
+		] or [pd.DataFrame({
+			"id_user": np.empty(0, dtype=np.int64),
+			"u_date_created": np.empty(0, dtype=np.int32),
+			"date": np.empty(0, dtype=np.int32),
+			"region": np.empty(0, dtype=object),
+		})], ignore_index=True)
+
+		data["region"] = pd.Categorical(data["region"], categories=regions)
+
+		logger.info("Logins streamed: {} rows in {} pages, {} kept, {:.1f} MB folded in {:.2f} s".format(
+			rows, pages, len(data), folded_bytes / 1024 ** 2, time.perf_counter() - start
+		))
+
+		return data
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+from typing import Iterable
+
+import numpy as np
+
+
+class UserSet:
+	"""Set of dense user indices (or of other non-negative integer keys) backed by a sorted NumPy array. \n
+	Set algebra is done with binary searches over sorted arrays, so no python ints are materialized.
+
+	Attributes:
+		values (np.ndarray): sorted unique int64 values
+
+	"""
+
+	__slots__ = ("values",)
+
+	def __init__(self, values: np.ndarray = None, assume_unique: bool = False):
+		if values is None:
+			values = np.empty(0, dtype=np.int64)
+
+		values = np.asarray(values, dtype=np.int64)
+
+		self.values: np.ndarray = values if assume_unique else np.unique(values)
+
+	@classmethod
+	def concatenate(cls, sets: Iterable["UserSet"]) -> "UserSet":
+		"""Method joins sets where every set's values are greater than values of all previous sets
+
+		Args:
+			sets (Iterable[UserSet]): sets in increasing order of their values
+
+		Returns:
+			UserSet: union of the sets
+
+		"""
+
+		values = [i.values for i in sets]
+
+		return cls(np.concatenate(values) if values else None, assume_unique=True)
+
+	def __len__(self) -> int:
+		return len(self.values)
+
+	def __iter__(self):
+		return iter(self.values.tolist())
+
+	def __eq__(self, other) -> bool:
+		return isinstance(other, UserSet) and np.array_equal(self.values, other.values)
+
+	def contains(self, values: np.ndarray) -> np.ndarray:
+		"""Method checks membership of every element of an array
+
+		Args:
+			values (np.ndarray): values to check
+
+		Returns:
+			np.ndarray: boolean mask over values
+
+		"""
+
+		values = np.asarray(values, dtype=np.int64)
+
+		if not len(self.values):
+			return np.zeros(len(values), dtype=bool)
+
+		position = np.minimum(np.searchsorted(self.values, values), len(self.values) - 1)
+
+		return self.values[position] == values
+
+	def filter(self, mask: np.ndarray) -> "UserSet":
+		"""Method keeps values where mask is True
+
+		Args:
+			mask (np.ndarray): boolean mask over `values`
+
+		Returns:
+			UserSet: subset
+
+		"""
+
+		return UserSet(self.values[mask], assume_unique=True)
+
+	def union(self, other: "UserSet") -> "UserSet":
+		return UserSet(np.union1d(self.values, other.values), assume_unique=True)
+
+	def intersection(self, other: "UserSet") -> "UserSet":
+		return self.filter(other.contains(self.values))
+
+	def difference(self, other: "UserSet") -> "UserSet":
+		return self.filter(~other.contains(self.values))
+
+	__or__ = union
+	__and__ = intersection
+	__sub__ = difference
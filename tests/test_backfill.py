@@ -0,0 +1,44 @@
+# coding: utf-8
+
+import datetime as dt
+
+import pytest
+
+pytest.importorskip("bogoslovskiy")
+
+from src.Backfill import plan_partitions, LOOK_AHEAD, LOOK_BACK
+
+
+def windows(partitions):
+    return [
+        (str(i.first), str(i.last), str(i.logins_since), str(i.payments_since), str(i.until)) for i in partitions
+    ]
+
+
+def test_partitions_extract_consecutive_windows():
+    partitions = plan_partitions(dt.date(2019, 7, 1), dt.date(2019, 7, 20), 7, dt.date(2019, 1, 1))
+
+    assert windows(partitions) == [
+        ("2019-07-01", "2019-07-07", "2019-06-02", "2019-01-01", "2019-07-15"),
+        ("2019-07-08", "2019-07-14", "2019-07-15", "2019-07-15", "2019-07-22"),
+        ("2019-07-15", "2019-07-20", "2019-07-22", "2019-07-22", "2019-07-28"),
+    ]
+
+    # every partition extracts the look-back of its first day and the look-ahead of its last day
+    for partition in partitions:
+        assert partition.until == partition.last + dt.timedelta(days=LOOK_AHEAD + 1)
+
+    assert partitions[0].logins_since == partitions[0].first - dt.timedelta(days=LOOK_BACK)
+
+
+def test_single_day_and_chunk_longer_than_the_range():
+    assert windows(plan_partitions(dt.date(2019, 7, 1), dt.date(2019, 7, 1), 7, dt.date(2019, 1, 1))) == [
+        ("2019-07-01", "2019-07-01", "2019-06-02", "2019-01-01", "2019-07-09"),
+    ]
+    assert windows(plan_partitions(dt.date(2019, 7, 1), dt.date(2019, 7, 5), 60, dt.date(2019, 1, 1))) == [
+        ("2019-07-01", "2019-07-05", "2019-06-02", "2019-01-01", "2019-07-13"),
+    ]
+
+
+def test_empty_range_has_no_partitions():
+    assert plan_partitions(dt.date(2019, 7, 2), dt.date(2019, 7, 1), 7, dt.date(2019, 1, 1)) == []
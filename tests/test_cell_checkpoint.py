@@ -0,0 +1,120 @@
+# coding: utf-8
+
+import datetime as dt
+import re
+
+import pandas as pd
+
+from src.CellCheckpoint import CellCheckpoints, FailedCells, plan_cells
+
+
+REGIONS = ("cis", "asia", "latam")
+
+
+class CheckpointsWorker:
+    """Answers the queries of `CellCheckpoints.last` and `CellCheckpoints.completed` from (table, region, day) cells"""
+
+    def __init__(self, cells):
+        self.cells = cells
+
+    def get_iterable(self, query):
+        table = re.search(r"table_name = '(\w+)'", query).group(1)
+        cells = [(region, day) for name, region, day in self.cells if name == table]
+
+        if "max(date_state)" in query:
+            return [(region, max(day for r, day in cells if r == region)) for region in {r for r, _ in cells}]
+
+        since = dt.date.fromisoformat(re.search(r"date_state >= '([\d-]+)'", query).group(1))
+
+        return [(region, day) for region, day in cells if day >= since]
+
+
+def days(first, last):
+    return pd.date_range(first, last)
+
+
+def planned(tasks):
+    return [(str(days[0].date()), str(days[-1].date()), regions) for days, regions in tasks]
+
+
+def completed_cells(table, regions, first, last):
+    return [(table, region, day.date()) for region in regions for day in days(first, last)]
+
+
+def test_plan_without_checkpoints_starts_at_the_default_start():
+    checkpoints = CellCheckpoints(CheckpointsWorker([]))
+
+    tasks = checkpoints.plan("core_state_series", REGIONS, dt.date(2019, 7, 19), 14, dt.date(2019, 7, 11), 7)
+
+    assert planned(tasks) == [("2019-07-06", "2019-07-12", REGIONS), ("2019-07-13", "2019-07-19", REGIONS)]
+
+
+def test_plan_recomputes_the_last_completed_day():
+    cells = completed_cells("core_state_series", REGIONS, "2019-06-01", "2019-07-18")
+    checkpoints = CellCheckpoints(CheckpointsWorker(cells))
+
+    tasks = checkpoints.plan("core_state_series", REGIONS, dt.date(2019, 7, 19), 14, dt.date(2019, 7, 11), 7)
+
+    assert planned(tasks) == [("2019-07-18", "2019-07-19", REGIONS)]
+
+
+def test_plan_catches_up_a_lagging_region_alone():
+    cells = completed_cells("core_state_series", ("cis", "asia"), "2019-06-01", "2019-07-18") + \
+        completed_cells("core_state_series", ("latam",), "2019-06-01", "2019-06-20")
+    checkpoints = CellCheckpoints(CheckpointsWorker(cells))
+
+    tasks = checkpoints.plan("core_state_series", REGIONS, dt.date(2019, 7, 19), 14, dt.date(2019, 7, 11), 7)
+
+    assert planned(tasks) == [
+        ("2019-06-20", "2019-06-26", ("latam",)),
+        ("2019-06-27", "2019-07-03", ("latam",)),
+        ("2019-07-04", "2019-07-10", ("latam",)),
+        ("2019-07-11", "2019-07-17", ("latam",)),
+        ("2019-07-18", "2019-07-19", REGIONS),
+    ]
+
+
+def test_plan_fills_gaps_of_the_resume_window_only():
+    cells = [
+        cell for cell in completed_cells("core_state_series", REGIONS, "2019-06-01", "2019-07-18")
+        if cell[2] not in (dt.date(2019, 6, 10), dt.date(2019, 7, 10)) or cell[1] != "asia"
+    ]
+    checkpoints = CellCheckpoints(CheckpointsWorker(cells))
+
+    tasks = checkpoints.plan("core_state_series", REGIONS, dt.date(2019, 7, 19), 14, dt.date(2019, 7, 11), 7)
+
+    assert planned(tasks) == [("2019-07-10", "2019-07-10", ("asia",)), ("2019-07-18", "2019-07-19", REGIONS)]
+
+
+def test_plan_cells_splits_runs_by_regions_and_chunk_days():
+    completed = {"cis": {dt.date(2019, 7, 2)}}
+
+    tasks = plan_cells(("cis", "asia"), days("2019-07-01", "2019-07-05"), completed, 2)
+
+    assert planned(tasks) == [
+        ("2019-07-01", "2019-07-01", ("cis", "asia")),
+        ("2019-07-02", "2019-07-02", ("asia",)),
+        ("2019-07-03", "2019-07-04", ("cis", "asia")),
+        ("2019-07-05", "2019-07-05", ("cis", "asia")),
+    ]
+
+
+def test_plan_cells_of_completed_days_is_empty():
+    completed = {region: {day.date() for day in days("2019-07-01", "2019-07-05")} for region in REGIONS}
+
+    assert plan_cells(REGIONS, days("2019-07-01", "2019-07-05"), completed, 7) == []
+    assert plan_cells(REGIONS, days("2019-07-01", "2019-07-05")[:0], {}, 7) == []
+
+
+def test_failed_runs_outside_of_the_extracted_window_stay_failed(tmp_path):
+    failed = FailedCells(str(tmp_path / "failed.json"))
+
+    for day in ("2019-05-01", "2019-07-01", "2019-07-02", "2019-07-04", "2019-07-15"):
+        failed.add("core_state_series", "cis", dt.date.fromisoformat(day), "ValueError()")
+
+    runs = failed.runs("core_state_series", dt.date(2019, 7, 10), dt.date(2019, 6, 20))
+
+    assert [(region, str(days[0].date()), len(days)) for region, days in runs] == [
+        ("cis", "2019-07-01", 2), ("cis", "2019-07-04", 1)
+    ]
+    assert len(failed.cells("core_state_series")["cis"]) == 5
@@ -0,0 +1,44 @@
+# coding: utf-8
+
+import datetime as dt
+
+import pandas as pd
+
+from benchmarks.synthetic import generate
+from src.FrameEncoder import encode_frame
+from src.Merge import merge_extracts, merge_encoded, number_payments
+from src.RegionFrames import RegionFrames
+from src.StateEngine import StateEngine, REGIONS
+
+
+def test_merge_encoded_gives_the_same_states_as_the_pandas_merge():
+    logins, payments = generate(2000, today=dt.date(2019, 7, 20))
+    payments = number_payments(payments)
+    days = pd.date_range("2019-06-25", "2019-07-12")
+
+    merged = StateEngine(RegionFrames(encode_frame(merge_extracts(logins, payments), REGIONS)))
+    encoded = StateEngine(RegionFrames(merge_encoded(logins, payments, REGIONS)))
+
+    assert encoded.series(days).equals(merged.series(days))
+    assert encoded.matrix(days).equals(merged.matrix(days))
+
+    def users(engine):
+        return engine.state_table(days).sort_values(["region", "date_state", "id_user", "state"]) \
+            .reset_index(drop=True)
+
+    assert users(encoded).equals(users(merged))
+
+
+def test_merge_encoded_keeps_users_without_logins_of_the_window():
+    logins = pd.DataFrame({
+        "id_user": [1, 1, 2], "u_date_created": ["2019-07-01"] * 3, "date": ["2019-07-01", "2019-07-02", "2019-07-02"],
+        "region": ["cis", "cis", "asia"],
+    })
+    payments = number_payments(pd.DataFrame({
+        "id_user": [1, 3], "po_date": ["2019-07-02", "2019-07-03"], "region": ["cis", "latam"],
+    }))
+
+    encoded = merge_encoded(logins, payments, REGIONS)
+
+    assert sorted(encoded.ids) == [1, 2, 3]
+    assert len(encoded) == len(merge_extracts(logins, payments))
@@ -0,0 +1,47 @@
+# coding: utf-8
+
+import datetime as dt
+import logging
+
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import generate
+from src.CellCheckpoint import FailedCells
+from src.Merge import merge_encoded, number_payments
+from src.ParallelExecutor import ParallelExecutor
+from src.RegionFrames import RegionFrames
+from src.StateEngine import StateEngine, REGIONS
+
+
+KEY = ["region", "date_state", "source_state"]
+
+
+@pytest.fixture(scope="module")
+def frames():
+    logins, payments = generate(2000, today=dt.date(2019, 7, 20))
+
+    return RegionFrames(merge_encoded(logins, number_payments(payments), REGIONS))
+
+
+def test_matrix_is_the_same_as_of_the_engine(frames):
+    days = pd.date_range("2019-07-01", "2019-07-12")
+
+    with ParallelExecutor(2) as executor:
+        matrix = executor.matrix(frames, days)
+
+    expected = StateEngine(frames).matrix(days)
+
+    assert matrix.sort_values(KEY).reset_index(drop=True).equals(expected.sort_values(KEY).reset_index(drop=True))
+
+
+def test_failed_cells_are_saved_and_logged_by_the_parent(frames, tmp_path, caplog):
+    failed = FailedCells(str(tmp_path / "failed.json"))
+    day = pd.Timestamp("2019-07-01")
+
+    with caplog.at_level(logging.ERROR), ParallelExecutor(2) as executor:
+        matrix = executor.matrix_cells(frames, [("nowhere", day), ("cis", day)], failed=failed)
+
+    assert set(matrix["region"]) == {"cis"}
+    assert failed.cells("core_migration_matrix") == {"nowhere": [day.date()]}
+    assert any("Cell (nowhere, 2019-07-01) failed" in record.getMessage() for record in caplog.records)
@@ -0,0 +1,64 @@
+# coding: utf-8
+
+import threading
+import time
+
+import pytest
+
+from src.Pipeline import Pipeline
+
+
+def pipeline_threads():
+    return [thread for thread in threading.enumerate() if thread.name.startswith("pipeline-")]
+
+
+def test_items_pass_every_stage_in_order():
+    loaded = []
+
+    stats = Pipeline(range(20), [("compute", lambda x: x * 2), ("load", loaded.append)], queue_size=2).run()
+
+    assert loaded == [i * 2 for i in range(20)]
+    assert stats["source"].items == stats["compute"].items == stats["load"].items == 20
+
+
+@pytest.mark.parametrize("failed_stage", ["compute", "load"])
+def test_failure_of_a_stage_stops_the_pipeline_and_is_raised(failed_stage):
+    loaded = []
+
+    def stage(name):
+        def run(x):
+            if name == failed_stage and x == 3:
+                raise ValueError("{} failed".format(name))
+
+            time.sleep(0.001)
+            return x
+
+        return run
+
+    pipeline = Pipeline(
+        range(1000), [("compute", stage("compute")), ("load", lambda x: loaded.append(stage("load")(x)))], queue_size=2
+    )
+
+    with pytest.raises(ValueError, match="{} failed".format(failed_stage)):
+        pipeline.run()
+
+    # the source isn't read to the end and the failed item never reaches the last stage
+    assert pipeline.stats["source"].items < 1000
+    assert 3 not in loaded and len(loaded) < 1000
+    assert not pipeline_threads()
+
+
+def test_failure_of_the_source_stops_the_pipeline_and_is_raised():
+    loaded = []
+
+    def source():
+        yield from range(5)
+        raise KeyError("source failed")
+
+    pipeline = Pipeline(source(), [("compute", lambda x: x), ("load", loaded.append)], queue_size=2)
+
+    with pytest.raises(KeyError, match="source failed"):
+        pipeline.run()
+
+    assert loaded == list(range(len(loaded))) and len(loaded) <= 5
+    assert not pipeline_threads()
@@ -0,0 +1,70 @@
+# coding: utf-8
+
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import generate
+from src import StateFunctions
+from src.FrameEncoder import encode_frame
+from src.Merge import merge_extracts, number_payments
+from src.RegionFrames import RegionFrames
+from src.RollingStateEngine import RollingStateEngine
+from src.StateEngine import StateEngine, REGIONS, MATRIX_STATES
+
+
+DAYS = pd.date_range("2019-07-06", "2019-07-12")
+
+ENGINES = (StateEngine, RollingStateEngine)
+
+
+@pytest.fixture(scope="module")
+def new_df():
+    logins, payments = generate(2000, today=dt.date(2019, 7, 20))
+
+    return merge_extracts(logins, number_payments(payments))
+
+
+@pytest.fixture(scope="module")
+def frames(new_df):
+    return RegionFrames(encode_frame(new_df, REGIONS))
+
+
+def normalized(series):
+    return series.astype({"users_count": "int64"}).sort_values(["region", "date_state", "state"]) \
+        .reset_index(drop=True)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_series_are_the_same_as_of_the_reference_functions(new_df, frames, engine):
+    expected = pd.concat(
+        [StateFunctions.create_series(new_df, now, region) for region in REGIONS for now in DAYS.to_pydatetime()],
+        ignore_index=True
+    )
+
+    assert normalized(engine(frames).series(DAYS)).equals(normalized(expected))
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_matrix_is_the_same_as_of_the_reference_functions(new_df, frames, engine):
+    matrix = engine(frames).matrix(DAYS).set_index(["region", "date_state", "source_state"])
+    compared = 0
+
+    for region in REGIONS:
+        for now in DAYS.to_pydatetime():
+            for state in MATRIX_STATES:
+                row = matrix.loc[(region, str(now)[0:10], state)]
+
+                try:
+                    expected = getattr(StateFunctions, "{}_validator".format(state))(new_df, now, region).loc[state]
+                except ZeroDivisionError:
+                    # the reference can't compute an empty source state, the engine leaves its percents empty
+                    assert row.isna().all()
+                    continue
+
+                np.testing.assert_allclose(row[expected.index].astype(float), expected.astype(float))
+                compared += 1
+
+    assert compared > len(REGIONS) * len(DAYS)
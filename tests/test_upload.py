@@ -0,0 +1,95 @@
+# coding: utf-8
+
+import datetime as dt
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("bogoslovskiy")
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("psycopg2")
+
+from benchmarks.synthetic import generate
+from src.Backfill import Backfill
+from src.CellCheckpoint import CellCheckpoints
+from src.PortgesDataLoader import PostgresDataLoader
+from src.StateEngine import REGIONS
+from src.Watermark import FileWatermarkStore
+from tests.fake_postgres import FakePostgres
+
+
+TABLES = {
+    "core_state_series": (["region", "date_state", "state", "users_count"], ["region", "date_state", "state"]),
+    "core_migration_matrix": (
+        ["region", "date_state", "source_state", "active_ns", "churn_ns", "new_spenders", "active_spenders",
+         "churn_spenders", "active_users"],
+        ["region", "date_state", "source_state"],
+    ),
+    "etl_cells": (["table_name", "region", "date_state", "completed_at"], ["table_name", "region", "date_state"]),
+}
+
+
+def test_upload_batch_merges_frames_of_the_same_table_in_copy_mode():
+    postgres = FakePostgres(TABLES)
+    loader = PostgresDataLoader(postgres)
+
+    def cells(table, days):
+        return pd.DataFrame({
+            "table_name": table, "region": "cis", "date_state": days, "completed_at": dt.datetime(2019, 7, 20)
+        })
+
+    assert loader.upload_batch([
+        ("etl_cells", cells("core_state_series", ["2019-07-01", "2019-07-02"])),
+        ("etl_cells", cells("core_migration_matrix", ["2019-07-01"])),
+    ], mode="copy")
+
+    assert postgres.commits == 1 and postgres.rollbacks == 0
+    assert sorted(postgres.rows["etl_cells"]) == [
+        ("core_migration_matrix", "cis", "2019-07-01"),
+        ("core_state_series", "cis", "2019-07-01"),
+        ("core_state_series", "cis", "2019-07-02"),
+    ]
+
+
+def test_upload_batch_keeps_the_last_frame_of_a_duplicated_key():
+    postgres = FakePostgres(TABLES)
+    loader = PostgresDataLoader(postgres)
+
+    def series(count):
+        return pd.DataFrame({
+            "region": ["cis"], "date_state": ["2019-07-01"], "state": ["new_ns"], "users_count": [count]
+        })
+
+    assert loader.upload_batch([("core_state_series", series(1)), ("core_state_series", series(2))], mode="copy")
+    assert [row["users_count"] for row in postgres.rows["core_state_series"].values()] == ["2"]
+
+
+def test_backfill_partitions_are_uploaded_with_checkpoints_in_copy_mode(tmp_path):
+    logins, payments = generate(2000, today=dt.date(2019, 7, 28))
+
+    def extract(frame, column):
+        def run(since, until):
+            days = pd.to_datetime(frame[column]).dt.date
+            return frame[((days >= since) & (days < until)).values].reset_index(drop=True)
+
+        return run
+
+    postgres = FakePostgres(TABLES)
+    loader = PostgresDataLoader(postgres)
+
+    Backfill(
+        extract(logins, "date"), extract(payments, "po_date"), loader, FileWatermarkStore(str(tmp_path / "state.json")),
+        chunk_days=7, mode="copy", checkpoints=CellCheckpoints(postgres)
+    ).run(dt.date(2019, 7, 1), dt.date(2019, 7, 10))
+
+    assert postgres.commits == 2 and postgres.rollbacks == 0
+
+    days = [str(day.date()) for day in pd.date_range("2019-07-01", "2019-07-10")]
+    expected = sorted(
+        (table, region, day) for table in ("core_migration_matrix", "core_state_series") for region in REGIONS
+        for day in days
+    )
+
+    assert sorted(postgres.rows["etl_cells"]) == expected
+    assert {key[:2] for key in postgres.rows["core_state_series"]} == {(r, d) for r in REGIONS for d in days}
+    assert {key[:2] for key in postgres.rows["core_migration_matrix"]} == {(r, d) for r in REGIONS for d in days}